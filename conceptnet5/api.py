@@ -4,14 +4,25 @@ This file defines the ConceptNet web API responses.
 
 from conceptnet5 import __version__ as VERSION
 from conceptnet5.nodes import ld_node, standardized_concept_uri
-from conceptnet5.db.config import DB_NAME
+from conceptnet5.db.config import DB_NAME, GRAPH_STORE
+from conceptnet5.db.graph_store import GraphStore
 from conceptnet5.db.query import AssertionFinder
+from conceptnet5.metrics import histogram
 from conceptnet5.vectors.query import VectorSpaceWrapper
 
 VECTORS = VectorSpaceWrapper()
-FINDER = AssertionFinder(dbname=DB_NAME)
+if GRAPH_STORE:
+    FINDER = GraphStore(GRAPH_STORE)
+else:
+    FINDER = AssertionFinder(dbname=DB_NAME)
 CONTEXT = ["http://api.conceptnet.io/ld/conceptnet5.7/context.ld.json"]
-VALID_KEYS = ['rel', 'start', 'end', 'node', 'other', 'source', 'uri']
+VALID_KEYS = [
+    'rel', 'start', 'end', 'node', 'other', 'source', 'uri', 'dataset',
+    'min_weight', 'language', 'exclude_rel',
+]
+VECTOR_SECONDS = histogram(
+    'conceptnet_vector_seconds', 'Time spent searching term vectors, by operation'
+)
 
 
 def success(response):
@@ -174,6 +185,72 @@ def lookup_single_assertion(uri):
         return success(response)
 
 
+def query_neighborhood(uri, hops=2, limit=20, rel=None):
+    """
+    Find the nodes and edges within a number of hops of a node, following
+    the `limit` strongest edges of each node at each hop.
+    """
+    params = [('hops', hops), ('limit', limit)]
+    if rel is not None:
+        params.append(('rel', rel))
+    url = make_query_url('/neighborhood' + uri, params)
+    distances, edges = FINDER.neighborhood(
+        uri, hops=hops, per_hop_limit=limit, rel_filter=rel
+    )
+    response = {
+        '@id': url,
+        'nodes': [dict(ld_node(node), hops=hop) for node, hop in distances.items()],
+        'edges': edges,
+    }
+    if not edges:
+        return error(response, 404, '%r is not a node in ConceptNet.' % uri)
+    return success(response)
+
+
+def query_random_walks(uri, length=3, walks=10, rel=None):
+    """
+    Take random walks from a node, where each step follows an edge with
+    probability proportional to its weight.
+    """
+    params = [('length', length), ('walks', walks)]
+    if rel is not None:
+        params.append(('rel', rel))
+    url = make_query_url('/walks' + uri, params)
+    found = FINDER.random_walks(uri, length=length, num_walks=walks, rel_filter=rel)
+    response = {'@id': url, 'walks': found}
+    if not any(found):
+        return error(response, 404, '%r is not a node in ConceptNet.' % uri)
+    return success(response)
+
+
+def query_path(node1, node2, rels=None, max_depth=4, weighted=True):
+    """
+    Find the shortest path of edges that connects node1 to node2.
+    """
+    if node1 is None or node2 is None:
+        return error({}, 400, 'Arguments should be called node1 and node2.')
+
+    params = [('node1', node1), ('node2', node2)]
+    params.extend(('rel', rel) for rel in rels or [])
+    params.append(('max_depth', max_depth))
+    if not weighted:
+        params.append(('weighted', 'false'))
+    url = make_query_url('/path', params)
+    path = FINDER.shortest_path(
+        node1, node2, rels=rels, max_depth=max_depth, weighted=weighted
+    )
+    if path is None:
+        return error(
+            {'@id': url},
+            404,
+            "Couldn't find a path from {} to {} in {} steps or fewer.".format(
+                repr(node1), repr(node2), max_depth
+            ),
+        )
+    response = {'@id': url, 'edges': path}
+    return success(response)
+
+
 def query_relatedness(node1, node2):
     """
     Query for the similarity between node1 and node2. Return the cosine
@@ -184,7 +261,8 @@ def query_relatedness(node1, node2):
 
     url = make_query_url('/relatedness', [('node1', node1), ('node2', node2)])
     try:
-        relatedness = VECTORS.get_similarity(node1, node2)
+        with VECTOR_SECONDS.timer(operation='relatedness'):
+            relatedness = VECTORS.get_similarity(node1, node2)
         response = {'@id': url, 'value': round(float(relatedness), 3)}
         return success(response)
     except ValueError:
@@ -225,7 +303,8 @@ def query_related(uri, filter=None, limit=20):
             '%r is not something that I can find related terms to.' % uri,
         )
 
-    found = VECTORS.similar_terms(query, filter=filter, limit=limit)
+    with VECTOR_SECONDS.timer(operation='related'):
+        found = VECTORS.similar_terms(query, filter=filter, limit=limit)
     related = [
         {'@id': key, 'weight': round(float(weight), 3)}
         for (key, weight) in found.items()
@@ -234,6 +313,19 @@ def query_related(uri, filter=None, limit=20):
     return response
 
 
+def criteria_problem(query):
+    """
+    Check the values of query criteria that have to be in a particular form,
+    returning a description of the problem if there is one.
+    """
+    if 'min_weight' in query:
+        try:
+            float(query['min_weight'])
+        except ValueError:
+            return "'min_weight' should be a number."
+    return None
+
+
 def query_paginated(query, offset=0, limit=50):
     """
     Search ConceptNet for edges matching a query.
@@ -241,9 +333,13 @@ def query_paginated(query, offset=0, limit=50):
     The query should be provided as a dictionary of criteria. The `query`
     function in the `.api` module constructs such a dictionary.
     """
+    url = make_query_url('/query', query.items())
+    problem = criteria_problem(query)
+    if problem:
+        return error({'@id': url, 'edges': []}, 400, problem)
     found = FINDER.query(query, limit=limit + 1, offset=offset)
     edges = found[:limit]
-    response = {'@id': make_query_url('/query', query.items()), 'edges': edges}
+    response = {'@id': url, 'edges': edges}
     more = len(found) > len(edges)
     if len(found) > len(edges) or offset != 0:
         response['view'] = make_paginated_view(
@@ -252,6 +348,20 @@ def query_paginated(query, offset=0, limit=50):
     return success(response)
 
 
+def query_stream(query):
+    """
+    Get all the edges matching a query, as an iterator instead of a page of
+    results. Returns the iterator, or an error response if the query can't
+    be run.
+    """
+    if not query:
+        return error({}, 400, 'Exporting edges requires at least one criterion.')
+    problem = criteria_problem(query)
+    if problem:
+        return error({}, 400, problem)
+    return FINDER.stream_query(query)
+
+
 def standardize_uri(language, text):
     """
     Look up the URI for a given piece of text.
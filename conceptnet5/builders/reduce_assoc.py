@@ -3,13 +3,18 @@ Implements the `reduce_assoc` builder, which filters a tab-separated list of
 associations.
 """
 
+from array import array
 from collections import defaultdict
 
+import numpy as np
 import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
 
 from conceptnet5.relations import is_negative_relation
 from conceptnet5.uri import is_concept, uri_prefix
-from conceptnet5.vectors.formats import load_hdf
+from conceptnet5.vectors.formats import load_index
+from conceptnet5.vectors.interning import Interner
 
 
 def concept_is_bad(uri):
@@ -31,21 +36,61 @@ def concept_is_bad(uri):
 class ConceptNetAssociationGraph:
     '''
     Class to hold the concept-association edge graph.
+
+    Vertices are interned as integer IDs, and edges are stored as two arrays
+    of the IDs of their endpoints.
     '''
 
     def __init__(self):
         '''Construct a graph with no vertices or edges.'''
-        self.vertex_to_neighbors = defaultdict(set)
+        self.vertex_ids = Interner()
+        self.edge_left = array('i')
+        self.edge_right = array('i')
 
     def add_edge(self, left, right, value, dataset, relation):
         '''Insert an edge in the graph.'''
-        self.vertex_to_neighbors[left].add(right)
-        self.vertex_to_neighbors[right].add(left)
+        self.edge_left.append(self.vertex_ids.add(left))
+        self.edge_right.append(self.vertex_ids.add(right))
         return
 
     def vertices(self):
         '''Returns an iterator over the vertices of the graph.'''
-        return self.vertex_to_neighbors.keys()
+        return iter(self.vertex_ids)
+
+    def edge_ids(self):
+        '''
+        Returns the IDs of the left and right ends of the edges, as two
+        NumPy arrays.
+        '''
+        return (
+            np.frombuffer(self.edge_left, dtype=np.intc),
+            np.frombuffer(self.edge_right, dtype=np.intc),
+        )
+
+    def adjacency_matrix(self):
+        '''
+        Returns the adjacency matrix of the undirected graph obtained by
+        adding the reversal of every edge, as a boolean CSR matrix whose rows
+        and columns are numbered by vertex ID.
+        '''
+        left, right = self.edge_ids()
+        n = len(self.vertex_ids)
+        rows = np.concatenate([left, right])
+        cols = np.concatenate([right, left])
+        return sparse.coo_matrix(
+            (np.ones(len(rows), dtype=bool), (rows, cols)), shape=(n, n)
+        ).tocsr()
+
+    def component_labels(self):
+        '''
+        Returns a NumPy array of the labels of the connected components
+        of the undirected graph obtained by adding the reversal of every
+        edge, indexed by vertex ID.
+        '''
+        _n_components, labels = connected_components(
+            self.adjacency_matrix(), directed=False
+        )
+        return labels
 
     def find_components(self):
         '''
@@ -56,26 +101,20 @@ class ConceptNetAssociationGraph:
         graph.  (But note that this function does not modify the graph,
         i.e. it does not add any edges.)
         '''
+        return dict(zip(self.vertices(), self.component_labels().tolist()))
 
-        component_labels = {vertex: -1 for vertex in self.vertices()}
-        vertices_to_examine = set(self.vertices())
-        new_label = -1
-        while len(vertices_to_examine) > 0:
-            new_label += 1
-            vertex = vertices_to_examine.pop()
-            assert component_labels[vertex] == -1
-            stack = [vertex]
-            component_labels[vertex] = new_label
-            while len(stack) > 0:
-                v = stack.pop()
-                for neighbor in self.vertex_to_neighbors[v]:
-                    if component_labels[neighbor] != new_label:
-                        assert component_labels[neighbor] == -1
-                        component_labels[neighbor] = new_label
-                        vertices_to_examine.discard(neighbor)
-                        stack.append(neighbor)
-
-        return component_labels
+    def good_vertices(self, vocab):
+        '''
+        Returns a boolean NumPy array, indexed by vertex ID, of whether each
+        vertex is in a connected component that contains a term from the
+        given vocabulary.
+        '''
+        component_labels = self.component_labels()
+        vocab_ids = self.vertex_ids.ids_of(vocab)
+        vocab_ids = vocab_ids[vocab_ids >= 0]
+        good_components = np.zeros(component_labels.max(initial=-1) + 1, dtype=bool)
+        good_components[component_labels[vocab_ids]] = True
+        return good_components[component_labels]
 
     @classmethod
     def from_csv(cls, filename, filtered_concepts=None, reject_negative_relations=True):
@@ -130,15 +169,27 @@ class ConceptNetAssociationGraphForReduction(ConceptNetAssociationGraph):
 
     def __init__(self):
         super().__init__()
-        self.edges = []
+        self.edge_data_ids = Interner()
+        self.edge_data = array('i')
 
     def add_edge(self, left, right, value, dataset, relation):
         """
         In addition to the superclass's handling of a new edge,
-        saves the full edge data.
+        saves the full edge data.  The (value, dataset, relation) triples
+        take few distinct values, so they are interned as well.
         """
         super().add_edge(left, right, value, dataset, relation)
-        self.edges.append((left, right, value, dataset, relation))
+        self.edge_data.append(self.edge_data_ids.add((value, dataset, relation)))
+
+    def edges(self):
+        """
+        Iterates over the full data of the edges, as (left, right, value,
+        dataset, relation) tuples, in the order they were added.
+        """
+        vertices = list(self.vertex_ids)
+        edge_data = list(self.edge_data_ids)
+        for left, right, data in zip(self.edge_left, self.edge_right, self.edge_data):
+            yield (vertices[left], vertices[right]) + edge_data[data]
 
 
 def make_filtered_concepts(filename, cutoff=3, en_cutoff=3):
@@ -177,12 +228,11 @@ def read_embedding_vocabularies(filenames):
     Reads every vector embedding file in the given collection of
     filenames, and returns the union of their vocabularies.  (The
     files are assumed to be hdf5 files containing dataframes, and
-    the vocabularies are their indices.
+    the vocabularies are their indices, which are all we load.)
     """
     result = pd.Index([])
     for filename in filenames:
-        vectors = load_hdf(filename)
-        result = result.union(vectors.index)
+        result = result.union(load_index(filename))
     return result
 
 
@@ -211,24 +261,17 @@ def reduce_assoc(
         reject_negative_relations=True,
     )
 
-    component_labels = graph.find_components()
-
     embedding_vocab = read_embedding_vocabularies(embedding_filenames)
 
     # If a connected component of the conceptnet graph contains no terms
     # from any of the embedding vocabularies, there will be no way to assign
     # vectors to any of its vertices, so we remove that component from the
     # output.
-
-    good_component_labels = set(
-        label for term, label in component_labels.items() if term in embedding_vocab
-    )
+    good_vertices = graph.good_vertices(embedding_vocab)
+    left, right = graph.edge_ids()
+    good_edges = good_vertices[left] & good_vertices[right]
 
     with open(output_filename, 'w', encoding='utf-8') as out:
-        for gleft, gright, value, dataset, rel in graph.edges:
-            if component_labels[gleft] not in good_component_labels:
-                continue
-            if component_labels[gright] not in good_component_labels:
-                continue
-            line = '\t'.join([gleft, gright, value, dataset, rel])
-            print(line, file=out)
+        for edge, is_good in zip(graph.edges(), good_edges):
+            if is_good:
+                print('\t'.join(edge), file=out)
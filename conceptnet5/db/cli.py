@@ -1,8 +1,13 @@
+import time
+
 import click
 
 from .connection import check_db_connection, get_db_connection
+from .delta import load_assertion_delta
+from .graph_store import build_graph_store
+from .query import NODE_TO_FEATURE_QUERY, AssertionFinder, prepared_statement
 from .prepare_data import assertions_to_sql_csv, load_sql_csv
-from .schema import create_indices, create_tables
+from .schema import create_indices, create_tables, mark_build
 
 
 @click.group()
@@ -15,8 +20,12 @@ def cli():
 @click.argument(
     'output_dir', type=click.Path(writable=True, dir_okay=True, file_okay=False)
 )
-def prepare_data(input_filename, output_dir):
-    assertions_to_sql_csv(input_filename, output_dir)
+@click.option(
+    '--linked-data', is_flag=True,
+    help='Also store each edge in the JSON-LD form that the API returns'
+)
+def prepare_data(input_filename, output_dir, linked_data):
+    assertions_to_sql_csv(input_filename, output_dir, linked_data=linked_data)
 
 
 @cli.command(name='load_data')
@@ -29,9 +38,125 @@ def load_data(input_dir):
     create_tables(conn)
     load_sql_csv(conn, input_dir)
     create_indices(conn)
+    with conn.cursor() as cursor:
+        mark_build(cursor)
     conn.close()
 
 
+@cli.command(name='build_graph_store')
+@click.argument('input_filename', type=click.Path(readable=True, dir_okay=False))
+@click.argument('output_filename', type=click.Path(writable=True, dir_okay=False))
+@click.option(
+    '--top-k', type=int, default=None,
+    help='The maximum number of edges to store for each feature'
+)
+def run_build_graph_store(input_filename, output_filename, top_k):
+    """
+    Build a single-file graph store that can be queried without PostgreSQL.
+    """
+    build_graph_store(input_filename, output_filename, top_k=top_k)
+
+
+@cli.command(name='load_delta')
+@click.argument('input_filename', type=click.Path(readable=True, dir_okay=False))
+def load_delta(input_filename):
+    """
+    Update the loaded database to match a new file of assertions, without
+    rebuilding it.
+    """
+    conn = get_db_connection()
+    counts = load_assertion_delta(conn, input_filename)
+    click.echo(
+        'Added {added}, updated {updated}, and removed {removed} assertions.'.format(
+            **counts
+        )
+    )
+
+
 @cli.command(name='check')
 def run_check_db_connection():
     check_db_connection()
+
+
+def feature_query_planning_time(finder, uri):
+    """
+    Get the planning time, in milliseconds, that Postgres reports for the
+    query behind `lookup_grouped_by_feature`.
+    """
+    params = {'node': uri, 'limit': 21}
+    cursor = finder.connection.cursor()
+    if finder.prepare:
+        # Make sure the statement is prepared, and explain its EXECUTE
+        finder._execute(cursor, NODE_TO_FEATURE_QUERY, params, 'feature')
+        cursor.fetchall()
+        statement = prepared_statement(NODE_TO_FEATURE_QUERY)[1]
+    else:
+        statement = NODE_TO_FEATURE_QUERY
+    cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + statement, params)
+    return cursor.fetchone()[0][0]['Planning Time']
+
+
+# Postgres may switch a prepared statement to a generic plan after it has run
+# this many times, so we time the executions before and after it separately
+CUSTOM_PLAN_EXECUTIONS = 5
+
+
+def gin_query_times(finder, uris, repeat):
+    """
+    Time `repeat` executions of queries that use the GIN index, for each
+    URI. Returns a list with the times, in milliseconds, of the first
+    executions, then of the second executions, and so on.
+    """
+    times = [[] for _ in range(repeat)]
+    for uri in uris:
+        for criteria in [{'other': uri}, {'node': uri, 'dataset': '/d/wiktionary'}]:
+            for execution in range(repeat):
+                start = time.perf_counter()
+                finder.query(criteria)
+                times[execution].append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def mean_time(times):
+    millis = [ms for execution_times in times for ms in execution_times]
+    return sum(millis) / len(millis)
+
+
+@cli.command(name='benchmark')
+@click.argument('uris', nargs=-1, required=True)
+@click.option('--repeat', '-n', default=100, help='How many times to look up each URI')
+def benchmark(uris, repeat):
+    """
+    Compare how long it takes to look up concept URIs with and without
+    prepared statements, including the time Postgres spends planning, and
+    how long queries that use the GIN index take as they're repeated.
+    """
+    for prepare in [False, True]:
+        finder = AssertionFinder(prepare=prepare)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for uri in uris:
+                finder.lookup(uri)
+                finder.lookup_grouped_by_feature(uri)
+        elapsed = time.perf_counter() - start
+        planning = sum(
+            feature_query_planning_time(finder, uri) for uri in uris for _ in range(repeat)
+        )
+        count = repeat * len(uris)
+        click.echo(
+            'prepare={}: {:.3f} ms per URI, {:.3f} ms planning per feature query'.format(
+                prepare, elapsed * 1000 / count, planning / count
+            )
+        )
+
+        # A change of plan shows up as a change in the time GIN queries take
+        gin_times = gin_query_times(finder, uris, repeat)
+        first = min(repeat, CUSTOM_PLAN_EXECUTIONS)
+        message = 'prepare={}: GIN queries take {:.3f} ms in their first {} executions'.format(
+            prepare, mean_time(gin_times[:first]), first
+        )
+        if repeat > CUSTOM_PLAN_EXECUTIONS:
+            message += ', {:.3f} ms after that'.format(
+                mean_time(gin_times[CUSTOM_PLAN_EXECUTIONS:])
+            )
+        click.echo(message)
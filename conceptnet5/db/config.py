@@ -7,6 +7,11 @@ environment variables:
     CONCEPTNET_DB_HOSTNAME - the host to connect to (default "localhost")
     CONCEPTNET_DB_PORT - the port number to connect to (default 5432)
     CONCEPTNET_DB_NAME - the database name to use (default "conceptnet5")
+
+Alternatively, the API can read assertions from a file built by
+`cn5-db build_graph_store`, without a database:
+
+    CONCEPTNET_GRAPH_STORE - the filename of the graph store to use
 """
 import os
 
@@ -17,3 +22,5 @@ DB_USERNAME = os.environ.get('CONCEPTNET_DB_USER', os.environ.get('USER', 'postg
 DB_PASSWORD = os.environ.get('CONCEPTNET_DB_PASSWORD', '')
 DB_HOSTNAME = os.environ.get('CONCEPTNET_DB_HOSTNAME', 'localhost')
 DB_PORT = int(os.environ.get('CONCEPTNET_DB_PORT', '5432'))
+
+GRAPH_STORE = os.environ.get('CONCEPTNET_GRAPH_STORE')
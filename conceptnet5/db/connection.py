@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+
 import psycopg2
 
 from conceptnet5.db import config
@@ -13,7 +15,7 @@ def get_db_connection(dbname=None):
     """
     if dbname is None:
         dbname = config.DB_NAME
-    if dbname in _CONNECTIONS:
+    if dbname in _CONNECTIONS and not _CONNECTIONS[dbname].closed:
         return _CONNECTIONS[dbname]
     else:
         _CONNECTIONS[dbname] = _get_db_connection_inner(dbname)
@@ -37,6 +39,22 @@ def _get_db_connection_inner(dbname):
     return conn
 
 
+@contextmanager
+def separate_connection(dbname=None):
+    """
+    Open a new connection to the database that isn't shared with the rest
+    of the process, for queries that stay open for a long time, and close
+    it at the end of the `with` block.
+    """
+    if dbname is None:
+        dbname = config.DB_NAME
+    conn = _get_db_connection_inner(dbname)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
 def check_db_connection(dbname=None):
     """
     Raise an error early if we can't access the database. This is intended
@@ -49,3 +67,22 @@ def check_db_connection(dbname=None):
     if dbname is None:
         dbname = config.DB_NAME
     _get_db_connection_inner(dbname)
+
+
+@contextmanager
+def transaction(connection):
+    """
+    Run the statements in a `with` block as a single transaction, which is
+    committed at the end of the block or rolled back if there's an error.
+
+    Our connections are in autocommit mode, where psycopg2's own `with
+    connection:` block doesn't start a transaction, so we switch autocommit
+    off for the duration of the block.
+    """
+    autocommit = connection.autocommit
+    connection.autocommit = False
+    try:
+        with connection:
+            yield
+    finally:
+        connection.autocommit = autocommit
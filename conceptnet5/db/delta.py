@@ -0,0 +1,218 @@
+"""
+Update a ConceptNet database that's already loaded, instead of rebuilding it,
+by applying the differences between a new file of combined assertions and
+the assertions that are in the database.
+
+Assertions are matched up by their URI. An assertion whose data has changed
+is replaced, keeping its edge ID, and the IDs of existing nodes, relations,
+and sources stay the same. New edges and URIs are numbered after the
+largest existing IDs.
+"""
+import io
+import json
+import tempfile
+
+from ordered_set import OrderedSet
+
+from conceptnet5.formats.msgpack_stream import read_msgpack_stream
+from conceptnet5.relations import SYMMETRIC_RELATIONS
+
+from .connection import transaction
+from .prepare_data import ASSERTION_TABLES, assertion_rows, write_row
+from .schema import features_of_edges, mark_build, refresh_ranked_features_in_transaction
+
+
+class DatabaseIDs(object):
+    """
+    Assigns IDs to URIs in one of the tables of unique IDs (`nodes`,
+    `sources`, or `relations`), keeping the IDs that are already in the
+    database, and numbering new URIs after the largest existing ID.
+
+    Like an OrderedSet, its `add` method returns the ID of a URI, so it can
+    be passed to `assertion_rows`. Call `prefetch` first with all the URIs
+    you'll need, so that they can be looked up in one query.
+    """
+
+    def __init__(self, cursor, tablename):
+        self.cursor = cursor
+        self.tablename = tablename
+        self.ids = {}
+        self.new_items = []
+        cursor.execute('SELECT COALESCE(MAX(id), -1) FROM {}'.format(tablename))
+        self.next_id = cursor.fetchone()[0] + 1
+
+    def prefetch(self, uris):
+        self.cursor.execute(
+            'SELECT uri, id FROM {} WHERE uri = ANY(%(uris)s::text[])'.format(
+                self.tablename
+            ),
+            {'uris': sorted(set(uris) - set(self.ids))},
+        )
+        self.ids.update(self.cursor.fetchall())
+
+    def add(self, uri):
+        if uri not in self.ids:
+            self.ids[uri] = self.next_id
+            self.new_items.append((self.next_id, uri))
+            self.next_id += 1
+        return self.ids[uri]
+
+
+def copy_rows(cursor, tablename, rows):
+    """
+    Add rows to a table using COPY, in the same format that `prepare_data`
+    writes to its CSV files.
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        write_row(buffer, row)
+    buffer.seek(0)
+    cursor.copy_from(buffer, tablename)
+
+
+def stage_assertions(cursor, msgpack_filename):
+    """
+    Load the URI and data of every assertion in the file into a temporary
+    table, `delta_edges`, so we can compare it to the `edges` table.
+    """
+    cursor.execute(
+        "CREATE TEMPORARY TABLE delta_edges (uri text NOT NULL, data jsonb NOT NULL) "
+        "ON COMMIT DROP"
+    )
+    with tempfile.TemporaryFile('w+', encoding='utf-8') as tmp:
+        for assertion in read_msgpack_stream(msgpack_filename):
+            jsondata = json.dumps(assertion, ensure_ascii=False, sort_keys=True)
+            write_row(tmp, [assertion['uri'], jsondata])
+        tmp.seek(0)
+        cursor.copy_from(tmp, 'delta_edges', columns=('uri', 'data'))
+
+    # Assertions are supposed to be unique, so this will fail if they're not
+    cursor.execute("CREATE UNIQUE INDEX delta_edges_uri ON delta_edges (uri)")
+    cursor.execute("ANALYZE delta_edges")
+
+
+def load_assertion_delta(connection, msgpack_filename):
+    """
+    Make the assertions in the database match the assertions in the given
+    msgpack file, by inserting new assertions, replacing assertions whose
+    data has changed, and removing assertions that aren't in the file. The
+    edges are compared by their JSONB data, which serves as a hash of their
+    contents.
+
+    All of the tables that are built from assertions are updated, and only
+    the features that contain changed edges are re-ranked. Everything
+    happens in one transaction, so a failed update leaves the database as
+    it was. The database gets a new build version (see `mark_build`), so
+    that the web server's ETags change with the data.
+
+    Returns a dictionary with the number of assertions that were 'added',
+    'updated', and 'removed'.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            # Keep storing the linked-data form of edges if the database has it
+            cursor.execute("SELECT ld_data IS NOT NULL FROM edges LIMIT 1")
+            row = cursor.fetchone()
+            linked_data = bool(row and row[0])
+
+            cursor.execute("SELECT COALESCE(MAX(id), -1) FROM edges")
+            next_edge_id = cursor.fetchone()[0] + 1
+
+            stage_assertions(cursor, msgpack_filename)
+            cursor.execute(
+                "SELECT e.id FROM edges e WHERE NOT EXISTS "
+                "(SELECT 1 FROM delta_edges d WHERE d.uri = e.uri)"
+            )
+            removed_ids = [edge_id for (edge_id,) in cursor.fetchall()]
+            cursor.execute(
+                "SELECT e.uri, e.id FROM edges e, delta_edges d "
+                "WHERE d.uri = e.uri AND d.data <> e.data"
+            )
+            changed_ids = dict(cursor.fetchall())
+            cursor.execute(
+                "SELECT d.uri FROM delta_edges d WHERE NOT EXISTS "
+                "(SELECT 1 FROM edges e WHERE e.uri = d.uri)"
+            )
+            added_uris = {uri for (uri,) in cursor.fetchall()}
+
+            # Remove the old versions of changed edges, along with removed
+            # edges, from every table built from assertions. We need to know
+            # their features first, to re-rank them.
+            old_edge_ids = removed_ids + sorted(changed_ids.values())
+            features = features_of_edges(connection, old_edge_ids)
+            for tablename in ['edges_gin', 'edge_features', 'edge_nodes', 'edge_sources']:
+                cursor.execute(
+                    "DELETE FROM {} WHERE edge_id = ANY(%(edge_ids)s::integer[])".format(
+                        tablename
+                    ),
+                    {'edge_ids': old_edge_ids},
+                )
+            cursor.execute(
+                "DELETE FROM edges WHERE id = ANY(%(edge_ids)s::integer[])",
+                {'edge_ids': old_edge_ids},
+            )
+
+            # Get the new and changed assertions, which we expect to be a small
+            # part of the file
+            assertions = [
+                assertion
+                for assertion in read_msgpack_stream(msgpack_filename)
+                if assertion['uri'] in added_uris or assertion['uri'] in changed_ids
+            ]
+
+            # Find out which URIs these assertions refer to, so we can look up
+            # the existing IDs of all of them at once
+            node_list = DatabaseIDs(cursor, 'nodes')
+            relation_list = DatabaseIDs(cursor, 'relations')
+            source_list = DatabaseIDs(cursor, 'sources')
+            referenced = [OrderedSet(), OrderedSet(), OrderedSet()]
+            for assertion in assertions:
+                assertion_rows(assertion, 0, *referenced)
+            for id_list, uris in zip([node_list, relation_list, source_list], referenced):
+                id_list.prefetch(uris)
+
+            new_rows = {tablename: [] for tablename in ASSERTION_TABLES}
+            for assertion in assertions:
+                uri = assertion['uri']
+                if uri in changed_ids:
+                    assertion_idx = changed_ids[uri]
+                else:
+                    assertion_idx = next_edge_id
+                    next_edge_id += 1
+                rows = assertion_rows(
+                    assertion,
+                    assertion_idx,
+                    node_list,
+                    relation_list,
+                    source_list,
+                    linked_data=linked_data,
+                )
+                for tablename, table_rows in rows.items():
+                    new_rows[tablename].extend(table_rows)
+
+            # Add the new URIs before the edges that refer to them
+            copy_rows(
+                cursor,
+                'relations',
+                [
+                    (idx, rel, 'f' if rel in SYMMETRIC_RELATIONS else 't')
+                    for (idx, rel) in relation_list.new_items
+                ],
+            )
+            copy_rows(cursor, 'nodes', node_list.new_items)
+            copy_rows(cursor, 'sources', source_list.new_items)
+            for tablename in ASSERTION_TABLES:
+                copy_rows(cursor, tablename, new_rows[tablename])
+
+            features.update(
+                (rel_id, direction, node_id)
+                for (rel_id, direction, node_id, _edge_id) in new_rows['edge_features']
+            )
+            refresh_ranked_features_in_transaction(cursor, features)
+            mark_build(cursor)
+
+    return {
+        'added': len(added_uris),
+        'updated': len(changed_ids),
+        'removed': len(removed_ids),
+    }
@@ -0,0 +1,495 @@
+"""
+A read-only store of ConceptNet assertions in a single file, which can answer
+the same lookups as `AssertionFinder` without a PostgreSQL database. The file
+is memory-mapped, so separate processes that open it share its pages.
+
+The file contains:
+
+- A trie of the URIs of nodes, relations, datasets, and sources (and their
+  prefixes), which assigns each one an integer 'key ID', and a trie of
+  assertion URIs
+- The Linked Data JSON of every edge, in one blob indexed by offsets. Edges
+  are numbered in order of descending weight, so any sorted list of edge IDs
+  is also sorted by weight.
+- The weight, relation, and start and end terms of every edge, which make
+  up the graph that `shortest_path` searches
+- Adjacency lists in CSR form, from key IDs to the edges whose start, end,
+  relation, dataset, or sources have that URI as a prefix
+- The edges of each feature (a node prefix, a relation, and a direction),
+  which are the same lists that the `ranked_features` table contains
+"""
+import json
+import mmap
+import random
+import struct
+import tempfile
+from array import array
+
+import marisa_trie
+import numpy as np
+from ftfy.fixes import remove_control_chars
+
+from conceptnet5.edges import transform_for_linked_data
+from conceptnet5.formats.msgpack_stream import read_msgpack_stream
+from conceptnet5.relations import SYMMETRIC_RELATIONS
+from conceptnet5.uri import uri_prefix, uri_prefixes
+
+from .paths import NodeGraph
+from .query import AssertionFinder, with_other_node
+
+MAGIC = b'CN5GRAPH'
+FORMAT_VERSION = 2
+
+# The CSR indexes of edges, and the function that gets the URIs that each
+# edge is indexed under. These are the same prefixes that the `edges_gin`
+# table matches.
+INDEXES = {
+    'start': lambda edge: uri_prefixes(edge['start']),
+    'end': lambda edge: uri_prefixes(edge['end']),
+    'rel': lambda edge: uri_prefixes(edge['rel']),
+    'dataset': lambda edge: uri_prefixes(edge['dataset']),
+    'sources': lambda edge: sorted({
+        prefix
+        for source in edge['sources']
+        for value in source.values()
+        for prefix in uri_prefixes(value, min_pieces=3)
+    }),
+}
+
+# Criteria that are matched against one of the indexes. 'node' and 'other'
+# are handled separately, because they can match either end of an edge.
+CRITERIA_INDEXES = {
+    'start': 'start',
+    'end': 'end',
+    'rel': 'rel',
+    'dataset': 'dataset',
+    'source': 'sources',
+    'sources': 'sources',
+}
+
+
+def edge_features(edge):
+    """
+    Get the (node prefix, direction) pairs of the features that an edge
+    belongs to, in the same way as the `edge_features` table.
+    """
+    start_prefixes = uri_prefixes(edge['start'], 3)
+    end_prefixes = uri_prefixes(edge['end'], 3)
+    if edge['rel'] in SYMMETRIC_RELATIONS:
+        return [(prefix, 0) for prefix in start_prefixes + end_prefixes]
+    else:
+        return [(prefix, 1) for prefix in start_prefixes] + [
+            (prefix, -1) for prefix in end_prefixes
+        ]
+
+
+def build_csr(keys, values, nkeys):
+    """
+    Given parallel arrays of keys and values, make a compressed sparse row
+    index: an array of offsets, so that the values for key `k` are
+    `sorted_values[offsets[k]:offsets[k + 1]]`, in ascending order.
+    """
+    order = np.lexsort((values, keys))
+    sorted_values = values[order]
+    counts = np.bincount(keys, minlength=nkeys)
+    offsets = np.zeros(nkeys + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, sorted_values.astype(np.int32)
+
+
+def build_graph_store(msgpack_filename, output_filename, top_k=None):
+    """
+    Build a graph store file from a msgpack file of assertions.
+
+    `top_k`, if given, limits how many edges are stored for each feature,
+    which is how many `lookup_grouped_by_feature` can return.
+    """
+    # First pass: find all the URIs we need to look up, and the weights
+    uris = set()
+    assertion_uris = []
+    weights = array('f')
+    for edge in read_msgpack_stream(msgpack_filename):
+        assertion_uris.append(edge['uri'])
+        weights.append(edge['weight'])
+        for get_uris in INDEXES.values():
+            uris.update(get_uris(edge))
+        uris.update(prefix for (prefix, _direction) in edge_features(edge))
+    trie = marisa_trie.Trie(uris)
+    del uris
+    assertion_trie = marisa_trie.Trie(assertion_uris)
+    nkeys = len(trie)
+    nedges = len(assertion_uris)
+
+    # Number the edges in order of descending weight, breaking ties by their
+    # order in the file
+    weights = np.frombuffer(weights, dtype=np.float32)
+    by_weight = np.lexsort((np.arange(nedges), -weights))
+    edge_id_of = np.empty(nedges, dtype=np.int32)
+    edge_id_of[by_weight] = np.arange(nedges, dtype=np.int32)
+
+    assertion_edge = np.empty(len(assertion_trie), dtype=np.int32)
+    for i, uri in enumerate(assertion_uris):
+        assertion_edge[assertion_trie.key_id(uri)] = edge_id_of[i]
+    del assertion_uris
+
+    # Second pass: write the Linked Data form of each edge to the blob, and
+    # collect the contents of the indexes
+    index_keys = {name: array('i') for name in INDEXES}
+    index_edges = {name: array('i') for name in INDEXES}
+    feature_nodes = array('i')
+    feature_directions = array('b')
+    feature_rels = array('i')
+    feature_edges = array('i')
+    edge_start = np.zeros(nedges, dtype=np.int64)
+    edge_length = np.zeros(nedges, dtype=np.int32)
+    edge_start_term = np.zeros(nedges, dtype=np.int32)
+    edge_end_term = np.zeros(nedges, dtype=np.int32)
+    edge_rel = np.zeros(nedges, dtype=np.int32)
+
+    blob = tempfile.TemporaryFile()
+    position = 0
+    for i, edge in enumerate(read_msgpack_stream(msgpack_filename)):
+        edge_id = int(edge_id_of[i])
+        for name, get_uris in INDEXES.items():
+            for uri in get_uris(edge):
+                index_keys[name].append(trie.key_id(uri))
+                index_edges[name].append(edge_id)
+        rel_key = trie.key_id(edge['rel'])
+        edge_start_term[edge_id] = trie.key_id(uri_prefix(edge['start']))
+        edge_end_term[edge_id] = trie.key_id(uri_prefix(edge['end']))
+        edge_rel[edge_id] = rel_key
+        for prefix, direction in edge_features(edge):
+            feature_nodes.append(trie.key_id(prefix))
+            feature_directions.append(direction)
+            feature_rels.append(rel_key)
+            feature_edges.append(edge_id)
+
+        encoded = json.dumps(
+            transform_for_linked_data(edge), ensure_ascii=False, sort_keys=True
+        ).encode('utf-8')
+        blob.write(encoded)
+        edge_start[edge_id] = position
+        edge_length[edge_id] = len(encoded)
+        position += len(encoded)
+
+    sections = {
+        'trie': np.frombuffer(trie.tobytes(), dtype=np.uint8),
+        'assertion_trie': np.frombuffer(assertion_trie.tobytes(), dtype=np.uint8),
+        'assertion_edge': assertion_edge,
+        'edge_start': edge_start,
+        'edge_length': edge_length,
+        'edge_start_term': edge_start_term,
+        'edge_end_term': edge_end_term,
+        'edge_rel': edge_rel,
+        'edge_weight': weights[by_weight],
+    }
+    for name in INDEXES:
+        offsets, values = build_csr(
+            np.frombuffer(index_keys[name], dtype=np.int32),
+            np.frombuffer(index_edges[name], dtype=np.int32),
+            nkeys,
+        )
+        sections[name + '_offsets'] = offsets
+        sections[name + '_edges'] = values
+    del index_keys, index_edges
+
+    sections.update(
+        build_feature_lists(
+            np.frombuffer(feature_nodes, dtype=np.int32),
+            np.frombuffer(feature_directions, dtype=np.int8),
+            np.frombuffer(feature_rels, dtype=np.int32),
+            np.frombuffer(feature_edges, dtype=np.int32),
+            nkeys,
+            top_k,
+        )
+    )
+
+    blob.seek(0)
+    write_sections(output_filename, sections, blob, position)
+    blob.close()
+
+
+def build_feature_lists(nodes, directions, rels, edges, nkeys, top_k=None):
+    """
+    Group the (node, direction, relation, edge) rows of the features by
+    feature, with the edges of each feature in order of descending weight
+    (which is ascending edge ID), keeping at most `top_k` edges per feature.
+    """
+    order = np.lexsort((edges, rels, directions, nodes))
+    nodes = nodes[order]
+    directions = directions[order]
+    rels = rels[order]
+    edges = edges[order]
+
+    is_first = np.ones(len(nodes), dtype=bool)
+    is_first[1:] = (
+        (nodes[1:] != nodes[:-1])
+        | (directions[1:] != directions[:-1])
+        | (rels[1:] != rels[:-1])
+    )
+    first_rows = np.flatnonzero(is_first)
+    if top_k is not None:
+        group_ids = np.cumsum(is_first) - 1
+        ranks = np.arange(len(nodes)) - first_rows[group_ids]
+        keep = ranks < top_k
+        is_first = is_first[keep]
+        nodes, directions, rels, edges = (
+            nodes[keep], directions[keep], rels[keep], edges[keep]
+        )
+        first_rows = np.flatnonzero(is_first)
+
+    feature_offsets = np.append(first_rows, len(nodes)).astype(np.int64)
+    feature_nodes = nodes[first_rows]
+    node_feature_offsets = np.zeros(nkeys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(feature_nodes, minlength=nkeys), out=node_feature_offsets[1:])
+    return {
+        'feature_direction': directions[first_rows],
+        'feature_rel': rels[first_rows],
+        'feature_offsets': feature_offsets,
+        'feature_edges': edges.astype(np.int32),
+        'node_feature_offsets': node_feature_offsets,
+    }
+
+
+def _aligned(position, alignment=8):
+    return (position + alignment - 1) // alignment * alignment
+
+
+def write_sections(output_filename, sections, blob, blob_size):
+    """
+    Write the arrays in `sections`, followed by the edge blob, to a single
+    file. The file starts with a magic string, the length of a JSON header,
+    and the header, which gives the position, type, and length of each
+    section relative to the end of the header.
+    """
+    header = {'version': FORMAT_VERSION, 'sections': {}}
+    position = 0
+    for name, arr in sections.items():
+        header['sections'][name] = [position, arr.dtype.str, len(arr)]
+        position = _aligned(position + arr.nbytes)
+    header['sections']['blob'] = [position, '|u1', blob_size]
+    header_bytes = json.dumps(header).encode('utf-8')
+
+    with open(output_filename, 'wb') as out:
+        out.write(MAGIC)
+        out.write(struct.pack('<Q', len(header_bytes)))
+        out.write(header_bytes)
+        data_start = _aligned(out.tell())
+        for name, (section_pos, _dtype, _length) in header['sections'].items():
+            out.write(b'\0' * (data_start + section_pos - out.tell()))
+            if name == 'blob':
+                while True:
+                    chunk = blob.read(1 << 20)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+            else:
+                out.write(sections[name].tobytes())
+
+
+class GraphStore(AssertionFinder):
+    """
+    Finds ConceptNet assertions in a file made by `build_graph_store`,
+    with the same methods as `AssertionFinder`.
+    """
+
+    def __init__(self, filename):
+        super().__init__()
+        self.filename = filename
+        with open(filename, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError("%r is not a ConceptNet graph store" % filename)
+        header_size = struct.unpack('<Q', self._mmap[len(MAGIC):len(MAGIC) + 8])[0]
+        header_start = len(MAGIC) + 8
+        header = json.loads(
+            self._mmap[header_start:header_start + header_size].decode('utf-8')
+        )
+        if header['version'] != FORMAT_VERSION:
+            raise ValueError(
+                "%r has graph store version %r, but we need version %r"
+                % (filename, header['version'], FORMAT_VERSION)
+            )
+        data_start = _aligned(header_start + header_size)
+        self._arrays = {
+            name: np.frombuffer(
+                self._mmap, dtype=dtype, count=length, offset=data_start + position
+            )
+            for name, (position, dtype, length) in header['sections'].items()
+        }
+        self._trie = marisa_trie.Trie()
+        self._trie.frombytes(self._arrays['trie'].tobytes())
+        self._assertion_trie = marisa_trie.Trie()
+        self._assertion_trie.frombytes(self._arrays['assertion_trie'].tobytes())
+        self.num_edges = len(self._arrays['edge_start'])
+
+    def __reduce__(self):
+        # Pickle a graph store by its filename, so it can be sent to worker
+        # processes, which will map the same file
+        return (GraphStore, (self.filename,))
+
+    @property
+    def connection(self):
+        raise TypeError("A GraphStore doesn't use a database connection")
+
+    def _edge(self, edge_id):
+        start = self._arrays['edge_start'][edge_id]
+        length = self._arrays['edge_length'][edge_id]
+        return json.loads(bytes(self._arrays['blob'][start:start + length]).decode('utf-8'))
+
+    def _indexed_edges(self, index_name, uri):
+        """
+        Get the sorted array of edge IDs whose `index_name` slot has `uri` as
+        a prefix.
+        """
+        if uri not in self._trie:
+            return np.zeros(0, dtype=np.int32)
+        key = self._trie.key_id(uri)
+        offsets = self._arrays[index_name + '_offsets']
+        return self._arrays[index_name + '_edges'][offsets[key]:offsets[key + 1]]
+
+    def _matching_edges(self, criteria):
+        """
+        Get the sorted array of edge IDs that match all the criteria, with the
+        same meaning as the criteria of `AssertionFinder.query`.
+        """
+        matches = None
+
+        def restrict(edge_ids):
+            nonlocal matches
+            if matches is None:
+                matches = edge_ids
+            else:
+                matches = np.intersect1d(matches, edge_ids, assume_unique=True)
+
+        for criterion, index_name in CRITERIA_INDEXES.items():
+            if criterion in criteria:
+                restrict(self._indexed_edges(index_name, criteria[criterion]))
+
+        if 'node' in criteria:
+            node = criteria['node']
+            if 'other' in criteria:
+                other = criteria['other']
+                forward = np.intersect1d(
+                    self._indexed_edges('start', node),
+                    self._indexed_edges('end', other),
+                    assume_unique=True,
+                )
+                backward = np.intersect1d(
+                    self._indexed_edges('end', node),
+                    self._indexed_edges('start', other),
+                    assume_unique=True,
+                )
+            else:
+                forward = self._indexed_edges('start', node)
+                backward = self._indexed_edges('end', node)
+            restrict(np.union1d(forward, backward))
+        elif 'other' in criteria:
+            restrict(self._indexed_edges('end', criteria['other']))
+
+        if 'language' in criteria:
+            language_prefix = '/c/' + criteria['language']
+            restrict(
+                np.union1d(
+                    self._indexed_edges('start', language_prefix),
+                    self._indexed_edges('end', language_prefix),
+                )
+            )
+
+        if matches is None:
+            matches = np.arange(self.num_edges, dtype=np.int32)
+
+        if 'min_weight' in criteria:
+            # Edges are numbered in order of descending weight, so the edges
+            # that are heavy enough are the ones before a cutoff
+            cutoff = np.searchsorted(
+                -self._arrays['edge_weight'], -float(criteria['min_weight']), side='right'
+            )
+            matches = matches[matches < cutoff]
+        if 'exclude_rel' in criteria:
+            excluded = self._relation_ids(criteria['exclude_rel'])
+            matches = matches[~np.isin(self._arrays['edge_rel'][matches], excluded)]
+        return matches
+
+    def lookup_grouped_by_feature(self, uri, limit=20):
+        uri = remove_control_chars(uri)
+        if uri not in self._trie:
+            return {}
+        key = self._trie.key_id(uri)
+        node_feature_offsets = self._arrays['node_feature_offsets']
+        feature_offsets = self._arrays['feature_offsets']
+        features = []
+        for feature_idx in range(node_feature_offsets[key], node_feature_offsets[key + 1]):
+            direction = int(self._arrays['feature_direction'][feature_idx])
+            rel = self._trie.restore_key(int(self._arrays['feature_rel'][feature_idx]))
+            start = feature_offsets[feature_idx]
+            end = min(feature_offsets[feature_idx + 1], start + limit)
+            features.append(((direction, rel), self._arrays['feature_edges'][start:end]))
+
+        features.sort(key=lambda item: item[0])
+        results = {}
+        for feature, edge_ids in features:
+            results[feature] = [
+                with_other_node(self._edge(edge_id), uri) for edge_id in edge_ids
+            ]
+        return results
+
+    def lookup_assertion(self, uri):
+        uri = remove_control_chars(uri)
+        if uri not in self._assertion_trie:
+            return []
+        edge_id = self._arrays['assertion_edge'][self._assertion_trie.key_id(uri)]
+        return [self._edge(edge_id)]
+
+    def _top_edges(self, uris, limit, rel=None):
+        found = []
+        for uri in uris:
+            criteria = {'node': uri}
+            if rel is not None:
+                criteria['rel'] = rel
+            for edge_id in self._matching_edges(criteria)[:limit]:
+                found.append((uri, with_other_node(self._edge(edge_id), uri)))
+        return found
+
+    def _edges_by_id(self, edge_ids):
+        return {edge_id: self._edge(edge_id) for edge_id in edge_ids}
+
+    def _node_ids(self, uris):
+        return {uri: self._trie.key_id(uri) for uri in uris if uri in self._trie}
+
+    def _relation_ids(self, rel):
+        return [
+            self._trie.key_id(uri)
+            for uri in self._trie.keys(rel)
+            if uri == rel or uri.startswith(rel + '/')
+        ]
+
+    def _load_node_graph(self):
+        return NodeGraph(
+            self._arrays['edge_start_term'],
+            self._arrays['edge_end_term'],
+            self._arrays['edge_rel'],
+            np.arange(self.num_edges, dtype=np.int32),
+            self._arrays['edge_weight'],
+        )
+
+    def random_edges(self, limit=20, criteria=None):
+        # random.sample takes time proportional to the sample size, while
+        # np.random.choice without replacement permutes the whole range
+        if criteria:
+            matches = self._matching_edges(criteria)
+            edge_ids = [
+                matches[idx]
+                for idx in random.sample(range(len(matches)), min(limit, len(matches)))
+            ]
+        else:
+            edge_ids = random.sample(range(self.num_edges), min(limit, self.num_edges))
+        return [self._edge(edge_id) for edge_id in edge_ids]
+
+    def stream_query(self, criteria):
+        for edge_id in self._matching_edges(criteria):
+            yield self._edge(edge_id)
+
+    def query(self, criteria, limit=20, offset=0):
+        edge_ids = self._matching_edges(criteria)[offset:offset + limit]
+        return [self._edge(edge_id) for edge_id in edge_ids]
@@ -0,0 +1,216 @@
+"""
+Find how two terms are connected, by searching for a shortest path between
+them in an in-memory graph of ConceptNet's terms.
+
+The graph connects terms (such as '/c/en/dog', not '/c/en/dog/n') by the
+edges between them, ignoring their direction. It's held in compact arrays
+of int32 node IDs, in compressed sparse row form, so a search doesn't need
+a query for every node it visits.
+"""
+import heapq
+import uuid
+
+import numpy as np
+
+from .connection import separate_connection, transaction
+
+# The rows of `edge_features` for the term-level prefixes of each edge's
+# nodes. Every edge has two of these rows, one for its start and one for its
+# end, and we pair them up to get the terms that the edge connects.
+NODE_GRAPH_QUERY = """
+SELECT ef.edge_id, ef.direction, ef.node_id, ef.rel_id, e.weight
+FROM edge_features ef, nodes n, edges e
+WHERE n.id = ef.node_id
+AND n.uri NOT LIKE '/c/%/%/%'
+AND e.id = ef.edge_id
+"""
+
+# The types of the columns of NODE_GRAPH_QUERY, for reading its rows into
+# NumPy arrays
+NODE_GRAPH_DTYPE = np.dtype(
+    [
+        ('edge_id', np.int32),
+        ('direction', np.int8),
+        ('node_id', np.int32),
+        ('rel_id', np.int32),
+        ('weight', np.float32),
+    ]
+)
+
+# Edges with very small weights cost this much at most to follow
+MIN_WEIGHT = 0.001
+
+
+class NodeGraph(object):
+    """
+    An undirected graph of terms, where the neighbors of node `n` are
+    `neighbors[offsets[n]:offsets[n + 1]]`, and the edge ID, relation ID,
+    and cost of reaching each one are in the parallel arrays `edge_ids`,
+    `rel_ids`, and `costs`. The cost of an edge is the reciprocal of its
+    weight, so the strongest connections are the cheapest.
+    """
+
+    def __init__(self, starts, ends, rel_ids, edge_ids, weights):
+        # Edges between two senses of the same term don't connect anything
+        keep = starts != ends
+        starts, ends = starts[keep], ends[keep]
+        rel_ids, edge_ids, weights = rel_ids[keep], edge_ids[keep], weights[keep]
+
+        sources = np.concatenate([starts, ends])
+        order = np.argsort(sources, kind='stable')
+        self.num_nodes = int(sources.max()) + 1 if len(sources) else 0
+        self.offsets = np.zeros(self.num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=self.num_nodes), out=self.offsets[1:])
+        self.neighbors = np.concatenate([ends, starts])[order].astype(np.int32)
+        self.edge_ids = np.concatenate([edge_ids, edge_ids])[order].astype(np.int32)
+        self.rel_ids = np.concatenate([rel_ids, rel_ids])[order].astype(np.int32)
+        costs = 1. / np.maximum(weights, MIN_WEIGHT)
+        self.costs = np.concatenate([costs, costs])[order].astype(np.float32)
+
+    def _adjacent(self, node, allowed_rels):
+        """
+        Get the neighbors of a node, with the edges that reach them and their
+        costs, leaving out edges whose relations aren't allowed.
+        """
+        if node >= self.num_nodes:
+            return [], [], []
+        start, end = self.offsets[node], self.offsets[node + 1]
+        neighbors = self.neighbors[start:end]
+        edge_ids = self.edge_ids[start:end]
+        costs = self.costs[start:end]
+        if allowed_rels is not None:
+            mask = np.isin(self.rel_ids[start:end], allowed_rels)
+            neighbors, edge_ids, costs = neighbors[mask], edge_ids[mask], costs[mask]
+        return neighbors.tolist(), edge_ids.tolist(), costs.tolist()
+
+    def shortest_path(
+        self, source, target, rel_ids=None, max_depth=4, weighted=True, max_visits=100000
+    ):
+        """
+        Find a path from the node `source` to the node `target` that takes
+        at most `max_depth` steps, using only edges whose relations are in
+        `rel_ids` if it's given. Returns the list of edge IDs along the path,
+        or None if there isn't one.
+
+        This is a bidirectional Dijkstra search over the costs of edges, or
+        a bidirectional breadth-first search if `weighted` is False. It gives
+        up after settling `max_visits` nodes. Nodes are settled by cost, so
+        with a tight `max_depth`, a weighted search can miss a path that's
+        shorter in steps but more expensive than paths it found too long.
+        """
+        if source == target:
+            return []
+        allowed_rels = None if rel_ids is None else np.asarray(sorted(rel_ids))
+
+        # For each direction of the search: the best known cost and number
+        # of steps to each node, the edge each node was reached by, the set
+        # of settled nodes, and the queue of nodes to settle
+        costs = [{source: 0.}, {target: 0.}]
+        steps = [{source: 0}, {target: 0}]
+        parents = [{source: None}, {target: None}]
+        settled = [set(), set()]
+        queues = [[(0., source)], [(0., target)]]
+
+        best_cost = float('inf')
+        meeting = None
+        visits = 0
+        while queues[0] and queues[1]:
+            if queues[0][0][0] + queues[1][0][0] >= best_cost:
+                break
+            visits += 1
+            if visits > max_visits:
+                break
+
+            # Expand the direction with the cheaper frontier
+            side = 0 if queues[0][0][0] <= queues[1][0][0] else 1
+            other_side = 1 - side
+            cost, node = heapq.heappop(queues[side])
+            if node in settled[side]:
+                continue
+            settled[side].add(node)
+            if steps[side][node] >= max_depth:
+                continue
+
+            next_steps = steps[side][node] + 1
+            for neighbor, edge_id, edge_cost in zip(*self._adjacent(node, allowed_rels)):
+                new_cost = cost + (edge_cost if weighted else 1.)
+                if new_cost < costs[side].get(neighbor, float('inf')):
+                    costs[side][neighbor] = new_cost
+                    steps[side][neighbor] = next_steps
+                    parents[side][neighbor] = (node, edge_id)
+                    heapq.heappush(queues[side], (new_cost, neighbor))
+                if neighbor in costs[other_side]:
+                    total = costs[side][neighbor] + costs[other_side][neighbor]
+                    total_steps = steps[side][neighbor] + steps[other_side][neighbor]
+                    if total < best_cost and total_steps <= max_depth:
+                        best_cost = total
+                        meeting = neighbor
+
+        if meeting is None:
+            return None
+        return self._path_edges(parents[0], meeting)[::-1] + self._path_edges(
+            parents[1], meeting
+        )
+
+    @staticmethod
+    def _path_edges(parents, node):
+        """
+        Follow the parent links from a node back to the start of one
+        direction of the search, listing the edge IDs along the way.
+        """
+        edges = []
+        while parents[node] is not None:
+            node, edge_id = parents[node]
+            edges.append(edge_id)
+        return edges
+
+
+def pair_edge_nodes(edge_ids, directions, nodes, rel_ids, weights):
+    """
+    Make a NodeGraph from the rows of `NODE_GRAPH_QUERY`, which have to be
+    paired up by edge. Sorting by direction puts the start node (direction 1)
+    before the end node (direction -1); symmetric edges (direction 0) can go
+    either way.
+    """
+    order = np.lexsort((-directions, edge_ids))
+    edge_ids, nodes = edge_ids[order], nodes[order]
+    rel_ids, weights = rel_ids[order], weights[order]
+
+    is_first = np.ones(len(edge_ids), dtype=bool)
+    is_first[1:] = edge_ids[1:] != edge_ids[:-1]
+    first_rows = np.flatnonzero(is_first)
+    sizes = np.diff(np.append(first_rows, len(edge_ids)))
+    pairs = first_rows[sizes == 2]
+    return NodeGraph(
+        nodes[pairs], nodes[pairs + 1], rel_ids[pairs], edge_ids[pairs], weights[pairs]
+    )
+
+
+def load_node_graph(dbname=None, batch_size=100000):
+    """
+    Load the graph of terms from the `edge_features` table. This reads a row
+    for each end of every edge, so it takes a while on the full ConceptNet.
+
+    The rows are read from a server-side cursor on a connection of our own,
+    `batch_size` at a time, and each batch becomes a NumPy array.
+    """
+    batches = []
+    with separate_connection(dbname) as connection:
+        # Named cursors only exist inside a transaction
+        with transaction(connection):
+            cursor_name = 'cn5_node_graph_' + uuid.uuid4().hex
+            with connection.cursor(name=cursor_name) as cursor:
+                cursor.execute(NODE_GRAPH_QUERY)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    batches.append(np.array(rows, dtype=NODE_GRAPH_DTYPE))
+
+    if batches:
+        table = np.concatenate(batches)
+    else:
+        table = np.zeros(0, dtype=NODE_GRAPH_DTYPE)
+    return pair_edge_nodes(
+        table['edge_id'], table['direction'], table['node_id'], table['rel_id'], table['weight']
+    )
@@ -1,16 +1,24 @@
 import json
+from contextlib import ExitStack
 
+from conceptnet5.edges import transform_for_linked_data
 from conceptnet5.formats.msgpack_stream import read_msgpack_stream
 from conceptnet5.relations import SYMMETRIC_RELATIONS
 from conceptnet5.uri import uri_prefixes
 from ordered_set import OrderedSet
 
+# The way psql's COPY command represents a NULL value
+SQL_NULL = '\\N'
+
 
 def write_row(outfile, items):
     """
-    Write a tab-separated row to a file.
+    Write a tab-separated row to a file. Values of None are written as NULL.
     """
-    print('\t'.join(sanitize(str(x)) for x in items), file=outfile)
+    print(
+        '\t'.join(SQL_NULL if x is None else sanitize(str(x)) for x in items),
+        file=outfile
+    )
 
 
 def write_ordered_set(filename, oset):
@@ -96,7 +104,132 @@ def gin_indexable_edge(edge):
     return gin_edge
 
 
-def assertions_to_sql_csv(msgpack_filename, output_dir):
+# The tables whose rows are built from each assertion by `assertion_rows`
+ASSERTION_TABLES = ['edges', 'edges_gin', 'edge_features', 'edge_nodes', 'edge_sources']
+
+
+def assertion_rows(
+    assertion, assertion_idx, node_list, relation_list, source_list, linked_data=False
+):
+    """
+    Get the rows that represent a single assertion in the tables that are
+    built from assertions, as a dictionary from table names to lists of rows.
+
+    `node_list`, `relation_list`, and `source_list` assign IDs to URIs with
+    their `add` method, which returns the ID. An OrderedSet does this, and so
+    does `conceptnet5.db.delta.DatabaseIDs`.
+    """
+    rows = {tablename: [] for tablename in ASSERTION_TABLES}
+
+    # Get unique IDs for the relation, start, and end. These IDs may already
+    # exist; this is handled by the `add` method.
+    rel_idx = relation_list.add(assertion['rel'])
+    start_idx = node_list.add(assertion['start'])
+    end_idx = node_list.add(assertion['end'])
+
+    # Also get unique IDs for each of the sources listed as contributing
+    # to this assertion.
+    sources = assertion['sources']
+    for source in sources:
+        for sourceval in sorted(source.values()):
+            source_list.add(sourceval)
+
+    # Make the row of edge data for the `edges` table.
+    jsondata = json.dumps(assertion, ensure_ascii=False, sort_keys=True)
+    if linked_data:
+        ld_jsondata = json.dumps(
+            transform_for_linked_data(json.loads(jsondata)),
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+    else:
+        ld_jsondata = None
+    weight = assertion['weight']
+    rows['edges'].append(
+        [
+            assertion_idx,
+            assertion['uri'],
+            rel_idx,
+            start_idx,
+            end_idx,
+            weight,
+            jsondata,
+            ld_jsondata,
+        ]
+    )
+
+    # Convert the edge to the form that we can easily filter using GIN
+    # indexing.
+    rows['edges_gin'].append(
+        [
+            assertion_idx,
+            weight,
+            json.dumps(
+                gin_indexable_edge(assertion),
+                ensure_ascii=False,
+                sort_keys=True,
+            ),
+        ]
+    )
+
+    # Extract the 'features' (combinations of the relation and one node)
+    # that are present in the edge. We may need to match the node using
+    # a prefix of that node, so store the feature separately for each
+    # prefix.
+    features = []
+
+    # Get the IDs in the node table for each prefix of the nodes
+    start_p_indices = [
+        node_list.add(prefix) for prefix in uri_prefixes(assertion['start'], 3)
+    ]
+    end_p_indices = [
+        node_list.add(prefix) for prefix in uri_prefixes(assertion['end'], 3)
+    ]
+
+    # Make rows of the feature data, the 'direction' (forward, backward, or
+    # symmetric), and the edge ID for the feature table.
+    if assertion['rel'] in SYMMETRIC_RELATIONS:
+        for start_p_idx in start_p_indices:
+            features.append((0, start_p_idx))
+        for end_p_idx in end_p_indices:
+            features.append((0, end_p_idx))
+    else:
+        for start_p_idx in start_p_indices:
+            features.append((1, start_p_idx))
+        for end_p_idx in end_p_indices:
+            features.append((-1, end_p_idx))
+
+    for direction, node_idx in features:
+        rows['edge_features'].append([rel_idx, direction, node_idx, assertion_idx])
+
+    # Make one row per node prefix for the `edge_nodes` table, which answers
+    # the common kinds of queries without the GIN index. The 'slot' is 1 for
+    # a prefix of the start node, -1 for a prefix of the end node, and 0 for
+    # a prefix of both.
+    node_slots = {}
+    for start_p_idx in start_p_indices:
+        node_slots[start_p_idx] = 1
+    for end_p_idx in end_p_indices:
+        if node_slots.get(end_p_idx) == 1:
+            node_slots[end_p_idx] = 0
+        else:
+            node_slots[end_p_idx] = -1
+    for node_idx, slot in node_slots.items():
+        rows['edge_nodes'].append([node_idx, rel_idx, slot, weight, assertion_idx])
+
+    # Similarly, make one row per source prefix for `edge_sources`, using the
+    # same prefixes that `gin_indexable_edge` uses.
+    source_prefixes = set()
+    for source in sources:
+        for sourceval in source.values():
+            source_prefixes.update(uri_prefixes(sourceval, min_pieces=3))
+    for prefix in sorted(source_prefixes):
+        rows['edge_sources'].append([source_list.add(prefix), weight, assertion_idx])
+
+    return rows
+
+
+def assertions_to_sql_csv(msgpack_filename, output_dir, linked_data=False):
     """
     Scan through the list of assertions (edges that are unique in their
     start, end, and relation) and produce CSV files that can be loaded
@@ -104,14 +237,15 @@ def assertions_to_sql_csv(msgpack_filename, output_dir):
 
     The columns of these CSV files are unlabeled, but they correspond
     to the order of the table columns defined in schema.py.
+
+    If `linked_data` is True, we also store the JSON-LD form of each edge,
+    as produced by `transform_for_linked_data`, so that the API doesn't have
+    to transform every edge it returns.
     """
     # Construct the filenames of the CSV files, one per table
     output_nodes = output_dir + '/nodes.csv'
-    output_edges = output_dir + '/edges.csv'
     output_relations = output_dir + '/relations.csv'
     output_sources = output_dir + '/sources.csv'
-    output_features = output_dir + '/edge_features.csv'
-    output_edges_gin = output_dir + '/edges_gin.csv'
 
     # We can't rely on Postgres to assign IDs, because we need to know the
     # IDs to refer to them _before_ they're in Postgres. So we track our own
@@ -121,95 +255,33 @@ def assertions_to_sql_csv(msgpack_filename, output_dir):
     assertion_list = OrderedSet()
     relation_list = OrderedSet()
 
-    # These are three files that we will write incrementally as we iterate
-    # through the edges. The syntax restrictions on 'with' leave me with no
-    # way to format this that satisfies my style checker and auto-formatter.
-    with open(output_edges, 'w', encoding='utf-8') as edge_file,\
-         open(output_edges_gin, 'w', encoding='utf-8') as edge_gin_file,\
-         open(output_features, 'w', encoding='utf-8') as feature_file:
+    # These are the files that we will write incrementally as we iterate
+    # through the edges, one per table in ASSERTION_TABLES.
+    with ExitStack() as stack:
+        outfiles = {
+            tablename: stack.enter_context(
+                open(output_dir + '/{}.csv'.format(tablename), 'w', encoding='utf-8')
+            )
+            for tablename in ASSERTION_TABLES
+        }
         for assertion in read_msgpack_stream(msgpack_filename):
             # Assertions are supposed to be unique. If they're not, we should
             # find out and the build should fail.
             if assertion['uri'] in assertion_list:
                 raise ValueError("Duplicate assertion: {!r}".format(assertion))
 
-            # Get unique IDs for the relation, start, and end, and the assertion
-            # itself. The relation, start, and end IDs may already exists; this is
-            # handled by OrderedSet.
             assertion_idx = assertion_list.add(assertion['uri'])
-            rel_idx = relation_list.add(assertion['rel'])
-            start_idx = node_list.add(assertion['start'])
-            end_idx = node_list.add(assertion['end'])
-
-            # Also get unique IDs for each of the sources listed as contributing
-            # to this assertion.
-            source_indices = []
-            sources = assertion['sources']
-            for source in sources:
-                for sourceval in sorted(source.values()):
-                    source_idx = source_list.add(sourceval)
-                    source_indices.append(source_idx)
-
-            # Write the edge data to the `edge_file`.
-            jsondata = json.dumps(assertion, ensure_ascii=False, sort_keys=True)
-            weight = assertion['weight']
-            write_row(
-                edge_file,
-                [
-                    assertion_idx,
-                    assertion['uri'],
-                    rel_idx,
-                    start_idx,
-                    end_idx,
-                    weight,
-                    jsondata,
-                ],
-            )
-
-            # Convert the edge to the form that we can easily filter using GIN
-            # indexing, and write that to the `edge_gin_file`.
-            write_row(
-                edge_gin_file,
-                [
-                    assertion_idx,
-                    weight,
-                    json.dumps(
-                        gin_indexable_edge(assertion),
-                        ensure_ascii=False,
-                        sort_keys=True,
-                    ),
-                ],
+            rows = assertion_rows(
+                assertion,
+                assertion_idx,
+                node_list,
+                relation_list,
+                source_list,
+                linked_data=linked_data,
             )
-
-            # Extract the 'features' (combinations of the relation and one node)
-            # that are present in the edge. We may need to match the node using
-            # a prefix of that node, so store the feature separately for each
-            # prefix.
-            features = []
-
-            # Get the IDs in the node table for each prefix of the nodes
-            start_p_indices = [
-                node_list.add(prefix) for prefix in uri_prefixes(assertion['start'], 3)
-            ]
-            end_p_indices = [
-                node_list.add(prefix) for prefix in uri_prefixes(assertion['end'], 3)
-            ]
-
-            # Write the feature data, the 'direction' (forward, backward, or
-            # symmetric), and the edge ID to the feature table.
-            if assertion['rel'] in SYMMETRIC_RELATIONS:
-                for start_p_idx in start_p_indices:
-                    features.append((0, start_p_idx))
-                for end_p_idx in end_p_indices:
-                    features.append((0, end_p_idx))
-            else:
-                for start_p_idx in start_p_indices:
-                    features.append((1, start_p_idx))
-                for end_p_idx in end_p_indices:
-                    features.append((-1, end_p_idx))
-
-            for direction, node_idx in features:
-                write_row(feature_file, [rel_idx, direction, node_idx, assertion_idx])
+            for tablename, table_rows in rows.items():
+                for row in table_rows:
+                    write_row(outfiles[tablename], row)
 
     # Write our tables of unique IDs
     write_ordered_set(output_nodes, node_list)
@@ -229,6 +301,8 @@ def load_sql_csv(connection, input_dir):
         (input_dir + '/sources.csv', 'sources'),
         (input_dir + '/edges_gin.shuf.csv', 'edges_gin'),
         (input_dir + '/edge_features.csv', 'edge_features'),
+        (input_dir + '/edge_nodes.csv', 'edge_nodes'),
+        (input_dir + '/edge_sources.csv', 'edge_sources'),
     ]:
         with connection:
             with connection.cursor() as cursor:
@@ -1,18 +1,38 @@
+import functools
+import hashlib
 import itertools
 import json
+import random
+import re
+import threading
+import time
+import uuid
+import weakref
+from collections import defaultdict
 
 from conceptnet5.db.config import DB_NAME
-from conceptnet5.db.connection import get_db_connection
+from conceptnet5.db.connection import get_db_connection, separate_connection, transaction
+from conceptnet5.db.paths import load_node_graph
 from conceptnet5.edges import transform_for_linked_data
+from conceptnet5.metrics import counter, histogram, log_slow_query
+from conceptnet5.uri import is_absolute_url, split_uri, uri_prefix
 from ftfy.fixes import remove_control_chars
 
 LIST_QUERIES = {}
 FEATURE_QUERIES = {}
 
+QUERY_SECONDS = histogram(
+    'conceptnet_db_query_seconds', 'Time spent running database queries, by type of query'
+)
+ROWS_FETCHED = counter(
+    'conceptnet_db_rows_fetched_total', 'Rows returned by database queries, by type of query'
+)
+
 # A query that's optimized for producing the edges, grouped by feature, that
 # you get when you look up a concept in the Web interface.
 NODE_TO_FEATURE_QUERY = """
-SELECT rf.direction, r.uri, e.data
+SELECT rf.direction, r.uri,
+       COALESCE(e.ld_data, e.data::text), e.ld_data IS NOT NULL
 FROM ranked_features rf, edges e, relations r
 WHERE rf.node_id = (SELECT n.id FROM nodes n where n.uri=%(node)s)
 AND rf.edge_id = e.id
@@ -21,34 +41,254 @@ AND rank <= %(limit)s
 ORDER BY direction, uri, rank;
 """
 
+# How many matches a query that uses the GIN index can consider
+GIN_MATCH_LIMIT = 10000
+
 # Queries that match arbitrary criteria using a GIN index. The @> operator
 # tests whether one JSONB structure includes all the values in another.
+#
+# These, and the queries below, are formatted with the conditions of the
+# filtering criteria (see `FILTER_CRITERIA`). The conditions go inside the
+# `matched_edges` subquery, so that its limit counts only the edges that
+# pass the filters.
 GIN_QUERY_1WAY = """
 WITH matched_edges AS (
-    SELECT edge_id FROM edges_gin
-    WHERE data @> %(query)s
-    LIMIT 10000
+    SELECT e.id FROM edges_gin eg, edges e
+    WHERE eg.data @> %(query)s
+    AND e.id = eg.edge_id
+    {weight_condition}
+    {conditions}
+    LIMIT {match_limit}
 )
-SELECT e.uri, e.data, e.weight
+SELECT e.uri, COALESCE(e.ld_data, e.data::text), e.ld_data IS NOT NULL
 FROM matched_edges m, edges e
-WHERE m.edge_id = e.id
-ORDER BY weight DESC
+WHERE m.id = e.id
+ORDER BY e.weight DESC
 OFFSET %(offset)s LIMIT %(limit)s;
 """
 
 GIN_QUERY_2WAY = """
 WITH matched_edges AS (
-    SELECT edge_id FROM edges_gin
-    WHERE data @> %(query_forward)s OR data @> %(query_backward)s
-    LIMIT 10000
+    SELECT e.id FROM edges_gin eg, edges e
+    WHERE (eg.data @> %(query_forward)s OR eg.data @> %(query_backward)s)
+    AND e.id = eg.edge_id
+    {weight_condition}
+    {conditions}
+    LIMIT {match_limit}
 )
-SELECT e.uri, e.data, e.weight
+SELECT e.uri, COALESCE(e.ld_data, e.data::text), e.ld_data IS NOT NULL
 FROM matched_edges m, edges e
-WHERE m.edge_id = e.id
-ORDER BY weight DESC
+WHERE m.id = e.id
+ORDER BY e.weight DESC
+OFFSET %(offset)s LIMIT %(limit)s;
+"""
+
+ASSERTION_QUERY = """
+SELECT COALESCE(ld_data, data::text), ld_data IS NOT NULL
+FROM edges WHERE uri=%(uri)s;
+"""
+
+# Queries for the most common shapes of criteria, which can be answered from
+# B-tree indexes that are already sorted by weight, instead of going through
+# the GIN index. The `edge_nodes` table contains one row for each edge and
+# each prefix of its start and end nodes, where `slot` is 1 if the prefix
+# comes from the start node, -1 if it comes from the end node, and 0 if it
+# comes from both.
+NODE_FAST_QUERY = """
+SELECT e.uri, COALESCE(e.ld_data, e.data::text), e.ld_data IS NOT NULL
+FROM edge_nodes en, edges e
+WHERE en.node_id = (SELECT n.id FROM nodes n WHERE n.uri=%(node)s)
+{conditions}
+AND en.edge_id = e.id
+ORDER BY en.weight DESC, en.edge_id
+OFFSET %(offset)s LIMIT %(limit)s;
+"""
+
+REL_FAST_QUERY = """
+SELECT e.uri, COALESCE(e.ld_data, e.data::text), e.ld_data IS NOT NULL
+FROM edges e
+WHERE e.relation_id IN ({relations})
+{conditions}
+ORDER BY e.weight DESC, e.id
 OFFSET %(offset)s LIMIT %(limit)s;
 """
 
+SOURCE_FAST_QUERY = """
+SELECT e.uri, COALESCE(e.ld_data, e.data::text), e.ld_data IS NOT NULL
+FROM edge_sources es, edges e
+WHERE es.source_id = (SELECT s.id FROM sources s WHERE s.uri=%(source)s)
+AND es.edge_id = e.id
+{conditions}
+ORDER BY es.weight DESC, es.edge_id
+OFFSET %(offset)s LIMIT %(limit)s;
+"""
+
+# A relation criterion matches the relation and anything it is a prefix of,
+# such as '/r/dbpedia' matching '/r/dbpedia/genre'.
+RELATION_IDS = """
+SELECT r.id FROM relations r
+WHERE r.uri=%(rel)s OR r.uri LIKE %(rel_prefix)s
+"""
+
+OTHER_NODE_CONDITION = """
+AND EXISTS (
+    SELECT 1 FROM edge_nodes en2
+    WHERE en2.edge_id = en.edge_id
+    AND en2.node_id = (SELECT n.id FROM nodes n WHERE n.uri=%(other)s)
+    AND {slot_condition}
+)
+"""
+
+# The highest-weighted edges of each of a list of nodes, which is how we
+# expand the neighborhood of a node by one hop in a single query.
+TOP_EDGES_QUERY = """
+SELECT n.uri, COALESCE(e.ld_data, e.data::text), e.ld_data IS NOT NULL
+FROM nodes n
+CROSS JOIN LATERAL (
+    SELECT en.edge_id FROM edge_nodes en
+    WHERE en.node_id = n.id
+    {conditions}
+    ORDER BY en.weight DESC, en.edge_id
+    LIMIT %(limit)s
+) top, edges e
+WHERE n.uri = ANY(%(nodes)s::text[])
+AND e.id = top.edge_id;
+"""
+
+# Edge IDs are numbered densely from 0 by `prepare_data`, so we can choose
+# random edges uniformly by choosing random IDs. Edges removed by
+# `load_delta` leave gaps in the numbering, which we make up for by asking
+# for extra IDs.
+MAX_EDGE_ID_QUERY = """
+SELECT max(id) FROM edges;
+"""
+
+EDGES_BY_ID_QUERY = """
+SELECT e.id, COALESCE(e.ld_data, e.data::text), e.ld_data IS NOT NULL
+FROM edges e
+WHERE e.id = ANY(%(ids)s::integer[]);
+"""
+
+# How many times to go back for more random IDs when we land in gaps
+RANDOM_EDGE_ATTEMPTS = 10
+
+NODE_IDS_QUERY = """
+SELECT n.uri, n.id FROM nodes n
+WHERE n.uri = ANY(%(uris)s::text[]);
+"""
+
+# Criteria that filter the edges that match the other criteria, instead of
+# being looked up in an index themselves
+FILTER_CRITERIA = ['min_weight', 'language', 'exclude_rel']
+
+# A 'language' criterion matches edges where either node is in the language
+LANGUAGE_CONDITION = """
+AND EXISTS (
+    SELECT 1 FROM nodes ln
+    WHERE ln.id IN (e.start_id, e.end_id)
+    AND ln.uri LIKE %(language_prefix)s
+)
+"""
+
+EXCLUDE_REL_CONDITION = """
+AND e.relation_id NOT IN (
+    SELECT r.id FROM relations r
+    WHERE r.uri=%(exclude_rel)s OR r.uri LIKE %(exclude_rel_prefix)s
+)
+"""
+
+START_SLOTS = '(1, 0)'
+END_SLOTS = '(-1, 0)'
+
+
+# Queries that use the GIN index aren't prepared. After a prepared
+# statement has run a few times, Postgres may switch to a generic plan that
+# doesn't depend on its parameters, and the best plan for a JSONB
+# containment query depends a lot on the values it's looking for.
+UNPREPARED_QUERY_TYPES = {'gin_1way', 'gin_2way'}
+
+# The names of the statements we've PREPAREd on each database connection
+_PREPARED_STATEMENTS = weakref.WeakKeyDictionary()
+
+NAMED_PARAMETER_RE = re.compile(r'%\((\w+)\)s')
+
+
+@functools.lru_cache(maxsize=None)
+def prepared_statement(query):
+    """
+    Convert a query with named parameters, such as `%(node)s`, into a
+    PREPARE statement with numbered parameters, and an EXECUTE statement
+    that fills them in from the same named parameters. The statement is
+    named after a hash of the query, so each distinct query gets prepared
+    once per connection.
+
+    >>> prepare, execute = prepared_statement(
+    ...     'SELECT id FROM nodes WHERE uri=%(uri)s LIMIT %(limit)s'
+    ... )
+    >>> prepare.split(' AS ')[1]
+    'SELECT id FROM nodes WHERE uri=$1 LIMIT $2'
+    >>> execute.split(' ', 2)[2]
+    '(%(uri)s, %(limit)s)'
+    """
+    name = 'cn5_' + hashlib.md5(query.encode('utf-8')).hexdigest()[:16]
+    param_names = []
+
+    def number_parameter(match):
+        param_name = match.group(1)
+        if param_name not in param_names:
+            param_names.append(param_name)
+        return '$%d' % (param_names.index(param_name) + 1)
+
+    prepare = 'PREPARE {} AS {}'.format(
+        name, NAMED_PARAMETER_RE.sub(number_parameter, query.strip().rstrip(';'))
+    )
+    if param_names:
+        execute = 'EXECUTE {} ({})'.format(
+            name, ', '.join('%({})s'.format(param_name) for param_name in param_names)
+        )
+    else:
+        execute = 'EXECUTE {}'.format(name)
+    return prepare, execute
+
+
+def linked_data_edge(edge_json, is_linked_data):
+    """
+    Get the Linked Data form of an edge from the JSON text we selected from
+    the `edges` table.
+
+    If the database was built with `prepare_data --linked-data`, the text
+    already contains the edge in the form that the API returns, and we only
+    have to parse it. Otherwise, it's the original edge data, which we
+    transform with `transform_for_linked_data`.
+    """
+    edge = json.loads(edge_json)
+    if is_linked_data:
+        return edge
+    return transform_for_linked_data(edge)
+
+
+def with_other_node(edge, uri):
+    """
+    Set the 'other' node of a Linked Data edge that was found by looking up
+    `uri`, which is the node that (in most cases) didn't match the URI.
+    """
+    # Hacky way to figure out what the 'other' node is. If both start with
+    # our given URI, take the longer one, which is either a more specific
+    # sense or a different, longer word.
+    start_uri = edge['start']['@id']
+    end_uri = edge['end']['@id']
+    shorter, longer = sorted([start_uri, end_uri], key=len)
+    if shorter.startswith(uri):
+        other = longer
+    else:
+        other = shorter
+
+    if other == start_uri:
+        edge['other'] = edge['start']
+    else:
+        edge['other'] = edge['end']
+    return edge
+
 
 def jsonify(value):
     """
@@ -114,23 +354,253 @@ def gin_jsonb_value(criteria, node_forward=True):
     return query
 
 
+def reservoir_sample(items, k, rng=random):
+    """
+    Choose `k` items uniformly at random from an iterable of unknown length,
+    keeping no more than `k` items in memory (Vitter's Algorithm R). If
+    there are fewer than `k` items, all of them are returned. The items come
+    out in random order.
+
+    >>> sorted(reservoir_sample(range(5), 10))
+    [0, 1, 2, 3, 4]
+    >>> sample = reservoir_sample(range(1000), 10, rng=random.Random(0))
+    >>> len(sample), len(set(sample))
+    (10, 10)
+    """
+    reservoir = []
+    for i, item in enumerate(items):
+        if i < k:
+            reservoir.append(item)
+        else:
+            j = rng.randint(0, i)
+            if j < k:
+                reservoir[j] = item
+    rng.shuffle(reservoir)
+    return reservoir
+
+
+def is_prefix_indexed(uri):
+    """
+    Check whether a URI is one of the prefixes that `prepare_data` writes to
+    the `edge_nodes` and `edge_sources` tables. These contain prefixes with
+    at least 3 components, so very general queries such as '/c/en' have to
+    use the GIN index.
+
+    >>> is_prefix_indexed('/c/en/dog')
+    True
+    >>> is_prefix_indexed('/c/en')
+    False
+    >>> is_prefix_indexed('http://dbpedia.org/resource/Dog')
+    True
+    """
+    return is_absolute_url(uri) or len(split_uri(uri)) >= 3
+
+
+def like_prefix(uri):
+    """
+    Make a pattern for the SQL LIKE operator that matches URIs that have the
+    given URI as a prefix, escaping characters that LIKE treats specially.
+
+    >>> like_prefix('/r/dbpedia')
+    '/r/dbpedia/%'
+    >>> like_prefix('/r/has_part')
+    '/r/has\\\\_part/%'
+    """
+    escaped = uri.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '/%'
+
+
+def filter_params(criteria):
+    """
+    Get the query parameters for the filtering criteria in `criteria`.
+    Raises a ValueError if 'min_weight' isn't a number.
+
+    >>> sorted(filter_params({'node': '/c/en/dog', 'language': 'fr'}).items())
+    [('language_prefix', '/c/fr/%')]
+    >>> filter_params({'min_weight': '2'})
+    {'min_weight': 2.0}
+    """
+    params = {}
+    if 'min_weight' in criteria:
+        params['min_weight'] = float(criteria['min_weight'])
+    if 'language' in criteria:
+        params['language_prefix'] = like_prefix('/c/' + criteria['language'])
+    if 'exclude_rel' in criteria:
+        params['exclude_rel'] = criteria['exclude_rel']
+        params['exclude_rel_prefix'] = like_prefix(criteria['exclude_rel'])
+    return params
+
+
+def weight_condition(criteria, column):
+    """
+    Get the SQL condition for the 'min_weight' criterion, applied to the
+    weight in the given column. We check the weight separately from the
+    other filters, so that it can be applied to an index that is sorted by
+    weight.
+    """
+    if 'min_weight' in criteria:
+        return 'AND {} >= %(min_weight)s'.format(column)
+    return ''
+
+
+def edge_conditions(criteria):
+    """
+    Get the SQL conditions for the other filtering criteria, which apply to
+    rows of the `edges` table, named `e`.
+    """
+    conditions = []
+    if 'language' in criteria:
+        conditions.append(LANGUAGE_CONDITION)
+    if 'exclude_rel' in criteria:
+        conditions.append(EXCLUDE_REL_CONDITION)
+    return '\n'.join(conditions)
+
+
+def plan_query(criteria):
+    """
+    Recognize criteria that can be answered by one of the fast, B-tree
+    indexed queries, and return the query and its parameters (without
+    `limit` and `offset`). Return None when the criteria should fall back
+    on the general GIN query.
+
+    The shapes we handle are a single node (as 'node', 'start', or 'end'),
+    optionally with a second node and a relation; a relation on its own; and
+    a source on its own. Any of them can also have filtering criteria, which
+    become extra conditions on the query.
+
+    >>> plan_query({'node': '/c/en', 'rel': '/r/IsA'}) is None
+    True
+    >>> plan_query({'node': '/c/en/dog', 'dataset': '/d/wordnet/3.1'}) is None
+    True
+    >>> plan_query({'other': '/c/en/dog'}) is None
+    True
+    >>> sql, params = plan_query({'start': '/c/en/dog', 'end': '/c/en/cat'})
+    >>> sorted(params.items())
+    [('node', '/c/en/dog'), ('other', '/c/en/cat')]
+    >>> sql, params = plan_query({'rel': '/r/IsA'})
+    >>> sorted(params.items())
+    [('rel', '/r/IsA'), ('rel_prefix', '/r/IsA/%')]
+    >>> sql, params = plan_query({'node': '/c/en/dog', 'min_weight': 2})
+    >>> 'en.weight >= %(min_weight)s' in sql
+    True
+    """
+    keys = set(criteria) - set(FILTER_CRITERIA)
+    params = filter_params(criteria)
+    filters = edge_conditions(criteria)
+    if keys == {'rel'}:
+        params['rel'] = criteria['rel']
+        params['rel_prefix'] = like_prefix(criteria['rel'])
+        conditions = weight_condition(criteria, 'e.weight') + filters
+        query = REL_FAST_QUERY.format(relations=RELATION_IDS, conditions=conditions)
+        return query, params
+
+    if keys == {'source'} or keys == {'sources'}:
+        source = criteria[keys.pop()]
+        if not is_prefix_indexed(source):
+            return None
+        params['source'] = source
+        conditions = weight_condition(criteria, 'es.weight') + filters
+        return SOURCE_FAST_QUERY.format(conditions=conditions), params
+
+    if 'node' in keys and keys <= {'node', 'other', 'rel'}:
+        node = criteria['node']
+        other = criteria.get('other')
+        node_slots = None
+        other_slots = None
+    elif keys & {'start', 'end'} and keys <= {'start', 'end', 'rel'}:
+        if 'start' in keys:
+            node, node_slots = criteria['start'], START_SLOTS
+            other, other_slots = criteria.get('end'), END_SLOTS
+        else:
+            node, node_slots = criteria['end'], END_SLOTS
+            other, other_slots = None, None
+    else:
+        return None
+
+    if not is_prefix_indexed(node):
+        return None
+    if other is not None and not is_prefix_indexed(other):
+        return None
+
+    conditions = []
+    params['node'] = node
+    if node_slots is not None:
+        conditions.append('AND en.slot IN {}'.format(node_slots))
+    if 'rel' in keys:
+        params['rel'] = criteria['rel']
+        params['rel_prefix'] = like_prefix(criteria['rel'])
+        conditions.append('AND en.rel_id IN ({})'.format(RELATION_IDS))
+    if other is not None:
+        params['other'] = other
+        if node_slots is None:
+            # The two nodes can appear in either order
+            slot_condition = (
+                '((en.slot IN {start} AND en2.slot IN {end}) OR '
+                '(en.slot IN {end} AND en2.slot IN {start}))'
+            ).format(start=START_SLOTS, end=END_SLOTS)
+        else:
+            slot_condition = 'en2.slot IN {}'.format(other_slots)
+        conditions.append(OTHER_NODE_CONDITION.format(slot_condition=slot_condition))
+
+    conditions.append(weight_condition(criteria, 'en.weight'))
+    conditions.append(filters)
+    return NODE_FAST_QUERY.format(conditions='\n'.join(conditions)), params
+
+
 class AssertionFinder(object):
     """
     The object that interacts with the database to find ConceptNet assertions
     (edges) matching certain criteria.
     """
 
-    def __init__(self, dbname=None):
+    def __init__(self, dbname=None, prepare=True):
         self._connection = None
         self.dbname = dbname
 
+        # Whether to use prepared statements, so that Postgres doesn't parse
+        # and plan our most frequent queries again on every call. Turn this
+        # off when connecting through a pooler that doesn't support them.
+        self.prepare = prepare
+
+        # The graph of terms that `shortest_path` searches, which is loaded
+        # the first time it's needed, or in the background by
+        # `preload_node_graph`
+        self._node_graph = None
+        self._node_graph_lock = threading.Lock()
+
     @property
-    def connection():
+    def connection(self):
         # See https://www.psycopg.org/docs/connection.html#connection.closed
         if self._connection is None or self._connection.closed > 0:
             self._connection = get_db_connection(self.dbname)
         return self._connection
 
+    def _execute(self, cursor, query, params, query_type='other'):
+        """
+        Run a query on the cursor, as a prepared statement if `self.prepare`
+        is True and its `query_type` isn't in UNPREPARED_QUERY_TYPES. Each
+        query is PREPAREd the first time it's used on a connection.
+
+        The time the query takes and the number of rows it returns are
+        counted in the metrics under `query_type`, and the query is logged if
+        it's slow.
+        """
+        start = time.perf_counter()
+        if not self.prepare or query_type in UNPREPARED_QUERY_TYPES:
+            cursor.execute(query, params)
+        else:
+            prepared = _PREPARED_STATEMENTS.setdefault(cursor.connection, set())
+            prepare, execute = prepared_statement(query)
+            if prepare not in prepared:
+                cursor.execute(prepare)
+                prepared.add(prepare)
+            cursor.execute(execute, params)
+        seconds = time.perf_counter() - start
+        QUERY_SECONDS.observe(seconds, query_type=query_type)
+        if cursor.rowcount > 0:
+            ROWS_FETCHED.inc(cursor.rowcount, query_type=query_type)
+        log_slow_query(query_type, seconds, params)
+
     def lookup(self, uri, limit=100, offset=0):
         """
         A query that returns all the edges that include a certain URI.
@@ -163,26 +633,16 @@ class AssertionFinder(object):
             return tuple(row[:2])
 
         def feature_data(row):
-            direction, _, data = row
-
-            # Hacky way to figure out what the 'other' node is, the one that
-            # (in most cases) didn't match the URI. If both start with our
-            # given URI, take the longer one, which is either a more specific
-            # sense or a different, longer word.
-            shorter, longer = sorted([data['start'], data['end']], key=len)
-            if shorter.startswith(uri):
-                data['other'] = longer
-            else:
-                data['other'] = shorter
-            return data
+            direction, _, edge_json, is_linked_data = row
+            return with_other_node(linked_data_edge(edge_json, is_linked_data), uri)
 
         cursor = self.connection.cursor()
-        cursor.execute(NODE_TO_FEATURE_QUERY, {'node': uri, 'limit': limit})
+        self._execute(
+            cursor, NODE_TO_FEATURE_QUERY, {'node': uri, 'limit': limit}, 'feature'
+        )
         results = {}
         for feature, rows in itertools.groupby(cursor.fetchall(), extract_feature):
-            results[feature] = [
-                transform_for_linked_data(feature_data(row)) for row in rows
-            ]
+            results[feature] = [feature_data(row) for row in rows]
         return results
 
     def lookup_assertion(self, uri):
@@ -193,62 +653,341 @@ class AssertionFinder(object):
         # remove \x00 anyway, but this avoids reporting a server error when that happens.
         uri = remove_control_chars(uri)
         cursor = self.connection.cursor()
-        cursor.execute("SELECT data FROM edges WHERE uri=%(uri)s", {'uri': uri})
-        results = [transform_for_linked_data(data) for (data,) in cursor.fetchall()]
+        self._execute(cursor, ASSERTION_QUERY, {'uri': uri}, 'assertion')
+        results = [
+            linked_data_edge(edge_json, is_linked_data)
+            for (edge_json, is_linked_data) in cursor.fetchall()
+        ]
         return results
 
-    def random_edges(self, limit=20):
+    def _top_edges(self, uris, limit, rel=None):
         """
-        Get a collection of distinct, randomly-selected edges.
+        Get up to `limit` of the highest-weighted edges of each of the given
+        nodes, optionally only those whose relation matches `rel`, in one
+        query. Returns a list of (uri, edge) pairs, where the 'other' node of
+        each edge is set relative to the URI it was found for.
         """
-        if self.dbname == 'conceptnet-test':
-            # Random queries sample 10% of edges. This makes sure we get matches in
-            # the test database, where there isn't much data.
-            random_query = """
-                SELECT uri, data, weight FROM edges
-                TABLESAMPLE SYSTEM(10)
-                ORDER BY random() LIMIT %(limit)s
-            """
-        else:
-            # In the real database, random queries sample 0.01% of edges.
-            random_query = """
-                SELECT uri, data, weight FROM edges
-                TABLESAMPLE SYSTEM(0.01)
-                ORDER BY random() LIMIT %(limit)s
-            """
-
+        params = {'nodes': list(uris), 'limit': limit}
+        conditions = ''
+        if rel is not None:
+            params['rel'] = rel
+            params['rel_prefix'] = like_prefix(rel)
+            conditions = 'AND en.rel_id IN ({})'.format(RELATION_IDS)
         cursor = self.connection.cursor()
-        cursor.execute(random_query, {'limit': limit})
-        results = [
-            transform_for_linked_data(data) for uri, data, weight in cursor.fetchall()
+        query = TOP_EDGES_QUERY.format(conditions=conditions)
+        self._execute(cursor, query, params, 'top_edges')
+        return [
+            (node, with_other_node(linked_data_edge(edge_json, is_linked_data), node))
+            for node, edge_json, is_linked_data in cursor.fetchall()
         ]
-        return results
 
-    def query(self, criteria, limit=20, offset=0):
+    def neighborhood(self, uri, hops=2, per_hop_limit=20, rel_filter=None, max_nodes=1000):
         """
-        The most general way to query based on a set of criteria.
+        Find the nodes within `hops` steps of a node, following the
+        `per_hop_limit` highest-weighted edges of each node at each step. If
+        `rel_filter` is given, only edges whose relation matches it are
+        followed. Each hop is one query, however many nodes it expands.
+
+        Nodes are identified by their term URIs (such as '/c/en/dog' instead
+        of '/c/en/dog/n'), and no more than `max_nodes` of them are reached.
+
+        Returns a pair of `nodes`, a dictionary from each node reached to its
+        number of hops from `uri`, and `edges`, the list of edges followed.
+        The 'other' node of an edge is the node it was followed to.
+        """
+        uri = remove_control_chars(uri)
+        distances = {uri: 0}
+        edges = {}
+        frontier = [uri]
+        for hop in range(1, hops + 1):
+            if not frontier:
+                break
+            found = self._top_edges(frontier, per_hop_limit, rel_filter)
+            # When we're running out of nodes, the strongest edges get them
+            found.sort(key=lambda item: -item[1]['weight'])
+            frontier = []
+            for node, edge in found:
+                if edge['@id'] not in edges:
+                    edges[edge['@id']] = edge
+                other = uri_prefix(edge['other']['@id'])
+                if other not in distances and len(distances) < max_nodes:
+                    distances[other] = hop
+                    frontier.append(other)
+        return distances, list(edges.values())
+
+    def random_walks(self, uri, length=3, num_walks=10, rel_filter=None, candidates=100):
+        """
+        Take `num_walks` random walks of up to `length` steps from a node.
+        Each step follows one of the `candidates` highest-weighted edges of
+        the current node (whose relation matches `rel_filter`, if given),
+        chosen with probability proportional to its weight. All the walks
+        take each step together, so a step is one query.
+
+        Returns a list of walks, each of which is a list of edges, whose
+        'other' node is the node the walk went to. A walk ends early if it
+        reaches a node with no edges to follow.
+        """
+        uri = remove_control_chars(uri)
+        walks = [[] for _ in range(num_walks)]
+        positions = [uri] * num_walks
+        for _step in range(length):
+            active = sorted({node for node in positions if node is not None})
+            if not active:
+                break
+            choices = defaultdict(list)
+            for node, edge in self._top_edges(active, candidates, rel_filter):
+                choices[node].append(edge)
+            for i, node in enumerate(positions):
+                if node is None:
+                    continue
+                options = choices.get(node)
+                if not options:
+                    positions[i] = None
+                    continue
+                [edge] = random.choices(options, weights=[edge['weight'] for edge in options])
+                walks[i].append(edge)
+                positions[i] = uri_prefix(edge['other']['@id'])
+        return walks
+
+    def _edges_by_id(self, edge_ids):
+        """
+        Get a dictionary of the edges with the given IDs.
+        """
+        cursor = self.connection.cursor()
+        self._execute(cursor, EDGES_BY_ID_QUERY, {'ids': list(edge_ids)}, 'edges_by_id')
+        return {
+            edge_id: linked_data_edge(edge_json, is_linked_data)
+            for edge_id, edge_json, is_linked_data in cursor.fetchall()
+        }
+
+    def _node_ids(self, uris):
+        """
+        Get a dictionary of the node IDs of the given URIs that are nodes.
+        """
+        cursor = self.connection.cursor()
+        self._execute(cursor, NODE_IDS_QUERY, {'uris': list(uris)}, 'node_ids')
+        return dict(cursor.fetchall())
+
+    def _relation_ids(self, rel):
+        """
+        Get the IDs of the relations that match `rel`, in the same way as the
+        'rel' criterion.
         """
         cursor = self.connection.cursor()
+        params = {'rel': rel, 'rel_prefix': like_prefix(rel)}
+        self._execute(cursor, RELATION_IDS, params, 'relation_ids')
+        return [rel_id for (rel_id,) in cursor.fetchall()]
+
+    def _load_node_graph(self):
+        return load_node_graph(self.dbname)
+
+    @property
+    def node_graph(self):
+        # Only one thread loads the graph, and the others wait for it
+        if self._node_graph is None:
+            with self._node_graph_lock:
+                if self._node_graph is None:
+                    self._node_graph = self._load_node_graph()
+        return self._node_graph
+
+    def preload_node_graph(self):
+        """
+        Start loading `node_graph` in a background thread, so that the first
+        search for a path doesn't have to wait for all of it. Returns the
+        thread.
+        """
+        thread = threading.Thread(target=lambda: self.node_graph, daemon=True)
+        thread.start()
+        return thread
+
+    def shortest_path(self, node1, node2, rels=None, max_depth=4, weighted=True):
+        """
+        Find how two terms are connected: the list of edges along the
+        shortest path between them, taking at most `max_depth` steps, or None
+        if there is no such path. The 'other' node of each edge is the node
+        the path goes to next.
+
+        If `weighted` is True, the path with the least total cost is found,
+        where the cost of an edge is the reciprocal of its weight. Otherwise,
+        it's the path with the fewest steps. If `rels` is given, it's a list
+        of relations that the edges have to match.
+
+        The search happens in `self.node_graph`, which is loaded from the
+        database the first time it's needed, unless `preload_node_graph` has
+        already started loading it.
+        """
+        node1 = uri_prefix(remove_control_chars(node1))
+        node2 = uri_prefix(remove_control_chars(node2))
+        node_ids = self._node_ids([node1, node2])
+        if node1 not in node_ids or node2 not in node_ids:
+            return None
+        rel_ids = None
+        if rels is not None:
+            rel_ids = [rel_id for rel in rels for rel_id in self._relation_ids(rel)]
+
+        edge_ids = self.node_graph.shortest_path(
+            node_ids[node1],
+            node_ids[node2],
+            rel_ids=rel_ids,
+            max_depth=max_depth,
+            weighted=weighted,
+        )
+        if edge_ids is None:
+            return None
+        found = self._edges_by_id(edge_ids)
+        path = []
+        node = node1
+        for edge_id in edge_ids:
+            edge = found[edge_id]
+            if uri_prefix(edge['start']['@id']) == node:
+                edge['other'] = edge['end']
+            else:
+                edge['other'] = edge['start']
+            node = uri_prefix(edge['other']['@id'])
+            path.append(edge)
+        return path
+
+    def random_edges(self, limit=20, criteria=None):
+        """
+        Get a collection of distinct, uniformly-selected edges, in random
+        order.
+
+        Without `criteria`, we choose random edge IDs and look them up in
+        one query, going back for more if some of the IDs are missing. With
+        `criteria`, we choose a sample of the edges that `query` would
+        return, using reservoir sampling.
+        """
+        if criteria:
+            return self._sample_matching_edges(criteria, limit)
+
+        cursor = self.connection.cursor()
+        self._execute(cursor, MAX_EDGE_ID_QUERY, {}, 'max_edge_id')
+        (max_id,) = cursor.fetchone()
+        if max_id is None:
+            return []
+
+        found = []
+        tried = set()
+        for _attempt in range(RANDOM_EDGE_ATTEMPTS):
+            needed = limit - len(found)
+            untried = max_id + 1 - len(tried)
+            if needed <= 0 or untried <= 0:
+                break
+            # Ask for some extra IDs, in case some of them are gaps
+            count = min(untried, needed + needed // 4 + 4)
+            ids = [
+                edge_id
+                for edge_id in random.sample(range(max_id + 1), count)
+                if edge_id not in tried
+            ]
+            tried.update(ids)
+            edges = self._edges_by_id(ids)
+            # Keep the edges in the random order we chose them in
+            found.extend(edges[edge_id] for edge_id in ids if edge_id in edges)
+        return found[:limit]
+
+    def _sample_matching_edges(self, criteria, limit):
+        """
+        Choose `limit` random edges out of all the edges matching `criteria`,
+        streaming the matches so that only the sample is kept in memory.
+        Criteria that fall back on the GIN index are sampled from its first
+        10000 matches.
+        """
+        sample = reservoir_sample(self._stream_matching_rows(criteria), limit)
+        return [
+            linked_data_edge(edge_json, is_linked_data)
+            for uri, edge_json, is_linked_data in sample
+        ]
+
+    def _stream_matching_rows(self, criteria, itersize=2000):
+        """
+        Iterate over all the rows that the query for `criteria` returns,
+        fetching `itersize` of them at a time from a server-side cursor.
+
+        The cursor gets its own connection, which is closed when the
+        iteration finishes or is abandoned, so that a long stream doesn't
+        hold a transaction open on the connection that other queries share.
+        """
+        _query_type, query, params = self._criteria_query(criteria)
+        params['limit'] = None
+        params['offset'] = 0
+        with separate_connection(self.dbname) as connection:
+            # Named cursors only exist inside a transaction
+            with transaction(connection):
+                cursor_name = 'cn5_matching_edges_' + uuid.uuid4().hex
+                with connection.cursor(name=cursor_name) as cursor:
+                    cursor.itersize = itersize
+                    cursor.execute(query, params)
+                    yield from cursor
+
+    def stream_query(self, criteria):
+        """
+        Iterate over all the edges matching `criteria`, in the same order as
+        `query` returns them, but without a limit and in constant memory.
+
+        The query runs on its own database connection, which stays open
+        until you finish iterating or close the iterator.
+        """
+        for uri, edge_json, is_linked_data in self._stream_matching_rows(criteria):
+            yield linked_data_edge(edge_json, is_linked_data)
+
+    def _criteria_query(self, criteria):
+        """
+        Get the query that finds edges matching a set of criteria, and its
+        parameters, not including `limit` and `offset`. Returns the type of
+        query that it is (for metrics), the query, and the parameters.
+        """
+        plan = plan_query(criteria)
+        if plan is not None:
+            keys = set(criteria) - set(FILTER_CRITERIA)
+            if keys == {'rel'}:
+                query_type = 'rel'
+            elif keys == {'source'} or keys == {'sources'}:
+                query_type = 'source'
+            else:
+                query_type = 'node'
+            return (query_type,) + plan
+
+        params = filter_params(criteria)
         if 'node' in criteria:
             query_forward = gin_jsonb_value(criteria, node_forward=True)
             query_backward = gin_jsonb_value(criteria, node_forward=False)
-            cursor.execute(
-                GIN_QUERY_2WAY,
-                {
-                    'query_forward': jsonify(query_forward),
-                    'query_backward': jsonify(query_backward),
-                    'limit': limit,
-                    'offset': offset,
-                },
-            )
+            params['query_forward'] = jsonify(query_forward)
+            params['query_backward'] = jsonify(query_backward)
+            query = GIN_QUERY_2WAY
+            query_type = 'gin_2way'
         else:
-            query = gin_jsonb_value(criteria)
-            cursor.execute(
-                GIN_QUERY_1WAY,
-                {'query': jsonify(query), 'limit': limit, 'offset': offset},
-            )
+            params['query'] = jsonify(gin_jsonb_value(criteria))
+            query = GIN_QUERY_1WAY
+            query_type = 'gin_1way'
+        query = query.format(
+            weight_condition=weight_condition(criteria, 'eg.weight'),
+            conditions=edge_conditions(criteria),
+            match_limit=GIN_MATCH_LIMIT,
+        )
+        return query_type, query, params
+
+    def query(self, criteria, limit=20, offset=0):
+        """
+        The most general way to query based on a set of criteria.
+
+        Common shapes of criteria are answered by indexed queries that are
+        planned by `plan_query`. Anything else uses the GIN index, which can
+        only consider the first 10000 matches.
+
+        Besides the criteria that select edges by their URIs, the criteria
+        can filter them: 'min_weight' is the smallest weight to return,
+        'language' is a language code that either node has to be in, and
+        'exclude_rel' is a relation that the edges can't match.
+        """
+        query_type, query, params = self._criteria_query(criteria)
+        params['limit'] = limit
+        params['offset'] = offset
+        cursor = self.connection.cursor()
+        self._execute(cursor, query, params, query_type)
 
         results = [
-            transform_for_linked_data(data) for uri, data, weight in cursor.fetchall()
+            linked_data_edge(edge_json, is_linked_data)
+            for uri, edge_json, is_linked_data in cursor.fetchall()
         ]
         return results
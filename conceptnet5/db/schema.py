@@ -1,7 +1,52 @@
+import uuid
+
+from psycopg2.extras import execute_values
+
+from conceptnet5 import __version__ as VERSION
+
+from .connection import transaction
+
+# Databases built by earlier versions have `ranked_features` as a
+# materialized view, which can't be dropped with DROP TABLE.
+DROP_RANKED_FEATURES_VIEW = """
+DO $$ BEGIN
+    IF EXISTS (SELECT 1 FROM pg_matviews WHERE matviewname = 'ranked_features')
+    THEN DROP MATERIALIZED VIEW ranked_features;
+    END IF;
+END $$
+"""
+
+# Rank the edges of each feature -- a combination of a node, a relation, and
+# a direction -- by their weight. The results go in the `ranked_features`
+# table, which is a regular table so that we can recompute just the features
+# that changed.
+RANK_FEATURES = """
+SELECT ef.rel_id, ef.direction, ef.node_id, ef.edge_id, e.weight,
+       row_number() OVER (
+           PARTITION BY (ef.node_id, ef.rel_id, ef.direction)
+           ORDER BY e.weight DESC, e.id
+       ) AS rank
+FROM {features} edge_features ef, edges e
+WHERE e.id=ef.edge_id {conditions}
+"""
+
+# A single row that identifies the version of the data that was loaded, which
+# the web server makes its ETags from. It's replaced whenever the data
+# changes. Databases built by earlier versions don't have this table yet.
+BUILD_INFO_TABLE = """
+CREATE TABLE IF NOT EXISTS build_info (
+    version   text NOT NULL,
+    built     timestamp with time zone NOT NULL
+)
+"""
+
 TABLES = [
-    "DROP MATERIALIZED VIEW IF EXISTS ranked_features",
+    DROP_RANKED_FEATURES_VIEW,
+    "DROP TABLE IF EXISTS build_info",
+    "DROP TABLE IF EXISTS ranked_features",
     "DROP TABLE IF EXISTS edge_features",
     "DROP TABLE IF EXISTS edge_sources",
+    "DROP TABLE IF EXISTS edge_nodes",
     "DROP TABLE IF EXISTS edges_gin",
     "DROP TABLE IF EXISTS node_prefixes",
     "DROP TABLE IF EXISTS edges",
@@ -29,7 +74,8 @@ TABLES = [
         start_id       integer NOT NULL,
         end_id         integer NOT NULL,
         weight         real NOT NULL,
-        data           jsonb NOT NULL
+        data           jsonb NOT NULL,
+        ld_data        text
     )
     """,
     """CREATE TABLE edges_gin (
@@ -45,6 +91,29 @@ TABLES = [
         edge_id   integer NOT NULL
     )
     """,
+    """CREATE TABLE ranked_features (
+        rel_id    integer NOT NULL,
+        direction integer NOT NULL,
+        node_id   integer NOT NULL,
+        edge_id   integer NOT NULL,
+        weight    real NOT NULL,
+        rank      integer NOT NULL
+    )
+    """,
+    """CREATE TABLE edge_nodes (
+        node_id   integer NOT NULL,
+        rel_id    integer NOT NULL,
+        slot      integer NOT NULL,
+        weight    real NOT NULL,
+        edge_id   integer NOT NULL
+    )
+    """,
+    """CREATE TABLE edge_sources (
+        source_id integer NOT NULL,
+        weight    real NOT NULL,
+        edge_id   integer NOT NULL
+    )
+    """,
 ]
 
 INDICES = [
@@ -59,6 +128,11 @@ INDICES = [
     "ALTER TABLE edge_features ADD FOREIGN KEY (rel_id) REFERENCES relations (id)",
     "ALTER TABLE edge_features ADD FOREIGN KEY (node_id) REFERENCES nodes (id)",
     "ALTER TABLE edge_features ADD FOREIGN KEY (edge_id) REFERENCES edges (id)",
+    "ALTER TABLE edge_nodes ADD FOREIGN KEY (node_id) REFERENCES nodes (id)",
+    "ALTER TABLE edge_nodes ADD FOREIGN KEY (rel_id) REFERENCES relations (id)",
+    "ALTER TABLE edge_nodes ADD FOREIGN KEY (edge_id) REFERENCES edges (id)",
+    "ALTER TABLE edge_sources ADD FOREIGN KEY (source_id) REFERENCES sources (id)",
+    "ALTER TABLE edge_sources ADD FOREIGN KEY (edge_id) REFERENCES edges (id)",
     "ALTER TABLE nodes ADD CONSTRAINT nodes_unique_uri UNIQUE (uri)",
     "ALTER TABLE sources ADD CONSTRAINT sources_unique_uri UNIQUE (uri)",
     "ALTER TABLE edges ADD CONSTRAINT edges_unique_uri UNIQUE (uri)",
@@ -67,19 +141,19 @@ INDICES = [
     "CREATE INDEX edge_start ON edges (start_id)",
     "CREATE INDEX edge_end ON edges (end_id)",
     "CREATE INDEX edge_weight ON edges (weight)",
+    "CREATE INDEX edge_relation_weight ON edges (relation_id, weight DESC, id)",
     "CREATE INDEX ef_feature ON edge_features (rel_id, direction, node_id)",
     "CREATE INDEX ef_node ON edge_features (node_id)",
-    """
-    CREATE MATERIALIZED VIEW ranked_features AS (
-    SELECT ef.rel_id, ef.direction, ef.node_id, ef.edge_id, e.weight,
-           row_number() OVER (
-               PARTITION BY (ef.node_id, ef.rel_id, ef.direction)
-               ORDER BY e.weight DESC, e.id
-           ) AS rank
-    FROM edge_features ef, edges e WHERE e.id=ef.edge_id
-    ) WITH DATA
-    """,
+    "CREATE INDEX ef_edge ON edge_features (edge_id)",
+    "CREATE INDEX edges_gin_edge ON edges_gin (edge_id)",
+    "CREATE INDEX en_node_weight ON edge_nodes (node_id, weight DESC, edge_id)",
+    "CREATE INDEX en_node_rel_weight ON edge_nodes (node_id, rel_id, weight DESC, edge_id)",
+    "CREATE INDEX en_edge_node ON edge_nodes (edge_id, node_id)",
+    "CREATE INDEX es_source_weight ON edge_sources (source_id, weight DESC, edge_id)",
+    "CREATE INDEX es_edge ON edge_sources (edge_id)",
+    "INSERT INTO ranked_features " + RANK_FEATURES.format(features='', conditions=''),
     "CREATE INDEX rf_node ON ranked_features (node_id)",
+    "CREATE INDEX rf_feature ON ranked_features (rel_id, direction, node_id)",
     "CREATE INDEX edges_gin_index ON edges_gin USING gin (data jsonb_path_ops)",
 ]
 
@@ -97,3 +171,93 @@ def create_tables(connection):
 
 def create_indices(connection):
     run_commands(connection, INDICES)
+
+
+def mark_build(cursor):
+    """
+    Record that the data in the database has just been built or changed, by
+    giving it a new build version.
+    """
+    cursor.execute(BUILD_INFO_TABLE)
+    cursor.execute("DELETE FROM build_info")
+    cursor.execute(
+        "INSERT INTO build_info (version, built) VALUES (%(version)s, now())",
+        {'version': '{}-{}'.format(VERSION, uuid.uuid4().hex[:12])},
+    )
+
+
+def get_build_info(connection):
+    """
+    Get the build version of the data in the database and the time it was
+    built, as recorded by `mark_build`, or None if the database doesn't
+    record them.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('build_info') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            return None
+        cursor.execute("SELECT version, built FROM build_info")
+        return cursor.fetchone()
+
+
+def features_of_edges(connection, edge_ids):
+    """
+    Get the set of features, as (rel_id, direction, node_id) tuples, that
+    the given edges belong to.
+
+    To find the features that need to be re-ranked when an edge is removed,
+    call this before removing it from `edge_features`.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT DISTINCT rel_id, direction, node_id FROM edge_features "
+            "WHERE edge_id = ANY(%(edge_ids)s::integer[])",
+            {'edge_ids': list(edge_ids)}
+        )
+        return set(cursor.fetchall())
+
+
+def refresh_ranked_features(connection, features):
+    """
+    Recompute the rows of `ranked_features` for just the given features,
+    which are (rel_id, direction, node_id) tuples, such as the ones returned
+    by `features_of_edges`. The rest of the table is left alone, so this
+    is much faster than ranking every feature again after a small change to
+    the edges.
+    """
+    with transaction(connection):
+        with connection.cursor() as cursor:
+            refresh_ranked_features_in_transaction(cursor, features)
+
+
+def refresh_ranked_features_in_transaction(cursor, features):
+    """
+    The steps of `refresh_ranked_features`, for a cursor whose connection
+    is already in a transaction.
+    """
+    if not features:
+        return
+    cursor.execute(
+        "CREATE TEMPORARY TABLE changed_features ("
+        "rel_id integer, direction integer, node_id integer"
+        ") ON COMMIT DROP"
+    )
+    execute_values(
+        cursor,
+        "INSERT INTO changed_features VALUES %s",
+        sorted(set(features))
+    )
+    cursor.execute(
+        "DELETE FROM ranked_features rf USING changed_features cf "
+        "WHERE rf.rel_id=cf.rel_id AND rf.direction=cf.direction "
+        "AND rf.node_id=cf.node_id"
+    )
+    cursor.execute(
+        "INSERT INTO ranked_features " + RANK_FEATURES.format(
+            features='changed_features cf,',
+            conditions=(
+                'AND ef.rel_id=cf.rel_id AND ef.direction=cf.direction '
+                'AND ef.node_id=cf.node_id'
+            )
+        )
+    )
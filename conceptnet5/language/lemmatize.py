@@ -193,6 +193,16 @@ class DBLemmatizer:
         root, _form = self.lookup(language, text, pos)
         return join_uri('c', language, root, *rest)
 
+    def lemmatize_uris(self, uris):
+        """
+        Lemmatize many URIs, looking up each distinct one only once.
+        """
+        lemmas = {}
+        for uri in uris:
+            if uri not in lemmas:
+                lemmas[uri] = self.lemmatize_uri(uri)
+        return [lemmas[uri] for uri in uris]
+
 
 LEMMATIZER = DBLemmatizer()
 
@@ -223,3 +233,7 @@ def lemmatize(language, word, pos=None):
 
 def lemmatize_uri(uri):
     return LEMMATIZER.lemmatize_uri(uri)
+
+
+def lemmatize_uris(uris):
+    return LEMMATIZER.lemmatize_uris(uris)
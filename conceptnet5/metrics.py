@@ -0,0 +1,203 @@
+"""
+Counters and histograms that measure how ConceptNet is being used and how
+long things take, which can be reported in the Prometheus text format.
+
+Metrics are kept in memory by each process. When the API is served by
+several worker processes, each of them counts only its own requests, so a
+scraper will see the metrics of whichever worker answered it.
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Queries that take longer than this many seconds are logged, along with
+# their parameters. Set CONCEPTNET_SLOW_QUERY_SECONDS to turn this on.
+SLOW_QUERY_SECONDS = float(os.environ.get('CONCEPTNET_SLOW_QUERY_SECONDS', '0'))
+SLOW_QUERY_LOG = logging.getLogger('conceptnet5.slow_queries')
+
+# The upper bounds (in seconds) of the buckets that timings are counted in
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+METRICS = {}
+_LOCK = threading.Lock()
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_number(value):
+    """
+    Format a number the way Prometheus expects it.
+
+    >>> _format_number(3.0)
+    '3'
+    >>> _format_number(0.25)
+    '0.25'
+    >>> _format_number(float('inf'))
+    '+Inf'
+    """
+    if value == float('inf'):
+        return '+Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Counter(object):
+    """
+    A count of things that have happened, separately for each combination
+    of labels.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _LOCK:
+            self.values[key] += amount
+
+    def get(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with _LOCK:
+            values = sorted(self.values.items())
+        for key, value in values:
+            yield self.name, key, value
+
+
+class Histogram(object):
+    """
+    The distribution of some measurement, usually a time in seconds, as
+    counts of how many observations were at most each of the `buckets`.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.counts = {}
+        self.sums = defaultdict(float)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _LOCK:
+            if key not in self.counts:
+                self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.counts[key][bisect.bisect_left(self.buckets, value)] += 1
+            self.sums[key] += value
+
+    @contextmanager
+    def timer(self, **labels):
+        """
+        Observe how long the body of a `with` statement takes.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        return sum(self.counts.get(_label_key(labels), []))
+
+    def samples(self):
+        with _LOCK:
+            counts = sorted((key, list(value)) for key, value in self.counts.items())
+            sums = dict(self.sums)
+        bounds = self.buckets + (float('inf'),)
+        for key, bucket_counts in counts:
+            total = 0
+            for bound, bucket_count in zip(bounds, bucket_counts):
+                total += bucket_count
+                yield self.name + '_bucket', key + (('le', _format_number(bound)),), total
+            yield self.name + '_count', key, total
+            yield self.name + '_sum', key, sums[key]
+
+
+def _register(metric_class, name, description, registry=None, **kwargs):
+    if registry is None:
+        registry = METRICS
+    with _LOCK:
+        if name not in registry:
+            registry[name] = metric_class(name, description, **kwargs)
+        return registry[name]
+
+
+def counter(name, description, registry=None):
+    """
+    Get the counter with the given name, creating it if it doesn't exist.
+
+    Metrics are kept in the global METRICS registry, unless a different dict
+    is passed as `registry`.
+    """
+    return _register(Counter, name, description, registry=registry)
+
+
+def histogram(name, description, buckets=DEFAULT_BUCKETS, registry=None):
+    """
+    Get the histogram with the given name, creating it if it doesn't exist.
+    """
+    return _register(
+        Histogram, name, description, registry=registry, buckets=buckets
+    )
+
+
+def render_metrics(registry=None):
+    """
+    Describe the current values of all the metrics in `registry` (by default,
+    the global METRICS registry) in the Prometheus text exposition format.
+
+    >>> registry = {}
+    >>> requests = counter('doctest_requests_total', 'Requests in a doctest', registry=registry)
+    >>> requests.inc(endpoint='query')
+    >>> print(render_metrics(registry).strip())
+    # HELP doctest_requests_total Requests in a doctest
+    # TYPE doctest_requests_total counter
+    doctest_requests_total{endpoint="query"} 1
+    """
+    if registry is None:
+        registry = METRICS
+    lines = []
+    for name in sorted(registry):
+        metric = registry[name]
+        lines.append('# HELP {} {}'.format(name, metric.description))
+        lines.append('# TYPE {} {}'.format(name, metric.kind))
+        for sample_name, labels, value in metric.samples():
+            if labels:
+                label_text = ','.join(
+                    '{}="{}"'.format(label, _escape_label(label_value))
+                    for label, label_value in labels
+                )
+                sample_name = '{}{{{}}}'.format(sample_name, label_text)
+            lines.append('{} {}'.format(sample_name, _format_number(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def log_slow_query(query_type, seconds, params):
+    """
+    Log a query that took longer than SLOW_QUERY_SECONDS, with the
+    parameters it was run with, which include the criteria it searched for.
+    """
+    if 0 < SLOW_QUERY_SECONDS <= seconds:
+        SLOW_QUERY_LOG.warning(
+            'Slow %s query took %.3f seconds: %r', query_type, seconds, params
+        )
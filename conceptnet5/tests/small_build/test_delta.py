@@ -0,0 +1,49 @@
+from conceptnet5.db.delta import load_assertion_delta
+from conceptnet5.db.schema import get_build_info
+from conceptnet5.formats.msgpack_stream import MsgpackStreamWriter, read_msgpack_stream
+from conceptnet5.tests.conftest import run_build, test_finder
+
+ASSERTIONS = 'testdata/current/assertions/assertions.msgpack'
+QUIZ_URI = '/a/[/r/RelatedTo/,/c/en/test/,/c/en/quiz/]'
+FORM_URI = '/a/[/r/FormOf/,/c/en/tests/,/c/en/test/n/]'
+
+
+def test_load_delta(test_finder, run_build, tmp_path):
+    connection = test_finder.connection
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id FROM edges WHERE uri=%(uri)s", {'uri': FORM_URI})
+        (form_id,) = cursor.fetchone()
+    build_version, built = get_build_info(connection)
+
+    # Remove one assertion and change the weight of another
+    delta_filename = str(tmp_path / 'assertions.msgpack')
+    writer = MsgpackStreamWriter(delta_filename)
+    for assertion in read_msgpack_stream(ASSERTIONS):
+        if assertion['uri'] == QUIZ_URI:
+            continue
+        if assertion['uri'] == FORM_URI:
+            assertion['weight'] = 10.0
+        writer.write(assertion)
+    writer.close()
+
+    try:
+        counts = load_assertion_delta(connection, delta_filename)
+        assert counts == {'added': 0, 'updated': 1, 'removed': 1}
+        new_version, new_built = get_build_info(connection)
+        assert new_version != build_version
+        assert new_built >= built
+        quiz_ids = [match['@id'] for match in test_finder.lookup('/c/en/quiz')]
+        assert QUIZ_URI not in quiz_ids
+
+        # The changed edge keeps its ID, and is now ranked first in its feature
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT id FROM edges WHERE uri=%(uri)s", {'uri': FORM_URI})
+            assert cursor.fetchone() == (form_id,)
+        found = test_finder.lookup_grouped_by_feature('/c/en/tests')
+        assert any(edges[0]['@id'] == FORM_URI for edges in found.values())
+    finally:
+        # Put back the original assertions
+        counts = load_assertion_delta(connection, ASSERTIONS)
+        assert counts == {'added': 1, 'updated': 1, 'removed': 0}
+
+    assert len(test_finder.lookup('/c/en/quiz')) == 3
@@ -1,4 +1,6 @@
 import pytest
+from conceptnet5.db.query import AssertionFinder
+from conceptnet5.db.schema import features_of_edges, refresh_ranked_features
 from conceptnet5.tests.conftest import run_build, test_finder
 
 
@@ -32,6 +34,17 @@ def test_lookup_dataset(test_finder, run_build):
 def test_random_edges(test_finder, run_build):
     results = list(test_finder.random_edges(limit=10))
     assert len(results) == 10
+    assert len({edge['@id'] for edge in results}) == 10
+
+
+def test_random_edges_with_criteria(test_finder, run_build):
+    results = test_finder.random_edges(limit=2, criteria={'node': '/c/en/quiz'})
+    assert len(results) == 2
+    quiz_ids = {edge['@id'] for edge in test_finder.lookup('/c/en/quiz')}
+    assert {edge['@id'] for edge in results} <= quiz_ids
+
+    results = test_finder.random_edges(limit=100, criteria={'node': '/c/en/quiz'})
+    assert {edge['@id'] for edge in results} == quiz_ids
 
 
 def test_strip_control_chars(test_finder, run_build):
@@ -96,3 +109,123 @@ def test_lookup_external(test_finder, run_build):
     found = list(test_finder.lookup('http://dbpedia.org/resource/Test_(assessment)'))
     assert len(found) == 1
     assert found[0]['start']['@id'] == '/c/en/test/n/wp/assessment'
+
+
+def test_query_rel(test_finder, run_build):
+    q = get_query_ids({'rel': '/r/FormOf'}, test_finder)
+    assert '/a/[/r/FormOf/,/c/en/tests/,/c/en/test/n/]' in q
+    weights = [match['weight'] for match in test_finder.query({'rel': '/r/FormOf'})]
+    assert weights == sorted(weights, reverse=True)
+
+
+def test_lookup_source(test_finder, run_build):
+    q = [match['@id'] for match in test_finder.lookup('/s/resource/jmdict/1.07')]
+    assert '/a/[/r/Synonym/,/c/ja/テスト/n/,/c/en/test/]' in q
+
+
+def test_refresh_ranked_features(test_finder, run_build):
+    before = test_finder.lookup_grouped_by_feature('/c/en/test')
+    connection = test_finder.connection
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id FROM edges WHERE uri LIKE '%/c/en/test/%'")
+        edge_ids = [edge_id for (edge_id,) in cursor.fetchall()]
+        features = features_of_edges(connection, edge_ids)
+        assert features
+
+        # Break the ranks of those edges, and make sure we can fix them
+        cursor.execute(
+            "UPDATE ranked_features SET rank = rank + 1000000 "
+            "WHERE edge_id = ANY(%(edge_ids)s)",
+            {'edge_ids': edge_ids}
+        )
+        refresh_ranked_features(connection, features)
+    assert test_finder.lookup_grouped_by_feature('/c/en/test') == before
+
+
+def test_neighborhood(test_finder, run_build):
+    distances, edges = test_finder.neighborhood('/c/en/quiz', hops=2, per_hop_limit=5)
+    assert distances['/c/en/quiz'] == 0
+    assert distances['/c/en/test'] == 1
+    assert max(distances.values()) == 2
+
+    distances, edges = test_finder.neighborhood(
+        '/c/en/quiz', hops=1, rel_filter='/r/Synonym'
+    )
+    assert edges and all(edge['rel']['@id'] == '/r/Synonym' for edge in edges)
+
+
+def test_random_walks(test_finder, run_build):
+    walks = test_finder.random_walks('/c/en/quiz', length=2, num_walks=5)
+    assert len(walks) == 5
+    assert all(1 <= len(walk) <= 2 for walk in walks)
+
+
+def test_shortest_path(test_finder, run_build):
+    path = test_finder.shortest_path('/c/en/quiz', '/c/en/test')
+    assert len(path) == 1
+    assert path[0]['other']['@id'].startswith('/c/en/test')
+    path = test_finder.shortest_path('/c/fi/koe', '/c/en/quiz', rels=['/r/Synonym'])
+    assert path and all(edge['rel']['@id'] == '/r/Synonym' for edge in path)
+    assert test_finder.shortest_path('/c/en/quiz', '/c/en/nonexistent') is None
+
+
+def test_preload_node_graph(run_build):
+    finder = AssertionFinder('conceptnet-test')
+    threads = [finder.preload_node_graph() for _ in range(3)]
+    for thread in threads:
+        thread.join()
+    graph = finder.node_graph
+    assert graph.num_nodes > 0
+    assert finder.node_graph is graph
+    assert finder.connection.autocommit
+    assert len(finder.shortest_path('/c/en/quiz', '/c/en/test')) == 1
+
+
+def test_filter_criteria(test_finder, run_build):
+    for criteria in [{'node': '/c/en/test'}, {'rel': '/r/Synonym'}, {'start': '/c/en'}]:
+        unfiltered = test_finder.query(criteria, limit=100)
+        found = test_finder.query(dict(criteria, min_weight=2), limit=100)
+        assert found and all(edge['weight'] >= 2 for edge in found)
+        assert len(found) < len(unfiltered)
+
+    found = test_finder.query({'node': '/c/en/test', 'language': 'ja'}, limit=100)
+    assert found
+    for edge in found:
+        assert '/c/ja/' in edge['start']['@id'] + ' ' + edge['end']['@id']
+
+    found = test_finder.query({'node': '/c/en/test', 'exclude_rel': '/r/Synonym'}, limit=100)
+    assert found and all(edge['rel']['@id'] != '/r/Synonym' for edge in found)
+
+    found = test_finder.query({'node': '/c/en/test', 'dataset': '/d/wordnet'}, limit=100)
+    assert found and all(edge['dataset'].startswith('/d/wordnet') for edge in found)
+
+
+
+def test_filters_before_gin_limit(test_finder, run_build, monkeypatch):
+    # Only a few of the JMDict edges have a French node, so if the language
+    # filter were applied after the GIN query's limit, it would miss most
+    # of them
+    criteria = {'dataset': '/d/jmdict', 'language': 'fr'}
+    expected = set(get_query_ids(criteria, test_finder))
+    assert 0 < len(expected) < 10
+    assert len(test_finder.query({'dataset': '/d/jmdict'}, limit=1000)) > 100
+    monkeypatch.setattr('conceptnet5.db.query.GIN_MATCH_LIMIT', 10)
+    assert set(get_query_ids(criteria, test_finder)) == expected
+def test_stream_query(test_finder, run_build):
+    criteria = {'rel': '/r/Synonym'}
+    streamed = list(test_finder.stream_query(criteria))
+    assert len(streamed) > 100
+    assert streamed[:100] == test_finder.query(criteria, limit=100)
+
+
+def test_concurrent_streams(test_finder, run_build):
+    criteria = {'rel': '/r/Synonym'}
+    stream1 = test_finder.stream_query(criteria)
+    stream2 = test_finder.stream_query(criteria)
+    first = next(stream1)
+    assert next(stream2) == first
+    # Other queries still run outside of the streams' transactions
+    assert test_finder.query(criteria, limit=1) == [first]
+    assert test_finder.connection.autocommit
+    stream1.close()
+    assert len(list(stream2)) > 100
@@ -0,0 +1,101 @@
+import gzip
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conceptnet5.vectors import formats
+from conceptnet5.vectors.formats import (
+    export_text,
+    load_fasttext,
+    load_glove,
+    load_word2vec_bin,
+    vec_to_text_line,
+)
+
+LABELS = ['the', '</s>', 'naïve', 'nan', 'café_au_lait']
+
+
+@pytest.fixture
+def vectors():
+    return np.random.RandomState(0).normal(size=(len(LABELS), 4)).astype('f')
+
+
+def write_text_vectors(filename, vectors, header=True):
+    with gzip.open(filename, 'wt', encoding='utf-8') as out:
+        if header:
+            print(*vectors.shape, file=out)
+        for label, vec in zip(LABELS, vectors):
+            print(label, ' '.join('%.6f' % value for value in vec), file=out)
+
+
+@pytest.mark.parametrize('block_lines', [2, 1000])
+def test_load_fasttext(tmp_path, vectors, monkeypatch, block_lines):
+    monkeypatch.setattr(formats, 'TEXT_BLOCK_LINES', block_lines)
+    filename = str(tmp_path / 'vectors.txt.gz')
+    write_text_vectors(filename, vectors)
+    frame = load_fasttext(filename, max_rows=3)
+
+    # The sentence boundary is skipped, and a label that looks like a number
+    # stays a label
+    assert list(frame.index) == ['the', 'naïve', 'nan']
+    assert np.allclose(frame.values, vectors[[0, 2, 3]], atol=1e-6)
+
+
+@pytest.mark.parametrize('block_lines', [2, 1000])
+def test_load_glove(tmp_path, vectors, monkeypatch, block_lines):
+    monkeypatch.setattr(formats, 'TEXT_BLOCK_LINES', block_lines)
+    filename = str(tmp_path / 'glove.txt.gz')
+    write_text_vectors(filename, vectors, header=False)
+    frame = load_glove(filename)
+    assert list(frame.index) == LABELS
+    assert frame.values.dtype == np.float32
+    assert np.allclose(frame.values, vectors, atol=1e-6)
+
+    # Values are rounded to float32 the same way Python's float() does it
+    with gzip.open(filename, 'rt', encoding='utf-8') as lines:
+        expected = [[float(x) for x in line.split()[1:]] for line in lines]
+    assert np.array_equal(frame.values, np.array(expected, dtype='f'))
+
+
+def test_load_glove_bad_line(tmp_path):
+    filename = str(tmp_path / 'glove.txt.gz')
+    with gzip.open(filename, 'wt') as out:
+        print('good 1.0 2.0', file=out)
+        print('bad 1.0 two', file=out)
+    with pytest.raises(ValueError):
+        load_glove(filename)
+
+
+@pytest.mark.parametrize('block_size', [7, 1 << 20])
+def test_load_word2vec_bin(tmp_path, vectors, monkeypatch, block_size):
+    monkeypatch.setattr(formats, 'BINARY_BLOCK_SIZE', block_size)
+    filename = str(tmp_path / 'vectors.bin.gz')
+    with gzip.open(filename, 'wb') as out:
+        out.write(b'%d %d\n' % vectors.shape)
+        for label, vec in zip(LABELS, vectors):
+            out.write(label.encode('utf-8') + b' ' + vec.tobytes() + b'\n')
+    frame = load_word2vec_bin(filename, 10)
+    assert list(frame.index) == ['the', 'naïve', 'nan', 'café_au_lait']
+    assert np.array_equal(frame.values, vectors[[0, 2, 3, 4]])
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+@pytest.mark.parametrize('filter_language', [None, 'fr'])
+def test_export_text(tmp_path, processes, filter_language):
+    rng = np.random.RandomState(1)
+    labels = sorted(['/c/en/cat', '/c/en/dog', '/c/fr/chat', '/c/fr/chien', '/c/fr/été'])
+    frame = pd.DataFrame(rng.normal(size=(5, 3)).astype('f'), index=labels)
+    frame.iloc[0, 0] = -0.0
+    filename = str(tmp_path / 'vectors.txt.gz')
+    export_text(frame, filename, filter_language, processes=processes, block_rows=2)
+
+    if filter_language is not None:
+        frame = frame.loc[[label for label in labels if label.startswith('/c/fr/')]]
+    expected = '%s %s\n' % frame.shape
+    for label, vec in zip(frame.index, frame.values):
+        if filter_language is not None:
+            label = label.split('/', 3)[-1]
+        expected += vec_to_text_line(label, vec) + '\n'
+    with gzip.open(filename, 'rt', encoding='utf-8') as infile:
+        assert infile.read() == expected
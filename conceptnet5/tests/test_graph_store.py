@@ -0,0 +1,146 @@
+import pickle
+
+import pytest
+
+from conceptnet5.db.graph_store import GraphStore, build_graph_store
+from conceptnet5.uri import uri_prefix
+
+ASSERTIONS = 'testdata/reference/assertions/assertions.msgpack'
+
+
+@pytest.fixture(scope='module')
+def graph_store(tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp('graph') / 'conceptnet.graph')
+    build_graph_store(ASSERTIONS, filename)
+    return GraphStore(filename)
+
+
+def get_query_ids(query, store):
+    return [match['@id'] for match in store.query(query)]
+
+
+def test_lookup(graph_store):
+    quiz = graph_store.lookup('/c/en/quiz')
+    assert len(quiz) == 3
+    assert graph_store.lookup('/c/en/quiz', offset=1) == quiz[1:]
+    assert graph_store.lookup('/c/en/quiz', limit=1) == quiz[:1]
+
+    edge = quiz[0]
+    assert edge['@id'] == '/a/[/r/RelatedTo/,/c/en/test/,/c/en/quiz/]'
+    assert edge['start']['@id'] == '/c/en/test'
+    assert edge['rel']['@id'] == '/r/RelatedTo'
+    weights = [edge['weight'] for edge in quiz]
+    assert weights == sorted(weights, reverse=True)
+
+    assert graph_store.lookup(edge['@id']) == [edge]
+    assert graph_store.lookup('/a/[/r/RelatedTo/,/c/en/quiz/,/c/en/test/]') == []
+
+
+def test_query(graph_store):
+    testquiz = {
+        '/a/[/r/RelatedTo/,/c/en/test/,/c/en/quiz/]',
+        '/a/[/r/Synonym/,/c/en/test/n/,/c/en/quiz/]',
+        '/a/[/r/Synonym/,/c/en/test/n/wikt/en_1/,/c/en/quiz/]',
+    }
+    assert set(get_query_ids({'start': '/c/en/test', 'end': '/c/en/quiz'}, graph_store)) == testquiz
+    assert set(get_query_ids({'node': '/c/en/quiz', 'other': '/c/en/test'}, graph_store)) == testquiz
+    assert get_query_ids({'node': '/c/es', 'other': '/c/es', 'rel': '/r/Synonym'}, graph_store) == [
+        '/a/[/r/Synonym/,/c/es/test/n/,/c/es/prueba/]'
+    ]
+    assert get_query_ids(
+        {'node': '/c/en/test', 'source': '/s/resource/jmdict/1.07'}, graph_store
+    ) == ['/a/[/r/Synonym/,/c/ja/テスト/n/,/c/en/test/]']
+    assert get_query_ids({'node': '/c/en/nonexistent'}, graph_store) == []
+
+
+def test_query_other_only(graph_store):
+    quiz_ids = get_query_ids({'other': '/c/en/quiz'}, graph_store)
+    assert quiz_ids
+    assert quiz_ids == get_query_ids({'end': '/c/en/quiz'}, graph_store)
+
+
+def test_query_other_only_matches_finder(graph_store, test_finder, run_build):
+    query = {'other': '/c/en/quiz'}
+    finder_ids = {match['@id'] for match in test_finder.query(query)}
+    assert set(get_query_ids(query, graph_store)) == finder_ids
+
+
+def test_lookup_grouped_by_feature(graph_store):
+    found = graph_store.lookup_grouped_by_feature('/c/en/test', limit=2)
+    assert list(found) == sorted(found)
+    for (direction, rel), edges in found.items():
+        assert 1 <= len(edges) <= 2
+        for edge in edges:
+            assert edge['rel']['@id'] == rel
+            assert edge['other']['@id'] in (edge['start']['@id'], edge['end']['@id'])
+
+
+def test_random_edges(graph_store):
+    results = graph_store.random_edges(limit=10)
+    assert len({edge['@id'] for edge in results}) == 10
+
+    quiz_ids = set(get_query_ids({'node': '/c/en/quiz'}, graph_store))
+    results = graph_store.random_edges(limit=100, criteria={'node': '/c/en/quiz'})
+    assert {edge['@id'] for edge in results} == quiz_ids
+
+
+def test_pickle(graph_store):
+    unpickled = pickle.loads(pickle.dumps(graph_store))
+    assert unpickled.lookup('/c/en/quiz') == graph_store.lookup('/c/en/quiz')
+    assert len(unpickled.random_edges(limit=5)) == 5
+
+
+def test_neighborhood(graph_store):
+    distances, edges = graph_store.neighborhood('/c/en/quiz', hops=2, per_hop_limit=5)
+    assert distances['/c/en/quiz'] == 0
+    assert distances['/c/en/test'] == 1
+    assert max(distances.values()) == 2
+    for edge in edges:
+        assert edge['other']['@id'] in (edge['start']['@id'], edge['end']['@id'])
+
+    distances, edges = graph_store.neighborhood(
+        '/c/en/quiz', hops=1, rel_filter='/r/Synonym'
+    )
+    assert edges and all(edge['rel']['@id'] == '/r/Synonym' for edge in edges)
+
+
+def test_random_walks(graph_store):
+    walks = graph_store.random_walks('/c/en/quiz', length=3, num_walks=5)
+    assert len(walks) == 5
+    for walk in walks:
+        assert 1 <= len(walk) <= 3
+        node = '/c/en/quiz'
+        for edge in walk:
+            assert node in (uri_prefix(edge['start']['@id']), uri_prefix(edge['end']['@id']))
+            node = uri_prefix(edge['other']['@id'])
+
+
+def test_shortest_path(graph_store):
+    path = graph_store.shortest_path('/c/en/quiz', '/c/en/quiz/n')
+    assert path == []
+    path = graph_store.shortest_path('/c/fi/koe', '/c/en/quiz')
+    assert path
+    assert uri_prefix(path[-1]['other']['@id']) == '/c/en/quiz'
+    assert len(graph_store.shortest_path('/c/fi/koe', '/c/en/quiz', weighted=False)) <= len(path)
+    assert graph_store.shortest_path('/c/en/quiz', '/c/en/nonexistent') is None
+
+
+def test_filter_criteria(graph_store):
+    found = graph_store.query({'node': '/c/en/test', 'min_weight': '2'}, limit=100)
+    assert found and all(edge['weight'] >= 2 for edge in found)
+    assert len(found) < len(graph_store.query({'node': '/c/en/test'}, limit=100))
+
+    found = graph_store.query({'node': '/c/en/test', 'language': 'ja'}, limit=100)
+    assert found
+    for edge in found:
+        assert '/c/ja/' in edge['start']['@id'] + ' ' + edge['end']['@id']
+
+    found = graph_store.query({'node': '/c/en/test', 'exclude_rel': '/r/Synonym'}, limit=100)
+    assert found and all(edge['rel']['@id'] != '/r/Synonym' for edge in found)
+
+
+def test_stream_query(graph_store):
+    criteria = {'rel': '/r/Synonym'}
+    streamed = list(graph_store.stream_query(criteria))
+    assert len(streamed) > 100
+    assert streamed[:100] == graph_store.query(criteria, limit=100)
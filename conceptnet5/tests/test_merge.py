@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conceptnet5.vectors.formats import save_hdf
+from conceptnet5.vectors.merge import (
+    concat_intersect,
+    dataframe_svd_projection,
+    merge_intersect,
+    randomized_svd,
+)
+
+
+@pytest.fixture
+def frame_filenames(tmp_path):
+    rng = np.random.RandomState(0)
+    frames = [
+        pd.DataFrame(
+            rng.normal(size=(4, 3)).astype('f'),
+            index=['/c/en/dog', '/c/en/cat', '/c/fr/chat', '/c/en/bird'],
+        ),
+        pd.DataFrame(
+            rng.normal(size=(5, 2)).astype('f'),
+            index=['/c/fr/chat', '/c/en/fish', '/c/en/cat', '/c/en/dog', '/c/de/hund'],
+        ),
+    ]
+    filenames = []
+    for i, frame in enumerate(frames):
+        filename = str(tmp_path / 'frame{}.h5'.format(i))
+        save_hdf(frame, filename, chunked=(i == 1))
+        filenames.append(filename)
+    return frames, filenames
+
+
+@pytest.mark.parametrize('memmap', [False, True])
+def test_concat_intersect(frame_filenames, tmp_path, memmap):
+    frames, filenames = frame_filenames
+    memmap_filename = str(tmp_path / 'joined.npy') if memmap else None
+    joined = concat_intersect(filenames, memmap_filename=memmap_filename, block_rows=2)
+
+    expected = pd.concat(frames, axis=1, join='inner').sort_index()
+    assert list(joined.index) == ['/c/en/cat', '/c/en/dog', '/c/fr/chat']
+    assert joined.shape == (3, 5)
+    assert np.array_equal(joined.values, expected.values)
+    if memmap:
+        assert np.array_equal(np.load(memmap_filename), expected.values)
+
+
+def test_randomized_svd_accuracy(tmp_path):
+    # A matrix whose singular values decay, like those of word vectors, plus
+    # some noise
+    rng = np.random.RandomState(1)
+    left, _ = np.linalg.qr(rng.normal(size=(2000, 100)))
+    right, _ = np.linalg.qr(rng.normal(size=(150, 100)))
+    spectrum = 100 * 0.9 ** np.arange(100)
+    matrix = (left * spectrum) @ right.T + rng.normal(scale=0.01, size=(2000, 150))
+    memmap_filename = str(tmp_path / 'matrix.npy')
+    np.save(memmap_filename, matrix)
+    matrix = np.load(memmap_filename, mmap_mode='r')
+
+    k = 20
+    U_exact, Σ_exact, Vt_exact = np.linalg.svd(matrix, full_matrices=False)
+    U, Σ, Vt = randomized_svd(matrix, k, block_rows=300)
+    assert U.shape == (2000, k)
+    assert Vt.shape == (k, 150)
+    assert np.allclose(Σ, Σ_exact[:k], rtol=1e-4)
+
+    # The singular vectors match the exact ones, up to sign
+    assert np.allclose(np.abs(np.sum(U * U_exact[:, :k], axis=0)), 1, atol=1e-3)
+    assert np.allclose(np.abs(np.sum(Vt * Vt_exact[:k], axis=1)), 1, atol=1e-3)
+
+    # The truncated reconstruction is as good as the exact truncated SVD's
+    exact_error = np.linalg.norm(matrix - (U_exact[:, :k] * Σ_exact[:k]) @ Vt_exact[:k])
+    error = np.linalg.norm(matrix - (U * Σ) @ Vt)
+    assert error <= exact_error * 1.001
+
+
+def test_merge_intersect_randomized_matches_exact(tmp_path):
+    # Frames shaped like the ones we merge in the build: four 300-dimensional
+    # embeddings of the same terms, which share a latent structure with
+    # decaying singular values, plus noise of their own
+    rng = np.random.RandomState(3)
+    nrows = 1500
+    labels = ['/c/en/term%d' % i for i in range(nrows)]
+    latent = rng.normal(size=(nrows, 400)) * (0.98 ** np.arange(400))
+    filenames = []
+    for i in range(4):
+        values = latent @ rng.normal(size=(400, 300)) + rng.normal(scale=0.1, size=(nrows, 300))
+        filename = str(tmp_path / 'frame{}.h5'.format(i))
+        save_hdf(pd.DataFrame(values.astype('f'), index=labels), filename)
+        filenames.append(filename)
+
+    # k + oversample is much smaller than the 1200 concatenated columns, so
+    # this uses the randomized SVD, while oversampling past the size of the
+    # matrix makes randomized_svd compute the exact SVD
+    merged, projection = merge_intersect(filenames, subsample=1, k=300, oversample=10)
+    exact, exact_projection = merge_intersect(filenames, subsample=1, k=300, oversample=nrows)
+    assert merged.shape == exact.shape == (nrows, 300)
+    assert projection.shape == exact_projection.shape == (1200, 300)
+
+    # The dimensions can differ in sign, but the similarities of terms that
+    # the merged vectors give are the same
+    similarities = merged.values[:200] @ merged.values.T
+    exact_similarities = exact.values[:200] @ exact.values.T
+    assert np.abs(similarities - exact_similarities).max() < 0.01
+
+
+def test_dataframe_svd_projection():
+    rng = np.random.RandomState(2)
+    frame = pd.DataFrame(
+        rng.normal(size=(50, 8)), index=['/c/en/term%d' % i for i in range(50)]
+    )
+    uframe, Σ, vframe = dataframe_svd_projection(frame, 3, oversample=2)
+    assert uframe.shape == (50, 3)
+    assert vframe.shape == (8, 3)
+    assert uframe.index.equals(frame.index)
+    assert np.allclose(Σ, np.linalg.svd(frame.values, compute_uv=False)[:3], rtol=0.1)
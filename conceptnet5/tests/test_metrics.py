@@ -0,0 +1,50 @@
+import logging
+
+from conceptnet5 import metrics
+from conceptnet5.metrics import Counter, Histogram, log_slow_query
+
+
+def test_histogram_buckets():
+    timing = Histogram('test_seconds', 'Test timings', buckets=(0.1, 1))
+    for value in [0.05, 0.1, 0.5, 2]:
+        timing.observe(value, kind='test')
+    samples = {
+        (name, labels): value for name, labels, value in timing.samples()
+    }
+    assert samples['test_seconds_bucket', (('kind', 'test'), ('le', '0.1'))] == 2
+    assert samples['test_seconds_bucket', (('kind', 'test'), ('le', '1'))] == 3
+    assert samples['test_seconds_bucket', (('kind', 'test'), ('le', '+Inf'))] == 4
+    assert samples['test_seconds_count', (('kind', 'test'),)] == 4
+    assert samples['test_seconds_sum', (('kind', 'test'),)] == 2.65
+    assert timing.count(kind='test') == 4
+    assert timing.count(kind='other') == 0
+
+
+def test_counter_labels():
+    lookups = Counter('test_lookups_total', 'Test lookups')
+    lookups.inc(cache='pages', result='hit')
+    lookups.inc(2, result='hit', cache='pages')
+    lookups.inc(cache='pages', result='miss')
+    assert lookups.get(cache='pages', result='hit') == 3
+    assert lookups.get(cache='pages', result='miss') == 1
+    assert lookups.get(cache='other', result='hit') == 0
+
+
+def test_render_escapes_labels():
+    registry = {}
+    lookups = metrics.counter('test_escaped_total', 'Test escaping', registry=registry)
+    lookups.inc(uri='/c/en/"quoted"\\')
+    rendered = metrics.render_metrics(registry)
+    assert 'test_escaped_total' not in metrics.METRICS
+    assert 'test_escaped_total{uri="/c/en/\\"quoted\\"\\\\"} 1\n' in rendered
+
+
+def test_slow_query_log(monkeypatch, caplog):
+    monkeypatch.setattr(metrics, 'SLOW_QUERY_SECONDS', 0.5)
+    with caplog.at_level(logging.WARNING, logger='conceptnet5.slow_queries'):
+        log_slow_query('gin_1way', 0.1, {'query': '{"rel": "/r/IsA"}'})
+        log_slow_query('gin_2way', 1.5, {'query_forward': '{"start": "/c/en/dog"}'})
+    assert len(caplog.records) == 1
+    message = caplog.records[0].getMessage()
+    assert 'gin_2way' in message
+    assert '/c/en/dog' in message
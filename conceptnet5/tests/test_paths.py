@@ -0,0 +1,43 @@
+import numpy as np
+
+from conceptnet5.db.paths import NodeGraph, pair_edge_nodes
+
+
+def make_graph():
+    # 0 - 1 - 2 - 3 is a chain of strong edges, and 0 - 3 is one weak edge
+    # with a different relation
+    return NodeGraph(
+        starts=np.array([0, 1, 2, 0, 4]),
+        ends=np.array([1, 2, 3, 3, 4]),
+        rel_ids=np.array([0, 0, 0, 1, 0]),
+        edge_ids=np.array([10, 11, 12, 13, 14]),
+        weights=np.array([2., 2., 2., 0.1, 1.]),
+    )
+
+
+def test_shortest_path():
+    graph = make_graph()
+    assert graph.shortest_path(0, 3) == [10, 11, 12]
+    assert graph.shortest_path(3, 0) == [12, 11, 10]
+    assert graph.shortest_path(0, 3, weighted=False) == [13]
+    assert graph.shortest_path(0, 3, max_depth=2) == [13]
+    assert graph.shortest_path(0, 3, rel_ids=[1]) == [13]
+    assert graph.shortest_path(0, 3, rel_ids=[0], max_depth=2) is None
+    assert graph.shortest_path(0, 0) == []
+
+    # Node 4 only has an edge to itself, which is left out
+    assert graph.shortest_path(0, 4) is None
+    assert graph.shortest_path(0, 99) is None
+
+
+def test_pair_edge_nodes():
+    graph = pair_edge_nodes(
+        edge_ids=np.array([7, 5, 7, 5, 6]),
+        directions=np.array([-1, 0, 1, 0, 1], dtype=np.int8),
+        nodes=np.array([2, 0, 1, 1, 3]),
+        rel_ids=np.array([0, 1, 0, 1, 0]),
+        weights=np.array([1., 1., 1., 1., 1.], dtype=np.float32),
+    )
+    # Edge 6 only has one row, so it isn't in the graph
+    assert sorted(graph.edge_ids.tolist()) == [5, 5, 7, 7]
+    assert graph.shortest_path(0, 2) == [5, 7]
@@ -531,7 +531,8 @@ def single_test_sharded_propagate():
     # We patch several functions with mock objects:  sharded_propagate reads
     # an assoc edge file, so we patch builtins.open to give sharded_propagate
     # the test data graph as that input.  It reads an embedding (a dataframe)
-    # as well, and we patch load_hdf to give it the test data frame.  It writes
+    # as well, and we patch load_index and load_columns to give it the labels
+    # and the columns of the test data frame.  It writes
     # a shard file for each shard, so we patch save_hdf with a mock object
     # that we will later query to retrieve the output shards for testing.
     # Finally we patch make_adjacency_matrix with a mock object that returns
@@ -543,7 +544,13 @@ def single_test_sharded_propagate():
     with patch('builtins.open', return_value=io.StringIO(ASSOC_FILE_CONTENTS)), patch(
         'conceptnet5.vectors.propagate.make_adjacency_matrix',
         return_value=(ADJACENCY_MATRIX, COMBINED_INDEX, len(NEW_ENGLISH_TERMS)),
-    ), patch('conceptnet5.vectors.propagate.load_hdf', return_value=FRAME), patch(
+    ), patch(
+        'conceptnet5.vectors.propagate.load_index',
+        side_effect=lambda filename, axis=0: FRAME.axes[axis],
+    ), patch(
+        'conceptnet5.vectors.propagate.load_columns',
+        side_effect=lambda filename, start, stop: FRAME.iloc[:, start:stop].copy(),
+    ), patch(
         'conceptnet5.vectors.propagate.save_hdf', shard_collector
     ):
         sharded_propagate(
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+from conceptnet5.builders.reduce_assoc import (
+    ConceptNetAssociationGraphForReduction,
+    reduce_assoc,
+)
+from conceptnet5.vectors.formats import save_hdf
+
+ASSOCIATIONS = [
+    ('/c/en/dog', '/c/en/cat', '1.0', '/d/test', '/r/RelatedTo'),
+    ('/c/en/cat', '/c/fr/chat', '2.0', '/d/test', '/r/Synonym'),
+    ('/c/en/dog', '/c/en/cat', '1.0', '/d/other', '/r/RelatedTo'),
+    ('/c/en/fish', '/c/fr/poisson/n', '1.0', '/d/test', '/r/Synonym'),
+    ('/c/en/fish', '/c/en/dog', '0.5', '/d/test', '/r/Antonym'),
+    ('/c/en/cat', '/c/en/cat/n', '1.0', '/d/test', '/r/RelatedTo'),
+]
+
+
+def write_assoc(filename):
+    with open(filename, 'w', encoding='utf-8') as out:
+        for assoc in ASSOCIATIONS:
+            print(*assoc, sep='\t', file=out)
+
+
+def test_graph_components(tmp_path):
+    filename = str(tmp_path / 'assoc.csv')
+    write_assoc(filename)
+    graph = ConceptNetAssociationGraphForReduction.from_csv(filename)
+
+    # The negative edge and the edge between two senses of the same concept
+    # are skipped, and the sense is removed from /c/fr/poisson/n
+    assert list(graph.vertices()) == [
+        '/c/en/dog', '/c/en/cat', '/c/fr/chat', '/c/en/fish', '/c/fr/poisson'
+    ]
+    assert list(graph.edges()) == [
+        ('/c/en/dog', '/c/en/cat', '1.0', '/d/test', '/r/RelatedTo'),
+        ('/c/en/cat', '/c/fr/chat', '2.0', '/d/test', '/r/Synonym'),
+        ('/c/en/dog', '/c/en/cat', '1.0', '/d/other', '/r/RelatedTo'),
+        ('/c/en/fish', '/c/fr/poisson', '1.0', '/d/test', '/r/Synonym'),
+    ]
+    adjacency = graph.adjacency_matrix()
+    assert (adjacency != adjacency.T).nnz == 0
+    assert adjacency.nnz == 6
+
+    labels = graph.find_components()
+    assert labels['/c/en/dog'] == labels['/c/en/cat'] == labels['/c/fr/chat']
+    assert labels['/c/en/fish'] == labels['/c/fr/poisson']
+    assert labels['/c/en/dog'] != labels['/c/en/fish']
+    assert list(graph.component_labels()) == [labels[v] for v in graph.vertices()]
+
+    good = graph.good_vertices(pd.Index(['/c/fr/poisson', '/c/de/fisch']))
+    assert good.tolist() == [False, False, False, True, True]
+
+
+def test_reduce_assoc(tmp_path):
+    assoc_filename = str(tmp_path / 'assoc.csv')
+    write_assoc(assoc_filename)
+    embedding_filename = str(tmp_path / 'vectors.h5')
+    save_hdf(pd.DataFrame(np.ones((1, 2)), index=['/c/fr/chat']), embedding_filename)
+    output_filename = str(tmp_path / 'reduced.csv')
+    reduce_assoc(
+        assoc_filename, [embedding_filename], output_filename, cutoff=1, en_cutoff=1
+    )
+    with open(output_filename, encoding='utf-8') as infile:
+        lines = [line.rstrip('\n').split('\t') for line in infile]
+    assert lines == [list(assoc) for assoc in ASSOCIATIONS[:3]]
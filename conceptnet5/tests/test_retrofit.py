@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conceptnet5.vectors.formats import (
+    load_columns,
+    load_hdf,
+    load_index,
+    load_rows,
+    save_hdf,
+)
+from conceptnet5.vectors.retrofit import join_shards, sharded_retrofit
+
+ASSOCIATIONS = [
+    ('/c/en/dog', '/c/en/cat', 1.0),
+    ('/c/en/dog', '/c/en/puppy', 2.0),
+    ('/c/en/cat', '/c/en/kitten', 2.0),
+    ('/c/en/puppy', '/c/fr/chiot', 1.0),
+    ('/c/en/kitten', '/c/fr/chaton', 1.0),
+    ('/c/en/dog', '/c/fr/chien', 1.5),
+]
+
+
+@pytest.fixture
+def retrofit_inputs(tmp_path):
+    rng = np.random.RandomState(0)
+    frame = pd.DataFrame(
+        rng.normal(size=(4, 12)).astype('f'),
+        index=['/c/en/cat', '/c/en/dog', '/c/en/kitten', '/c/fr/chien'],
+    )
+    dense_filename = str(tmp_path / 'vectors.h5')
+    save_hdf(frame, dense_filename)
+
+    assoc_filename = str(tmp_path / 'reduced.csv')
+    with open(assoc_filename, 'w', encoding='utf-8') as out:
+        for left, right, weight in ASSOCIATIONS:
+            print(left, right, weight, '/d/test', '/r/RelatedTo', sep='\t', file=out)
+    return frame, dense_filename, assoc_filename
+
+
+@pytest.mark.parametrize('chunked', [False, True])
+def test_partial_loading(retrofit_inputs, tmp_path, chunked):
+    frame = retrofit_inputs[0]
+    filename = str(tmp_path / 'saved.h5')
+    save_hdf(frame, filename, chunked=chunked)
+    assert load_hdf(filename).equals(frame)
+    assert list(load_index(filename)) == list(frame.index)
+    assert list(load_index(filename, axis=1)) == list(frame.columns)
+
+    columns = load_columns(filename, 3, 7)
+    assert list(columns.columns) == [3, 4, 5, 6]
+    assert columns.equals(frame.iloc[:, 3:7])
+
+    rows = load_rows(filename, 1, 3)
+    assert list(rows.index) == ['/c/en/dog', '/c/en/kitten']
+    assert rows.equals(frame.iloc[1:3])
+    assert load_rows(filename, 2, 2).shape == (0, 12)
+
+
+@pytest.mark.parametrize('processes', [1, 3])
+def test_sharded_retrofit(retrofit_inputs, tmp_path, processes):
+    frame, dense_filename, assoc_filename = retrofit_inputs
+    output_filename = str(tmp_path / 'retrofit.h5')
+    sharded_retrofit(
+        dense_filename, assoc_filename, output_filename, nshards=3, processes=processes
+    )
+    shards = [load_hdf(output_filename + '.shard%d' % i) for i in range(3)]
+    join_shards(output_filename, nshards=3)
+    retrofitted = load_hdf(output_filename)
+
+    assert [shard.shape for shard in shards] == [(7, 4)] * 3
+    assert list(retrofitted.index[:4]) == list(frame.index)
+    assert '/c/fr/chaton' in retrofitted.index
+    assert np.allclose(np.linalg.norm(retrofitted.values, axis=1), 1)
+
+
+def test_parallel_retrofit_matches(retrofit_inputs, tmp_path):
+    _, dense_filename, assoc_filename = retrofit_inputs
+    results = []
+    for processes in (1, 2):
+        output_filename = str(tmp_path / 'retrofit{}.h5'.format(processes))
+        sharded_retrofit(
+            dense_filename, assoc_filename, output_filename, nshards=2, processes=processes
+        )
+        results.append([load_hdf(output_filename + '.shard%d' % i) for i in range(2)])
+    for sequential, parallel in zip(*results):
+        assert sequential.index.equals(parallel.index)
+        assert np.allclose(sequential.values, parallel.values)
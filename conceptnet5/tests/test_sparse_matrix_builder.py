@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from conceptnet5.vectors.sparse_matrix_builder import SparseMatrixBuilder
+
+ENTRIES = [(0, 1, 1.0), (1, 0, 2.0), (2, 2, 0.5), (0, 1, 3.0), (3, 0, 1.5)]
+
+
+@pytest.mark.parametrize('spill', [False, True])
+def test_builder_sums_duplicates(tmp_path, spill):
+    builder = SparseMatrixBuilder(chunk_size=2, spill_dir=tmp_path if spill else None)
+    for row, col, value in ENTRIES:
+        builder[row, col] = value
+    builder.add_many([1, 3], [3, 0], 0.25)
+    assert len(builder) == 7
+    if spill:
+        assert len(list(tmp_path.iterdir())) == 1
+
+    expected = np.zeros((4, 5))
+    for row, col, value in ENTRIES + [(1, 3, 0.25), (3, 0, 0.25)]:
+        expected[row, col] += value
+    matrix = builder.tocsr((4, 5))
+    assert matrix.format == 'csr'
+    assert np.array_equal(matrix.toarray(), expected)
+
+    builder.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_builder_dtype():
+    builder = SparseMatrixBuilder()
+    assert builder.tocsr((2, 2)).nnz == 0
+    builder.add_many(np.array([0, 1, 1]), np.array([1, 0, 0]), 1)
+    matrix = builder.tocsr((2, 2), dtype=np.int8)
+    assert matrix.dtype == np.int8
+    assert np.array_equal(matrix.toarray(), [[0, 1], [2, 0]])
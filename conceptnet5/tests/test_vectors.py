@@ -5,7 +5,7 @@ import pandas as pd
 import pytest
 
 from conceptnet5.uri import is_term
-from conceptnet5.vectors import get_vector
+from conceptnet5.vectors import get_vector, transforms
 from conceptnet5.vectors.transforms import (
     l1_normalize_columns,
     l2_normalize_rows,
@@ -86,6 +86,31 @@ def test_standardize_row_labels(simple_frame):
     assert '/c/en/##' in standardized_vectors.index
 
 
+def test_standardize_row_labels_forms(simple_frame, monkeypatch):
+    # Lemmatize without the Wiktionary database
+    lemmas = {'/c/en/figure_skater': '/c/en/figure'}
+    monkeypatch.setattr(
+        transforms, 'lemmatize_uris', lambda uris: [lemmas.get(uri, uri) for uri in uris]
+    )
+    without_forms = standardize_row_labels(simple_frame.copy(), forms=False)
+    with_forms = standardize_row_labels(simple_frame.copy())
+
+    # Half of the inflected word's weight and vector go to its lemma
+    assert with_forms.index.equals(without_forms.index)
+    figure = (1 / 4) * np.array([3, 3, 4]) + (1 / 12) * np.array([2, 3, 5])
+    assert np.allclose(with_forms.loc['/c/en/figure'], figure / (1 / 4 + 1 / 12))
+    assert with_forms.loc['/c/en/figure_skater'].equals(
+        without_forms.loc['/c/en/figure_skater']
+    )
+
+
+def test_standardize_row_labels_parallel(simple_frame, monkeypatch):
+    sequential = standardize_row_labels(simple_frame.copy(), forms=False)
+    monkeypatch.setattr(transforms, 'PARALLEL_MIN_LABELS', 1)
+    parallel = standardize_row_labels(simple_frame.copy(), forms=False, processes=2)
+    assert parallel.equals(sequential)
+
+
 def test_l1_normalize_columns(simple_frame):
     normalized = l1_normalize_columns(simple_frame)
     sums = np.sum(np.abs(normalized))
@@ -57,6 +57,7 @@ def filter_word_vectors(dense_hdf_filename, vocab_filename):
 @click.option('--verbose', '-v', count=True)
 @click.option('--max_cleanup_iters', '-m', default=20)
 @click.option('--orig_vec_weight', '-w', default=0.15)
+@click.option('--processes', '-p', default=1, help='How many shards to retrofit at once')
 def run_retrofit(
     dense_hdf_filename,
     conceptnet_filename,
@@ -66,6 +67,7 @@ def run_retrofit(
     verbose=0,
     max_cleanup_iters=20,
     orig_vec_weight=0.15,
+    processes=1,
 ):
     """
     Run retrofit, operating on a part of a frame at a time.
@@ -79,6 +81,7 @@ def run_retrofit(
         verbosity=verbose,
         max_cleanup_iters=max_cleanup_iters,
         orig_vec_weight=orig_vec_weight,
+        processes=processes,
     )
 
 
@@ -86,8 +89,9 @@ def run_retrofit(
 @click.argument('glove_filename', type=click.Path(readable=True, dir_okay=False))
 @click.argument('output_filename', type=click.Path(writable=True, dir_okay=False))
 @click.option('--nrows', '-n', default=500000)
-def run_convert_glove(glove_filename, output_filename, nrows=500000):
-    convert_glove(glove_filename, output_filename, nrows)
+@click.option('--processes', '-p', default=1, help='How many processes to standardize labels with')
+def run_convert_glove(glove_filename, output_filename, nrows=500000, processes=1):
+    convert_glove(glove_filename, output_filename, nrows, processes=processes)
 
 
 @cli.command(name='convert_fasttext')
@@ -95,26 +99,32 @@ def run_convert_glove(glove_filename, output_filename, nrows=500000):
 @click.argument('output_filename', type=click.Path(writable=True, dir_okay=False))
 @click.option('--nrows', '-n', default=500000)
 @click.option('--language', '-l', default='en')
+@click.option('--processes', '-p', default=1, help='How many processes to standardize labels with')
 def run_convert_fasttext(
-    fasttext_filename, output_filename, nrows=500000, language='en'
+    fasttext_filename, output_filename, nrows=500000, language='en', processes=1
 ):
-    convert_fasttext(fasttext_filename, output_filename, nrows=nrows, language=language)
+    convert_fasttext(
+        fasttext_filename, output_filename, nrows=nrows, language=language,
+        processes=processes
+    )
 
 
 @cli.command(name='convert_word2vec')
 @click.argument('word2vec_filename', type=click.Path(readable=True, dir_okay=False))
 @click.argument('output_filename', type=click.Path(writable=True, dir_okay=False))
 @click.option('--nrows', '-n', default=500000)
-def run_convert_word2vec(word2vec_filename, output_filename, nrows=500000):
-    convert_word2vec(word2vec_filename, output_filename, nrows)
+@click.option('--processes', '-p', default=1, help='How many processes to standardize labels with')
+def run_convert_word2vec(word2vec_filename, output_filename, nrows=500000, processes=1):
+    convert_word2vec(word2vec_filename, output_filename, nrows, processes=processes)
 
 
 @cli.command(name='convert_polyglot')
 @click.argument('polyglot_filename', type=click.Path(readable=True, dir_okay=False))
 @click.argument('output_filename', type=click.Path(writable=True, dir_okay=False))
 @click.option('--language', '-l')
-def run_convert_polyglot(polyglot_filename, output_filename, language):
-    convert_polyglot(polyglot_filename, output_filename, language)
+@click.option('--processes', '-p', default=1, help='How many processes to standardize labels with')
+def run_convert_polyglot(polyglot_filename, output_filename, language, processes=1):
+    convert_polyglot(polyglot_filename, output_filename, language, processes=processes)
 
 
 @cli.command(name='intersect')
@@ -123,11 +133,28 @@ def run_convert_polyglot(polyglot_filename, output_filename, language):
 )
 @click.argument('output_filename', type=click.Path(writable=True, dir_okay=False))
 @click.argument('projection_filename', type=click.Path(writable=True, dir_okay=False))
-def run_intersect(input_filenames, output_filename, projection_filename):
+@click.option(
+    '--memmap',
+    type=click.Path(writable=True, dir_okay=False),
+    help='Keep the concatenated vectors in this temporary file instead of in memory',
+)
+@click.option(
+    '--oversample', default=10, help='Extra random directions to use in the randomized SVD'
+)
+@click.option(
+    '--power-iters', default=4, help='How many power iterations the randomized SVD uses'
+)
+def run_intersect(
+    input_filenames, output_filename, projection_filename, memmap=None, oversample=10,
+    power_iters=4
+):
     """
     Combine the vector knowledge contained in frames.
     """
-    intersected, projection = merge_intersect(input_filenames)
+    intersected, projection = merge_intersect(
+        input_filenames, memmap_filename=memmap, oversample=oversample,
+        power_iters=power_iters
+    )
     save_hdf(intersected, output_filename)
     save_hdf(projection, projection_filename)
 
@@ -264,12 +291,16 @@ def run_comparison_graph(table_filename, eval_graph_filename):
 @click.argument('input_filename', type=click.Path(readable=True, dir_okay=False))
 @click.argument('output_filename', type=click.Path(writable=True, dir_okay=False))
 @click.option('--language', '-l', default=None)
-def run_export(input_filename, output_filename, language):
+@click.option('--processes', '-p', default=1, help='How many processes to compress with')
+@click.option('--compresslevel', default=9, help='The gzip compression level, from 1 to 9')
+def run_export(input_filename, output_filename, language, processes, compresslevel):
     """
     Export a frame to a fastText-style text file.
     """
     frame = load_hdf(input_filename)
-    export_text(frame, output_filename, language)
+    export_text(
+        frame, output_filename, language, processes=processes, compresslevel=compresslevel
+    )
 
 
 @cli.command(name='miniaturize')
@@ -1,32 +1,160 @@
+import collections
 import gzip
+import itertools
+import multiprocessing
+import os
 import pickle
-import struct
+import warnings
 
 import numpy as np
 import pandas as pd
+import tables
 
 from ordered_set import OrderedSet
 
 from .transforms import l1_normalize_columns, l2_normalize_rows, standardize_row_labels
 
 
+# Frames saved with `chunked=True` are stored as these nodes: a chunked
+# float32 array of the vectors, and the row and column labels as UTF-8 text,
+# one label per line, with the byte offsets where each line starts
+CHUNKED_VECTORS = 'vectors'
+CHUNKED_LABELS = 'labels'
+CHUNKED_COLUMNS = 'columns'
+
+# The shape of the chunks of the vectors array, in rows and columns. A chunk
+# of 16384 x 32 float32 values is 2 MB.
+CHUNK_SHAPE = (16384, 32)
+
+
+def is_chunked_hdf(filename):
+    """
+    Check whether an HDF5 file holds a frame saved with `chunked=True`.
+    """
+    with tables.open_file(filename, 'r') as h5:
+        return '/' + CHUNKED_VECTORS in h5
+
+
+def _read_text_labels(h5, name, rows=slice(None)):
+    offsets = h5.get_node('/', name + '_offsets')
+    start, stop, _step = rows.indices(offsets.nrows - 1)
+    labels = []
+    if start < stop:
+        text_start, text_end = offsets[start], offsets[stop] - 1
+        text = h5.get_node('/', name)[text_start:text_end].tobytes().decode('utf-8')
+        labels = text.split('\n')
+    if h5.get_node('/', name).attrs.integer:
+        return pd.Index([int(label) for label in labels])
+    return pd.Index(labels)
+
+
+def _write_text_labels(h5, name, labels):
+    lines = [str(label).encode('utf-8') + b'\n' for label in labels]
+    offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+    np.cumsum([len(line) for line in lines], out=offsets[1:])
+    text = h5.create_array('/', name, np.frombuffer(b''.join(lines), dtype=np.uint8))
+    text.attrs.integer = pd.api.types.is_integer_dtype(labels)
+    h5.create_array('/', name + '_offsets', offsets)
+
+
+def _read_chunked(filename, rows=slice(None), columns=slice(None)):
+    with tables.open_file(filename, 'r') as h5:
+        index = _read_text_labels(h5, CHUNKED_LABELS, rows)
+        column_index = _read_text_labels(h5, CHUNKED_COLUMNS, columns)
+        matrix = h5.get_node('/', CHUNKED_VECTORS)[rows, columns]
+    return pd.DataFrame(matrix, index=index, columns=column_index)
+
+
 def load_hdf(filename):
     """
     Load a semantic vector space from an HDF5 file.
 
     HDF5 is a complex format that can contain many instances of different kinds
     of data. The convention we use is that the file contains one labeled
-    matrix, named "mat".
+    matrix, named "mat", or, for files saved with `chunked=True`, a chunked
+    array named "vectors" with its labels.
     """
+    if is_chunked_hdf(filename):
+        return _read_chunked(filename)
     return pd.read_hdf(filename, 'mat', encoding='utf-8')
 
 
-def save_hdf(table, filename):
+def load_index(filename, axis=0):
+    """
+    Load just the labels of a semantic vector space in an HDF5 file: the
+    row labels if `axis` is 0, or the column labels if `axis` is 1.
+    """
+    if is_chunked_hdf(filename):
+        with tables.open_file(filename, 'r') as h5:
+            return _read_text_labels(h5, (CHUNKED_LABELS, CHUNKED_COLUMNS)[axis])
+    with pd.HDFStore(filename, 'r') as store:
+        return store.get_storer('mat').read_index('axis%d' % (1 - axis))
+
+
+def load_rows(filename, start=None, stop=None):
+    """
+    Load the rows from `start` to `stop` of a semantic vector space in an
+    HDF5 file, without reading the rest of its matrix into memory.
+    """
+    if is_chunked_hdf(filename):
+        return _read_chunked(filename, rows=slice(start, stop))
+    return pd.read_hdf(filename, 'mat', start=start, stop=stop)
+
+
+def load_columns(filename, start=None, stop=None):
+    """
+    Load the columns from `start` to `stop` of a semantic vector space in an
+    HDF5 file, without reading the rest of its matrix into memory.
+
+    In a file that `save_hdf` wrote without chunking, a frame of vectors is
+    stored as a single block of values, which we slice. Frames that are
+    stored in some other way are loaded completely and then sliced.
+    """
+    if is_chunked_hdf(filename):
+        return _read_chunked(filename, columns=slice(start, stop))
+    with pd.HDFStore(filename, 'r') as store:
+        storer = store.get_storer('mat')
+        if getattr(storer, 'nblocks', None) != 1:
+            return load_hdf(filename).iloc[:, start:stop].copy()
+        index = storer.read_index('axis1')
+        columns = storer.read_index('axis0')[start:stop]
+        values = storer.group.block0_values
+        if getattr(values._v_attrs, 'transposed', False):
+            matrix = values[:, start:stop]
+        else:
+            matrix = values[start:stop, :].T
+    return pd.DataFrame(matrix, index=index, columns=columns)
+
+
+def save_hdf(table, filename, chunked=False):
     """
     Save a semantic vector space into an HDF5 file, following the convention
     of storing it as a labeled matrix named 'mat'.
-    """
-    return table.to_hdf(filename, 'mat', mode='w', encoding='utf-8')
+
+    With `chunked=True`, the vectors are instead stored as a chunked float32
+    array, so that `load_rows` and `load_columns` only read the chunks they
+    need. Files in this format can only be read by the functions here, not
+    by `pd.read_hdf`, so we use it for intermediate files.
+    """
+    if not chunked:
+        return table.to_hdf(filename, 'mat', mode='w', encoding='utf-8')
+
+    values = table.values
+    nrows, ncols = values.shape
+    chunkshape = tuple(max(1, min(size, chunk)) for size, chunk in zip(values.shape, CHUNK_SHAPE))
+    with tables.open_file(filename, 'w') as h5:
+        vectors = h5.create_earray(
+            '/',
+            CHUNKED_VECTORS,
+            tables.Float32Atom(),
+            shape=(0, ncols),
+            chunkshape=chunkshape,
+            expectedrows=nrows,
+        )
+        for start in range(0, nrows, chunkshape[0]):
+            vectors.append(values[start : start + chunkshape[0]])
+        _write_text_labels(h5, CHUNKED_LABELS, table.index)
+        _write_text_labels(h5, CHUNKED_COLUMNS, table.columns)
 
 
 def save_labels(table, vocab_filename):
@@ -50,11 +178,34 @@ def vec_to_text_line(label, vec):
     return ' '.join(cells)
 
 
-def export_text(frame, filename, filter_language=None):
+def _text_block(labels, vectors, compresslevel):
+    """
+    Format a block of labeled vectors as lines of text, the same way
+    `vec_to_text_line` does, and compress them as a gzip member.
+    """
+    row_format = ' '.join(['%s'] + ['%4.4f'] * vectors.shape[1])
+    text = ''.join(
+        row_format % (label, *vec) + '\n' for label, vec in zip(labels, vectors.tolist())
+    )
+    return gzip.compress(text.encode('utf-8'), compresslevel=compresslevel)
+
+
+def export_text(
+    frame, filename, filter_language=None, processes=1, block_rows=10000, compresslevel=9
+):
     """
     Save a semantic vector space as a fastText-style text file.
 
     If `filter_language` is set, it will output only vectors in that language.
+
+    The rows are formatted and compressed in blocks of `block_rows`. Each
+    block becomes its own gzip member, as with pigz's independent blocks; a
+    gzip file can be made of any number of these, and decompresses to the
+    same text as if it were compressed all at once. Setting `processes` to
+    more than 1 compresses that many blocks at a time, and `processes=None`
+    uses one process per CPU. A lower `compresslevel`, such as gzip's
+    default of 6, is many times faster than level 9 on this kind of text,
+    and makes files only slightly larger.
     """
     vectors = frame.values
     index = frame.index
@@ -68,42 +219,62 @@ def export_text(frame, filename, filter_language=None):
         vectors = frame.values
         index = frame.index
 
-    with gzip.open(filename, 'wt') as out:
-        dims = "%s %s" % frame.shape
-        print(dims, file=out)
-        for i in range(frame.shape[0]):
-            label = index[i]
+    def blocks():
+        for start in range(0, frame.shape[0], block_rows):
+            labels = list(index[start : start + block_rows])
             if filter_language is not None:
-                label = label.split('/', 3)[-1]
-            vec = vectors[i]
-            print(vec_to_text_line(label, vec), file=out)
-
-
-def convert_glove(glove_filename, output_filename, nrows):
+                labels = [label.split('/', 3)[-1] for label in labels]
+            yield labels, vectors[start : start + block_rows], compresslevel
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    with open(filename, 'wb') as out:
+        dims = "%s %s\n" % frame.shape
+        out.write(gzip.compress(dims.encode('utf-8'), compresslevel=compresslevel))
+        if processes <= 1:
+            for block in blocks():
+                out.write(_text_block(*block))
+            return
+
+        # Keep a few blocks in progress per process, and write them in order,
+        # so that we don't hold more than that in memory
+        with multiprocessing.Pool(processes) as pool:
+            pending = collections.deque()
+            for block in blocks():
+                pending.append(pool.apply_async(_text_block, block))
+                if len(pending) >= processes * 2:
+                    out.write(pending.popleft().get())
+            while pending:
+                out.write(pending.popleft().get())
+
+
+def convert_glove(glove_filename, output_filename, nrows, processes=1):
     """
     Convert GloVe data from a gzipped text file to an HDF5 dataframe.
     """
     glove_raw = load_glove(glove_filename, nrows)
-    glove_std = standardize_row_labels(glove_raw, forms=False)
+    glove_std = standardize_row_labels(glove_raw, forms=False, processes=processes)
     del glove_raw
     glove_normal = l2_normalize_rows(l1_normalize_columns(glove_std))
     del glove_std
     save_hdf(glove_normal, output_filename)
 
 
-def convert_fasttext(fasttext_filename, output_filename, nrows, language):
+def convert_fasttext(fasttext_filename, output_filename, nrows, language, processes=1):
     """
     Convert FastText data from a gzipped text file to an HDF5 dataframe.
     """
     ft_raw = load_fasttext(fasttext_filename, nrows)
-    ft_std = standardize_row_labels(ft_raw, forms=False, language=language)
+    ft_std = standardize_row_labels(
+        ft_raw, forms=False, language=language, processes=processes
+    )
     del ft_raw
     ft_normal = l2_normalize_rows(l1_normalize_columns(ft_std))
     del ft_std
     save_hdf(ft_normal, output_filename)
 
 
-def convert_word2vec(word2vec_filename, output_filename, nrows, language='en'):
+def convert_word2vec(word2vec_filename, output_filename, nrows, language='en', processes=1):
     """
     Convert word2vec data from its gzipped binary format to an HDF5
     dataframe.
@@ -112,7 +283,9 @@ def convert_word2vec(word2vec_filename, output_filename, nrows, language='en'):
         term_text = term.split('/')[3]
         return len(term_text) >= 3
     w2v_raw = load_word2vec_bin(word2vec_filename, nrows)
-    w2v_std = standardize_row_labels(w2v_raw, forms=False, language=language)
+    w2v_std = standardize_row_labels(
+        w2v_raw, forms=False, language=language, processes=processes
+    )
     del w2v_raw
     # word2vec believes stupid things about two-letter combinations, so filter
     # them out
@@ -127,16 +300,55 @@ def convert_word2vec(word2vec_filename, output_filename, nrows, language='en'):
     save_hdf(w2v_normal, output_filename)
 
 
-def convert_polyglot(polyglot_filename, output_filename, language):
+def convert_polyglot(polyglot_filename, output_filename, language, processes=1):
     """
     Convert Polyglot data from its pickled format to an HDF5 dataframe.
     """
     pg_raw = load_polyglot(polyglot_filename)
-    pg_std = standardize_row_labels(pg_raw, language, forms=False)
+    pg_std = standardize_row_labels(pg_raw, language, forms=False, processes=processes)
     del pg_raw
     save_hdf(pg_std, output_filename)
 
 
+# How many lines of a text file of vectors to parse at once
+TEXT_BLOCK_LINES = 10000
+
+# How many bytes of a binary file of vectors to read at once
+BINARY_BLOCK_SIZE = 1 << 22
+
+
+def _parse_vector_lines(lines, ncols):
+    """
+    Parse lines of the fastText/GloVe text format, each of which is a label
+    followed by `ncols` numbers separated by spaces. Returns the list of
+    labels and a float32 array of the vectors.
+
+    The numbers from all the lines are parsed by NumPy at once. If a line
+    doesn't look like it has `ncols` numbers, or NumPy can't parse them all,
+    we parse the lines one at a time instead, so that a bad line fails in
+    the same way it always has.
+    """
+    labels = []
+    texts = []
+    well_formed = True
+    for line in lines:
+        label, _space, text = line.rstrip().partition(' ')
+        labels.append(label)
+        texts.append(text)
+        well_formed = well_formed and text.count(' ') == ncols - 1
+    if well_formed:
+        with warnings.catch_warnings():
+            # NumPy warns when it stops at something that isn't a number
+            warnings.simplefilter('ignore', DeprecationWarning)
+            values = np.fromstring(' '.join(texts), dtype='d', sep=' ')
+        if len(values) == len(labels) * ncols:
+            return labels, values.reshape(len(labels), ncols).astype('f')
+    arr = np.zeros((len(labels), ncols), dtype='f')
+    for i, text in enumerate(texts):
+        arr[i] = [float(x) for x in text.split(' ')]
+    return labels, arr
+
+
 def load_glove(filename, max_rows=1000000):
     """
     Load a DataFrame from the GloVe text format, which is the same as the
@@ -146,16 +358,18 @@ def load_glove(filename, max_rows=1000000):
     arr = None
     label_list = []
     with gzip.open(filename, 'rt') as infile:
-        for i, line in enumerate(infile):
-            if i >= max_rows:
+        while len(label_list) < max_rows:
+            lines = list(
+                itertools.islice(infile, min(TEXT_BLOCK_LINES, max_rows - len(label_list)))
+            )
+            if not lines:
                 break
-            items = line.rstrip().split(' ')
-            label_list.append(items[0])
             if arr is None:
-                ncols = len(items) - 1
+                ncols = len(lines[0].rstrip().split(' ')) - 1
                 arr = np.zeros((max_rows, ncols), 'f')
-            values = [float(x) for x in items[1:]]
-            arr[i] = values
+            labels, values = _parse_vector_lines(lines, ncols)
+            arr[len(label_list) : len(label_list) + len(labels)] = values
+            label_list.extend(labels)
 
     if len(label_list) < max_rows:
         arr = arr[: len(label_list)]
@@ -174,43 +388,31 @@ def load_fasttext(filename, max_rows=1000000):
         nrows = min(int(nrows_str), max_rows)
         ncols = int(ncols_str)
         arr = np.zeros((nrows, ncols), dtype='f')
-        for line in infile:
-            if len(label_list) >= nrows:
+        while len(label_list) < nrows:
+            lines = list(
+                itertools.islice(infile, min(TEXT_BLOCK_LINES, nrows - len(label_list)))
+            )
+            if not lines:
                 break
-            items = line.rstrip().split(' ')
-            label = items[0]
-            if label != '</s>':
-                values = [float(x) for x in items[1:]]
-                arr[len(label_list)] = values
-                label_list.append(label)
+            labels, values = _parse_vector_lines(lines, ncols)
+            keep = [i for i, label in enumerate(labels) if label != '</s>']
+            arr[len(label_list) : len(label_list) + len(keep)] = values[keep]
+            label_list.extend(labels[i] for i in keep)
 
     if len(label_list) < max_rows:
         arr = arr[: len(label_list)]
     return pd.DataFrame(arr, index=label_list, dtype='f')
 
 
-def _read_until_space(file):
-    chars = []
-    while True:
-        newchar = file.read(1)
-        if newchar == b'' or newchar == b' ':
-            break
-        chars.append(newchar[0])
-    return bytes(chars).decode('utf-8', 'replace')
-
-
-def _read_vec(file, ndims):
-    fmt = 'f' * ndims
-    bytes_in = file.read(4 * ndims)
-    values = list(struct.unpack(fmt, bytes_in))
-    return np.array(values)
-
-
 def load_word2vec_bin(filename, nrows):
     """
     Load a DataFrame from word2vec's binary format. (word2vec's text format
     should be the same as fastText's, but it's less efficient to load the
     word2vec data that way.)
+
+    Each entry is a label, a space, and the vector as binary float32 values.
+    We read the file in large blocks and copy each vector straight from the
+    block into the array.
     """
     label_list = []
     arr = None
@@ -219,18 +421,36 @@ def load_word2vec_bin(filename, nrows):
         nrows_str, ncols_str = header.split()
         nrows = min(int(nrows_str), nrows)
         ncols = int(ncols_str)
+        vec_size = 4 * ncols
         arr = np.zeros((nrows, ncols), dtype='f')
+        block = b''
+        pos = 0
         while len(label_list) < nrows:
-            label = _read_until_space(infile)
-            vec = _read_vec(infile, ncols)
+            space = block.find(b' ', pos)
+            if space == -1 or space + 1 + vec_size > len(block):
+                more = infile.read(BINARY_BLOCK_SIZE)
+                if not more:
+                    break
+                block = block[pos:] + more
+                pos = 0
+                continue
+
+            # word2vec ends each vector with a newline, which isn't part of
+            # the next label
+            label = block[pos:space].lstrip(b'\n').decode('utf-8', 'replace')
+            vec_start = space + 1
+            pos = vec_start + vec_size
             if label == '</s>':
                 # Skip the word2vec sentence boundary marker, which will not
                 # correspond to anything in other data
                 continue
-            idx = len(label_list)
-            arr[idx] = vec
+            arr[len(label_list)] = np.frombuffer(
+                block, dtype='f', count=ncols, offset=vec_start
+            )
             label_list.append(label)
 
+    if len(label_list) < nrows:
+        arr = arr[: len(label_list)]
     return pd.DataFrame(arr, index=label_list, dtype='f')
 
 
@@ -0,0 +1,64 @@
+"""
+Tools for referring to labels, such as ConceptNet URIs, by integer IDs, so
+that graphs and matrices over them can be stored as arrays of ints instead of
+collections of strings.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class Interner:
+    """
+    Assigns consecutive integer IDs to labels, in the order they are first
+    added. The labels are stored once, in a single dict, no matter how many
+    times they are added.
+
+    >>> labels = Interner(['/c/en/cat'])
+    >>> labels.add('/c/en/dog'), labels.add('/c/en/cat')
+    (1, 0)
+    >>> list(labels)
+    ['/c/en/cat', '/c/en/dog']
+    """
+
+    def __init__(self, labels=()):
+        self.ids = {}
+        for label in labels:
+            self.add(label)
+
+    def add(self, label):
+        """
+        Get the ID of a label, giving it the next unused ID if it's new.
+        """
+        return self.ids.setdefault(label, len(self.ids))
+
+    def get(self, label, default=None):
+        """
+        Get the ID of a label, or `default` if it hasn't been added.
+        """
+        return self.ids.get(label, default)
+
+    def ids_of(self, labels):
+        """
+        Get a NumPy array of the IDs of the given labels, with -1 for labels
+        that haven't been added.
+        """
+        get = self.ids.get
+        return np.fromiter(
+            (get(label, -1) for label in labels), dtype=np.int32, count=len(labels)
+        )
+
+    def to_index(self):
+        """
+        Get a pandas Index of the labels, in order by ID.
+        """
+        return pd.Index(list(self.ids), dtype=object)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, label):
+        return label in self.ids
+
+    def __iter__(self):
+        return iter(self.ids)
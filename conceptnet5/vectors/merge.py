@@ -1,3 +1,5 @@
+import os
+
 import numpy as np
 import pandas as pd
 from sklearn.preprocessing import normalize
@@ -5,10 +7,74 @@ from sklearn.preprocessing import normalize
 from conceptnet5.languages import CORE_LANGUAGES
 from conceptnet5.uri import get_uri_language
 
-from .formats import load_hdf
+from .formats import load_hdf, load_index
+
+
+def _times(matrix, other, block_rows):
+    """
+    Multiply `matrix` by a small dense matrix, reading `block_rows` rows of
+    `matrix` at a time.
+    """
+    result = np.empty((matrix.shape[0], other.shape[1]))
+    for start in range(0, matrix.shape[0], block_rows):
+        result[start : start + block_rows] = matrix[start : start + block_rows] @ other
+    return result
+
+
+def _transpose_times(matrix, other, block_rows):
+    """
+    Multiply the transpose of `matrix` by a tall, thin matrix, reading
+    `block_rows` rows of `matrix` at a time.
+    """
+    result = np.zeros((matrix.shape[1], other.shape[1]))
+    for start in range(0, matrix.shape[0], block_rows):
+        stop = start + block_rows
+        result += matrix[start:stop].T @ other[start:stop]
+    return result
 
 
-def dataframe_svd_projection(frame, k):
+def randomized_svd(
+    matrix, k, oversample=10, power_iters=4, block_rows=100000, random_seed=0
+):
+    """
+    Get the top `k` singular values of a matrix and its singular vectors, as
+    `U, Σ, Vt`, like `np.linalg.svd(matrix, full_matrices=False)` truncated
+    to `k` components.
+
+    This uses the randomized range finder of Halko, Martinsson and Tropp,
+    "Finding structure with randomness" (2011): we project the matrix onto
+    `k + oversample` random directions, sharpen that projection with
+    `power_iters` power iterations, and take the exact SVD of the matrix
+    restricted to the small subspace we found. More oversampling and power
+    iterations make the result more accurate, and slower.
+
+    The matrix is only ever read `block_rows` rows at a time, so it can be a
+    memory-mapped array that's larger than memory. When `k + oversample`
+    isn't smaller than the matrix, this just computes the exact SVD.
+    """
+    nrows, ncols = matrix.shape
+    size = k + oversample
+    if size >= min(nrows, ncols):
+        U, Σ, Vt = np.linalg.svd(np.asarray(matrix), full_matrices=False)
+        return U[:, :k], Σ[:k], Vt[:k]
+
+    rng = np.random.RandomState(random_seed)
+    sample = _times(matrix, rng.normal(size=(ncols, size)), block_rows)
+    Q, _ = np.linalg.qr(sample)
+    del sample
+    for _iteration in range(power_iters):
+        # Orthonormalize between the multiplications, so that the smaller
+        # singular values don't get lost in rounding error
+        Z, _ = np.linalg.qr(_transpose_times(matrix, Q, block_rows))
+        Q, _ = np.linalg.qr(_times(matrix, Z, block_rows))
+
+    small = _transpose_times(matrix, Q, block_rows).T
+    U_small, Σ, Vt = np.linalg.svd(small, full_matrices=False)
+    U = Q @ U_small[:, :k]
+    return U, Σ[:k], Vt[:k]
+
+
+def dataframe_svd_projection(frame, k, oversample=10, power_iters=4):
     """
     Factor a dataframe into two matrices with `k` columns, using the labels
     from the dataframe as the row labels.
@@ -18,14 +84,19 @@ def dataframe_svd_projection(frame, k):
     k-dimensional vector to each column. One way to think of these is that
     `uframe` contains the rows of `frame` projected into a k-dimensional space,
     while `vframe` is the operation that projects those rows.
+
+    The factorization is a truncated SVD, computed by `randomized_svd` with
+    the given amounts of oversampling and power iterations.
     """
-    U, Σ, Vt = np.linalg.svd(frame.values, full_matrices=False)
-    uframe = pd.DataFrame(U[:, :k], index=frame.index, dtype='f')
-    vframe = pd.DataFrame(Vt.T[:, :k], index=frame.columns, dtype='f')
-    return uframe, Σ[:k], vframe
+    U, Σ, Vt = randomized_svd(
+        frame.values, k, oversample=oversample, power_iters=power_iters
+    )
+    uframe = pd.DataFrame(U, index=frame.index, dtype='f')
+    vframe = pd.DataFrame(Vt.T, index=frame.columns, dtype='f')
+    return uframe, Σ, vframe
 
 
-def concat_intersect(frame_filenames):
+def concat_intersect(frame_filenames, memmap_filename=None, block_rows=100000):
     """
     Find the intersection of the labels of all the frames in the given
     files , and concatenate the vectors that the frames have for each of
@@ -34,42 +105,55 @@ def concat_intersect(frame_filenames):
     This is exactly what `pd.concat` is for. However, `pd.concat` uses too
     much memory. We have to emulate what it does while building the result
     within a single matrix, instead of having multiple intermediate matrices.
+
+    We find the intersection from the labels alone, and then load each frame
+    once, copying its rows into place `block_rows` at a time. If
+    `memmap_filename` is given, the result is a memory-mapped .npy file
+    there, instead of an array in memory.
     """
-    # Each frame will be associated with a range of columns in our concatenated
-    # frame. As we scan through the frames, find out what the indices of those
-    # columns are.
-    frame_col_offsets = [0]
     assert len(frame_filenames) > 0
-    frame = load_hdf(frame_filenames[0])
-    ncolumns = frame.shape[1]
-
-    # Our label intersection starts out as the label set of the first frame.
-    label_intersection = set(frame.index)
 
-    # Narrow down the label intersection, and find the column offset of
-    # each subsequent frame.
-    for frame_filename in frame_filenames[1:]:
-        frame = load_hdf(frame_filename)
-        label_intersection &= set(frame.index)
-        frame_col_offsets.append(ncolumns)
-        ncolumns += frame.shape[1]
+    # Each frame will be associated with a range of columns in our concatenated
+    # frame. Find the labels that all the frames have, and the range of
+    # columns of each frame, without loading their vectors.
+    label_intersection = None
+    frame_col_offsets = [0]
+    for frame_filename in frame_filenames:
+        index = load_index(frame_filename)
+        if label_intersection is None:
+            label_intersection = index
+        else:
+            label_intersection = label_intersection.intersection(index)
+        width = len(load_index(frame_filename, axis=1))
+        frame_col_offsets.append(frame_col_offsets[-1] + width)
+        del index
 
     # Get the list of labels in a predictable order.
-    label_intersection = sorted(label for label in label_intersection)
+    label_intersection = label_intersection.sort_values()
     nrows = len(label_intersection)
+    ncolumns = frame_col_offsets[-1]
 
     # Now we know how many rows and columns of data we have, so allocate the
     # NumPy array that will contain our results.
-    joindata = np.zeros((nrows, ncolumns), 'f')
-
-    # Find the appropriate rows of each frame, extract them in the order of
-    # our labels, and set those as the appropriate columns of the merged array.
-    for frame_filename, offset in zip(frame_filenames, frame_col_offsets):
+    if memmap_filename is None:
+        joindata = np.zeros((nrows, ncolumns), 'f')
+    else:
+        joindata = np.lib.format.open_memmap(
+            memmap_filename, mode='w+', dtype='f', shape=(nrows, ncolumns)
+        )
+
+    # Find the row of each label in each frame, and copy those rows, in the
+    # order of our labels, into the appropriate columns of the merged array.
+    for frame_filename, col_from, col_to in zip(
+        frame_filenames, frame_col_offsets, frame_col_offsets[1:]
+    ):
         frame = load_hdf(frame_filename)
-        width = frame.shape[1]
-        for i, label in enumerate(label_intersection):
-            joindata[i, offset : (offset + width)] = frame.loc[label].values
-    del frame
+        rows = frame.index.get_indexer(label_intersection)
+        values = frame.values
+        for start in range(0, nrows, block_rows):
+            stop = start + block_rows
+            joindata[start:stop, col_from:col_to] = values[rows[start:stop]]
+        del frame, values
 
     # Convert the array to a DataFrame with the appropriate labels, and
     # return it.
@@ -77,7 +161,9 @@ def concat_intersect(frame_filenames):
     return joined
 
 
-def merge_intersect(frame_filenames, subsample=20, k=300):
+def merge_intersect(
+    frame_filenames, subsample=20, k=300, memmap_filename=None, oversample=10, power_iters=4
+):
     """
     Combine the vector knowledge contained in the frames over the vocabulary
     that they agree on, and use dimensionality reduction to mitigate the
@@ -86,10 +172,17 @@ def merge_intersect(frame_filenames, subsample=20, k=300):
     If their vocabularies result from retrofitting, then the resulting
     vocabulary will be the vocabulary of the retrofit knowledge graph,
     plus any other terms that happen to be in all of the frames.
+
+    If `memmap_filename` is given, the concatenated vectors are kept in a
+    memory-mapped file there while we work with them, and the file is
+    removed afterward.
+
+    The SVD is computed by `randomized_svd`, with the given amounts of
+    `oversample` and `power_iters`.
     """
     # Find the intersected vocabulary of the frames, and concatenate their
     # vectors over that vocabulary.
-    joined = concat_intersect(frame_filenames)
+    joined = concat_intersect(frame_filenames, memmap_filename=memmap_filename)
 
     # Find a subset of the labels that we'll use for calculating the
     # dimensionality-reduced version. The labels we particularly care about
@@ -116,7 +209,9 @@ def merge_intersect(frame_filenames, subsample=20, k=300):
     # a lower-dimensional space (`projected`), as well as the operator that
     # performs that projection (`projection`) and the relative weights of the
     # columns (`eigenvalues`).
-    projected, eigenvalues, projection = dataframe_svd_projection(adjusted, k)
+    projected, eigenvalues, projection = dataframe_svd_projection(
+        adjusted, k, oversample=oversample, power_iters=power_iters
+    )
 
     # We don't actually need this smaller matrix or its projection anymore;
     # what we learned is how to project _any_ matrix into this space.
@@ -127,6 +222,8 @@ def merge_intersect(frame_filenames, subsample=20, k=300):
     # `projection` operator.
     reprojected = joined.dot(projection)
     del joined
+    if memmap_filename is not None:
+        os.remove(memmap_filename)
 
     # `projection` (V) is an orthogonal matrix, so when we multiply by it, we
     # get a `reprojected` that approximately preserves distances (U * Σ).
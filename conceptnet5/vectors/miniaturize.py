@@ -6,6 +6,7 @@ from conceptnet5.languages import CORE_LANGUAGES
 from conceptnet5.uri import split_uri
 
 from .debias import de_bias_frame
+from .merge import randomized_svd
 
 
 def term_freq(term):
@@ -63,9 +64,9 @@ def miniaturize(frame, other_vocab=None, k=300, debias=True):
 
     vocab = vocab1 + extra_vocab
     smaller = frame.loc[vocab]
-    U, _S, _Vt = np.linalg.svd(smaller, full_matrices=False)
+    U, _S, _Vt = randomized_svd(smaller.values, k)
     del smaller, _S, _Vt, vocab1, extra_vocab, vocab_set
-    redecomposed = pd.DataFrame(U[:, :k], index=vocab, dtype='f')
+    redecomposed = pd.DataFrame(U, index=vocab, dtype='f')
     del U, vocab
     if debias:
         de_bias_frame(redecomposed)
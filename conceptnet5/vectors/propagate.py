@@ -6,14 +6,14 @@ reduced graph.
 
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from scipy.sparse import diags
 
 from conceptnet5.builders.reduce_assoc import ConceptNetAssociationGraph
 from conceptnet5.uri import get_uri_language
 from conceptnet5.vectors import replace_numbers
 
-from .formats import load_hdf, save_hdf
-from .sparse_matrix_builder import SparseMatrixBuilder
+from .formats import load_columns, load_index, save_hdf
 
 
 class ConceptNetAssociationGraphForPropagation(ConceptNetAssociationGraph):
@@ -22,22 +22,15 @@ class ConceptNetAssociationGraphForPropagation(ConceptNetAssociationGraph):
     the full graph of a set of associations as required for propagation.
     """
 
-    def __init__(self):
-        super().__init__()
-        self.edges = set()
-
     def add_edge(self, left, right, value, dataset, relation):
         """
-        In addition to the superclass's handling of a new edge,
-        saves the edges as a set of (left, right) pairs.
+        Adds the edge between the URIs standardized as vector-space labels.
         """
         # Use URIs that have the additional standardization for vector-space labels,
         # replacing sequences of digits with the # sign.
         left = replace_numbers(left)
         right = replace_numbers(right)
         super().add_edge(left, right, value, dataset, relation)
-        self.edges.add((left, right))
-        self.edges.add((right, left))  # save undirected edges
 
 
 def sharded_propagate(
@@ -46,29 +39,19 @@ def sharded_propagate(
     """
     A wrapper around propagate which reduces memory requirements by
     splitting the embedding into shards (along the dimensions of the
-    embedding feature space).
+    embedding feature space). Only the columns of one shard are read from
+    disk at a time.
     """
-    # frame_box is basically a reference to a single large DataFrame. The
-    # DataFrame will at times be present or absent. When it's present, the list
-    # contains one item, which is the DataFrame. When it's absent, the list
-    # is empty.
-    frame_box = [load_hdf(embedding_filename)]
     adjacency_matrix, combined_index, n_new_english = make_adjacency_matrix(
-        assoc_filename, frame_box[0].index
+        assoc_filename, load_index(embedding_filename)
     )
-    shard_width = frame_box[0].shape[1] // nshards
+    shard_width = len(load_index(embedding_filename, axis=1)) // nshards
 
     for i in range(nshards):
         temp_filename = output_filename + '.shard%d' % i
         shard_from = shard_width * i
         shard_to = shard_from + shard_width
-        if len(frame_box) == 0:
-            frame_box.append(load_hdf(embedding_filename))
-        embedding_shard = pd.DataFrame(frame_box[0].iloc[:, shard_from:shard_to])
-
-        # Delete full_dense_frame while running retrofitting, because it takes
-        # up a lot of memory and we can reload it from disk later.
-        frame_box.clear()
+        embedding_shard = load_columns(embedding_filename, shard_from, shard_to)
 
         propagated = propagate(
             combined_index,
@@ -77,7 +60,8 @@ def sharded_propagate(
             n_new_english,
             iterations=iterations,
         )
-        save_hdf(propagated, temp_filename)
+        del embedding_shard
+        save_hdf(propagated, temp_filename, chunked=True)
         del propagated
 
 
@@ -104,21 +88,7 @@ def make_adjacency_matrix(assoc_filename, embedding_vocab):
     graph = ConceptNetAssociationGraphForPropagation.from_csv(
         assoc_filename, reject_negative_relations=False
     )
-    component_labels = graph.find_components()
-
-    # Get the labels of components that overlap the embedding vocabulary.
-    good_component_labels = set(
-        label for term, label in component_labels.items() if term in embedding_vocab
-    )
-
-    # Now get the concepts in those components.
-    good_concepts = set(
-        term
-        for term, label in component_labels.items()
-        if label in good_component_labels
-    )
-
-    del component_labels, good_component_labels
+    good_vertices = graph.good_vertices(embedding_vocab)
 
     # Put terms from the embedding first, then terms from the good part
     # of the graph neither from the embedding nor in English, then terms
@@ -127,7 +97,9 @@ def make_adjacency_matrix(assoc_filename, embedding_vocab):
     # (In the corner case where either of these addtional sets of terms is
     # empty, construction of a pandas index will fail using generator rather
     # than list comprehensions.)
-    new_vocab = good_concepts - set(embedding_vocab)
+    vertices = graph.vertex_ids.to_index()
+    new_vocab = vertices[good_vertices & ~vertices.isin(embedding_vocab)]
+    del vertices, good_vertices
     good_concepts = embedding_vocab.append(
         pd.Index([term for term in new_vocab if get_uri_language(term) != 'en'])
     )
@@ -138,8 +110,6 @@ def make_adjacency_matrix(assoc_filename, embedding_vocab):
     del new_vocab
     n_new_english = len(good_concepts) - n_good_concepts_not_new_en
 
-    good_concepts_map = {term: i for i, term in enumerate(good_concepts)}
-
     # Convert the good part of the graph to an adjacency matrix representation.
 
     # Note: the edges added differ slightly from the way it is done in (e.g.)
@@ -150,19 +120,25 @@ def make_adjacency_matrix(assoc_filename, embedding_vocab):
     # build_from_conceptnet_table), so it doesn't matter, but in the future
     # we may want to add such edges here as well.
 
-    builder = SparseMatrixBuilder()
-    for v, w in graph.edges:
-        try:
-            index0 = good_concepts_map[v]
-            index1 = good_concepts_map[w]
-            builder[index0, index1] = 1
-        except KeyError:
-            pass  # one of v, w wasn't good
+    # Renumber the graph's vertices to their positions in good_concepts, and
+    # keep only the edges between two good vertices.
+    vertex_ids = graph.vertex_ids.ids_of(good_concepts)
+    new_ids = np.full(len(graph.vertex_ids), -1, dtype=np.int32)
+    in_graph = vertex_ids >= 0
+    new_ids[vertex_ids[in_graph]] = np.flatnonzero(in_graph)
+    graph_adjacency = graph.adjacency_matrix().tocoo()
     del graph
 
-    adjacency_matrix = builder.tocsr(
-        shape=(len(good_concepts), len(good_concepts)), dtype=np.int8
-    )
+    rows = new_ids[graph_adjacency.row]
+    cols = new_ids[graph_adjacency.col]
+    good_edges = (rows >= 0) & (cols >= 0)
+    adjacency_matrix = sparse.coo_matrix(
+        (
+            np.ones(np.count_nonzero(good_edges), dtype=np.int8),
+            (rows[good_edges], cols[good_edges]),
+        ),
+        shape=(len(good_concepts), len(good_concepts)),
+    ).tocsr()
 
     return adjacency_matrix, good_concepts, n_new_english
 
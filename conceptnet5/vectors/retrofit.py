@@ -1,10 +1,20 @@
+import multiprocessing
+import os
+import tempfile
+
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.preprocessing import normalize
 
-from .formats import load_hdf, save_hdf
+from .formats import load_columns, load_index, load_rows, save_hdf
 from .sparse_matrix_builder import build_from_conceptnet_table
 
+# The state that each worker process retrofits its shards with: the labels
+# of the rows, and the sparse matrix, mapped from the files that the parent
+# process saved it in
+_WORKER_STATE = {}
+
 
 def sharded_retrofit(
     dense_hdf_filename,
@@ -15,53 +25,139 @@ def sharded_retrofit(
     verbosity=0,
     max_cleanup_iters=20,
     orig_vec_weight=0.15,
+    processes=1,
 ):
-    # frame_box is basically a reference to a single large DataFrame. The
-    # DataFrame will at times be present or absent. When it's present, the list
-    # contains one item, which is the DataFrame. When it's absent, the list
-    # is empty.
-    frame_box = [load_hdf(dense_hdf_filename)]
+    """
+    Retrofit the vectors in `dense_hdf_filename` to the ConceptNet graph in
+    `conceptnet_filename`, a shard of their columns at a time, to save
+    memory. Each shard is saved to `output_filename` plus '.shard<n>', to be
+    put back together by `join_shards`. Only the columns of one shard are
+    read from disk at a time.
+
+    The shards don't depend on each other, so with `processes` greater than
+    1, that many shards are retrofitted at once in a pool of processes. The
+    processes share one copy of the sparse matrix, through files that they
+    memory-map, but each one needs the memory for retrofitting its own shard.
+    """
+    orig_index = load_index(dense_hdf_filename)
     sparse_csr, combined_index = build_from_conceptnet_table(
-        conceptnet_filename, orig_index=frame_box[0].index
+        conceptnet_filename, orig_index=orig_index
     )
-    shard_width = frame_box[0].shape[1] // nshards
-
-    for i in range(nshards):
-        temp_filename = output_filename + '.shard%d' % i
-        shard_from = shard_width * i
-        shard_to = shard_from + shard_width
-        if len(frame_box) == 0:
-            frame_box.append(load_hdf(dense_hdf_filename))
-        dense_frame = pd.DataFrame(frame_box[0].iloc[:, shard_from:shard_to])
-
-        # Delete full_dense_frame while running retrofitting, because it takes
-        # up a lot of memory and we can reload it from disk later.
-        frame_box.clear()
-
-        retrofitted = retrofit(
-            combined_index,
-            dense_frame,
-            sparse_csr,
+    del orig_index
+    shard_width = len(load_index(dense_hdf_filename, axis=1)) // nshards
+    shards = [
+        (
+            dense_hdf_filename,
+            output_filename + '.shard%d' % i,
+            shard_width * i,
+            shard_width * (i + 1),
             iterations,
             verbosity,
             max_cleanup_iters,
             orig_vec_weight,
         )
-        save_hdf(retrofitted, temp_filename)
-        del retrofitted
-
-
-def join_shards(output_filename, nshards=6, sort=False):
-    joined_matrix = None
-    joined_labels = None
-    for i in range(nshards):
-        shard = load_hdf(output_filename + '.shard%d' % i)
-        nrows, ncols = shard.shape
-        if joined_matrix is None:
-            joined_matrix = np.zeros((nrows, ncols * nshards), dtype='f')
-            joined_labels = shard.index
-        joined_matrix[:, (ncols * i) : (ncols * (i + 1))] = shard.values
-        del shard
+        for i in range(nshards)
+    ]
+
+    if processes <= 1:
+        _WORKER_STATE['row_labels'] = combined_index
+        _WORKER_STATE['sparse_csr'] = sparse_csr
+        try:
+            for shard in shards:
+                _retrofit_shard(*shard)
+        finally:
+            _WORKER_STATE.clear()
+        return
+
+    # Keep the shared matrix next to the output, where there's room for it
+    output_dir = os.path.dirname(os.path.abspath(output_filename))
+    with tempfile.TemporaryDirectory(dir=output_dir) as matrix_dir:
+        save_shared_csr(sparse_csr, matrix_dir)
+        del sparse_csr
+        with multiprocessing.Pool(
+            processes,
+            initializer=_init_worker,
+            initargs=(combined_index, matrix_dir),
+        ) as pool:
+            pool.starmap(_retrofit_shard, shards, chunksize=1)
+
+
+def save_shared_csr(sparse_csr, dirname):
+    """
+    Save the arrays of a sparse CSR matrix as .npy files in `dirname`, so
+    that other processes can share them with `load_shared_csr`.
+    """
+    np.save(os.path.join(dirname, 'shape.npy'), np.array(sparse_csr.shape))
+    for name in ('data', 'indices', 'indptr'):
+        np.save(os.path.join(dirname, name + '.npy'), getattr(sparse_csr, name))
+
+
+def load_shared_csr(dirname):
+    """
+    Get the sparse CSR matrix that `save_shared_csr` saved, with its arrays
+    memory-mapped read-only from the files, so that all the processes that
+    load it share the same pages of memory.
+    """
+    shape = tuple(np.load(os.path.join(dirname, 'shape.npy')))
+    data, indices, indptr = [
+        np.load(os.path.join(dirname, name + '.npy'), mmap_mode='r')
+        for name in ('data', 'indices', 'indptr')
+    ]
+    return sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+
+def _init_worker(row_labels, matrix_dir):
+    _WORKER_STATE['row_labels'] = row_labels
+    _WORKER_STATE['sparse_csr'] = load_shared_csr(matrix_dir)
+
+
+def _retrofit_shard(
+    dense_hdf_filename,
+    shard_filename,
+    shard_from,
+    shard_to,
+    iterations,
+    verbosity,
+    max_cleanup_iters,
+    orig_vec_weight,
+):
+    """
+    Retrofit one shard of columns, using the row labels and sparse matrix
+    in `_WORKER_STATE`, and save it to `shard_filename`.
+    """
+    dense_frame = load_columns(dense_hdf_filename, shard_from, shard_to)
+    retrofitted = retrofit(
+        _WORKER_STATE['row_labels'],
+        dense_frame,
+        _WORKER_STATE['sparse_csr'],
+        iterations,
+        verbosity,
+        max_cleanup_iters,
+        orig_vec_weight,
+    )
+    del dense_frame
+    save_hdf(retrofitted, shard_filename, chunked=True)
+
+
+def join_shards(output_filename, nshards=6, sort=False, block_rows=100000):
+    """
+    Put the shards of a frame that were saved by `sharded_retrofit` or
+    `sharded_propagate` back together, normalize its rows, and save it to
+    `output_filename`. The shards are copied in blocks of `block_rows` rows,
+    so only the joined matrix has to fit in memory.
+    """
+    shard_filenames = [output_filename + '.shard%d' % i for i in range(nshards)]
+    joined_labels = load_index(shard_filenames[0])
+    shard_widths = [len(load_index(filename, axis=1)) for filename in shard_filenames]
+    col_offsets = np.cumsum([0] + shard_widths)
+    joined_matrix = np.zeros((len(joined_labels), col_offsets[-1]), dtype='f')
+    for i, filename in enumerate(shard_filenames):
+        for start in range(0, len(joined_labels), block_rows):
+            block = load_rows(filename, start, start + block_rows)
+            joined_matrix[
+                start : start + len(block), col_offsets[i] : col_offsets[i + 1]
+            ] = block.values
+            del block
 
     normalize(joined_matrix, axis=1, norm='l2', copy=False)
     dframe = pd.DataFrame(joined_matrix, index=joined_labels)
@@ -1,5 +1,8 @@
+import os
+import tempfile
 from collections import defaultdict
 
+import numpy as np
 import pandas as pd
 from scipy import sparse
 from sklearn.preprocessing import normalize
@@ -10,19 +13,90 @@ from conceptnet5.uri import get_uri_language, uri_prefix, uri_prefixes
 from ordered_set import OrderedSet
 
 from ..vectors import replace_numbers
+from .interning import Interner
+
+# The number of entries SparseMatrixBuilder keeps as Python objects before
+# converting them to NumPy arrays, and the number of entries in each chunk
+# that it can spill to disk
+BUILDER_BUFFER_SIZE = 1 << 16
+BUILDER_CHUNK_SIZE = 1 << 22
 
 
 class SparseMatrixBuilder:
     """
     SparseMatrixBuilder is a utility class that helps build a matrix of
     unknown shape.
+
+    Only the most recent entries are kept in Python lists; every
+    `BUILDER_BUFFER_SIZE` entries they are packed into NumPy arrays of 4-byte
+    indices and 8-byte values, and those are grouped into chunks of
+    `chunk_size` entries. If `spill_dir` is given, finished chunks are
+    written to a temporary directory inside it until the matrix is built.
+    Entries added more than once at the same position are summed.
     """
 
-    def __init__(self):
+    def __init__(self, chunk_size=BUILDER_CHUNK_SIZE, spill_dir=None):
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.pieces = []
+        self.n_pending = 0
+        self.spill = None
+        if spill_dir is not None:
+            self.spill = tempfile.TemporaryDirectory(
+                prefix='sparse-builder-', dir=str(spill_dir)
+            )
+        self._new_buffer()
+
+    def _new_buffer(self):
         self.row_index = []
         self.col_index = []
         self.values = []
 
+    def _flush_buffer(self):
+        if self.values:
+            self._add_piece(
+                np.array(self.row_index, dtype=np.intc),
+                np.array(self.col_index, dtype=np.intc),
+                np.array(self.values, dtype=np.float64),
+            )
+            self._new_buffer()
+
+    def _add_piece(self, rows, cols, vals):
+        self.pieces.append((rows, cols, vals))
+        self.n_pending += len(vals)
+        if self.n_pending >= self.chunk_size:
+            self._finish_chunk()
+
+    def _finish_chunk(self):
+        if not self.pieces:
+            return
+        chunk = tuple(np.concatenate(parts) for parts in zip(*self.pieces))
+        self.pieces = []
+        self.n_pending = 0
+        if self.spill is not None:
+            filename = os.path.join(self.spill.name, 'chunk%d.npz' % len(self.chunks))
+            np.savez(filename, rows=chunk[0], cols=chunk[1], values=chunk[2])
+            chunk = filename
+        self.chunks.append(chunk)
+
+    def _load_chunks(self):
+        for chunk in self.chunks:
+            if isinstance(chunk, str):
+                with np.load(chunk) as saved:
+                    yield saved['rows'], saved['cols'], saved['values']
+            else:
+                yield chunk
+
+    def __len__(self):
+        total = len(self.values) + self.n_pending
+        for chunk in self.chunks:
+            if isinstance(chunk, str):
+                with np.load(chunk) as saved:
+                    total += len(saved['values'])
+            else:
+                total += len(chunk[2])
+        return total
+
     def __setitem__(self, key, val):
         row, col = key
         self.add(row, col, val)
@@ -31,12 +105,52 @@ class SparseMatrixBuilder:
         self.row_index.append(row)
         self.col_index.append(col)
         self.values.append(val)
+        if len(self.values) >= BUILDER_BUFFER_SIZE:
+            self._flush_buffer()
+
+    def add_many(self, rows, cols, vals):
+        """
+        Add a batch of entries at once, given as equal-length sequences of
+        row indices, column indices and values. `vals` can also be a single
+        value to use for every entry.
+        """
+        self._flush_buffer()
+        rows = np.asarray(rows, dtype=np.intc)
+        cols = np.asarray(cols, dtype=np.intc)
+        vals = np.broadcast_to(np.asarray(vals, dtype=np.float64), rows.shape)
+        if len(rows):
+            self._add_piece(rows, cols, vals)
 
     def tocsr(self, shape, dtype=float):
+        """
+        Build a SciPy CSR matrix of the given shape from the entries, summing
+        entries that were added at the same position.
+        """
+        self._flush_buffer()
+        self._finish_chunk()
+        chunks = list(self._load_chunks())
+        if chunks:
+            rows, cols, values = [np.concatenate(parts) for parts in zip(*chunks)]
+        else:
+            rows = cols = np.zeros(0, dtype=np.intc)
+            values = np.zeros(0)
+        del chunks
         return sparse.coo_matrix(
-            (self.values, (self.row_index, self.col_index)), shape=shape, dtype=dtype
+            (values.astype(dtype, copy=False), (rows, cols)), shape=shape
         ).tocsr()
 
+    def close(self):
+        """
+        Discard the entries, and remove any chunks that were spilled to disk.
+        """
+        self.chunks = []
+        self.pieces = []
+        self.n_pending = 0
+        self._new_buffer()
+        if self.spill is not None:
+            self.spill.cleanup()
+            self.spill = None
+
 
 def build_from_conceptnet_table(filename, orig_index=(), self_loops=True):
     """
@@ -52,9 +166,8 @@ def build_from_conceptnet_table(filename, orig_index=(), self_loops=True):
     """
     mat = SparseMatrixBuilder()
 
-    labels = OrderedSet(orig_index)
+    labels = Interner(orig_index)
 
-    totals = defaultdict(float)
     with open(str(filename), encoding='utf-8') as infile:
         for line in infile:
             concept1, concept2, value_str, dataset, relation = line.strip().split('\t')
@@ -65,30 +178,30 @@ def build_from_conceptnet_table(filename, orig_index=(), self_loops=True):
 
             mat[index1, index2] = value
             mat[index2, index1] = value
-            totals[index1] += value
-            totals[index2] += value
 
     # Link nodes to their more general versions
-    for label in labels:
+    children = []
+    parents = []
+    for index1, label in enumerate(labels):
         prefixes = list(uri_prefixes(label, 3))
         if len(prefixes) >= 2:
-            parent_uri = prefixes[-2]
-            if parent_uri in labels:
-                index1 = labels.index(label)
-                index2 = labels.index(parent_uri)
-                mat[index1, index2] = 1
-                mat[index2, index1] = 1
-                totals[index1] += 1
-                totals[index2] += 1
+            index2 = labels.get(prefixes[-2])
+            if index2 is not None:
+                children.append(index1)
+                parents.append(index2)
+    mat.add_many(children, parents, 1)
+    mat.add_many(parents, children, 1)
+
+    shape = (len(labels), len(labels))
+    index = labels.to_index()
+    del labels
+    matrix = mat.tocsr(shape)
+    del mat
 
     # add self-loops on the diagonal with equal weight to the rest of the row
     if self_loops:
-        for key, value in totals.items():
-            mat[key, key] = value
-
-    shape = (len(labels), len(labels))
-    index = pd.Index(labels)
-    return normalize(mat.tocsr(shape), norm='l1', axis=1), index
+        matrix = matrix + sparse.diags(np.asarray(matrix.sum(axis=1)).ravel(), format='csr')
+    return normalize(matrix, norm='l1', axis=1), index
 
 
 def build_features_from_conceptnet_table(filename):
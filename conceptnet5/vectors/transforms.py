@@ -1,57 +1,115 @@
+import functools
+import multiprocessing
+import os
+
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.preprocessing import normalize
 
-from conceptnet5.language.lemmatize import lemmatize_uri
+from conceptnet5.language.lemmatize import lemmatize_uris
 from conceptnet5.uri import get_uri_language, uri_prefix
 from conceptnet5.vectors import standardized_uri
 
 
-def standardize_row_labels(frame, language='en', forms=True):
+# Frames with at least this many distinct row labels have them standardized
+# by a pool of processes
+PARALLEL_MIN_LABELS = 100000
+
+
+def _standardized_label(language, label, bare_terms=False):
+    """
+    Get the standardized term URI for one row label. With `bare_terms`, the
+    label has the form 'en/term', which gives its own language.
+    """
+    if bare_terms:
+        language, _slash, label = label.partition('/')
+        label = uri_prefix(standardized_uri(language, label))
+    return uri_prefix(standardized_uri(language, label))
+
+
+def _standardized_labels(language, bare_terms, labels):
+    return [_standardized_label(language, label, bare_terms) for label in labels]
+
+
+def standardized_labels(labels, language='en', bare_terms=False, processes=1):
+    """
+    Get the standardized term URIs for a sequence of distinct row labels, as
+    `standardize_row_labels` would. When there are at least
+    PARALLEL_MIN_LABELS of them and `processes` is more than 1, they're
+    divided among that many processes. `processes=None` uses one per CPU.
+    """
+    labels = list(labels)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1 or len(labels) < PARALLEL_MIN_LABELS:
+        return _standardized_labels(language, bare_terms, labels)
+
+    chunk_size = -(-len(labels) // (processes * 4))
+    chunks = [labels[i : i + chunk_size] for i in range(0, len(labels), chunk_size)]
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(
+            functools.partial(_standardized_labels, language, bare_terms), chunks
+        )
+    return [uri for chunk in results for uri in chunk]
+
+
+def standardize_row_labels(frame, language='en', forms=True, processes=1):
     """
     Convert a frame whose row labels are bare English terms (e.g. of the
     form 'en/term') to one whose row labels are standardized ConceptNet URIs
     (e.g. of the form '/c/en/term'; and with some extra word2vec-style
     normalization of digits). Rows whose labels get the same standardized
     URI get combined, with earlier rows given more weight.
+
+    Each distinct label is standardized once, using `processes` processes
+    for large frames, and the rows are combined with sparse matrix
+    arithmetic.
     """
     # Check for en/term format we use to train fastText on OpenSubtitles data
-    if all(label.count('/') == 1 for label in frame.index[0:5]):
-        tuples = [label.partition('/') for label in frame.index]
-        frame.index = [
-            uri_prefix(standardized_uri(language, text))
-            for language, _slash, text in tuples
-        ]
-
-    # Re-label the DataFrame with standardized, non-unique row labels
-    frame.index = [
-        uri_prefix(standardized_uri(language, label)) for label in frame.index
-    ]
+    bare_terms = all(label.count('/') == 1 for label in frame.index[0:5])
 
-    # Assign row n a weight of 1/(n+1) for weighted averaging
+    # Find the standardized, sorted group label of each row
+    label_codes, unique_labels = pd.factorize(frame.index)
+    standardized = standardized_labels(unique_labels, language, bare_terms, processes)
+    group_labels, unique_groups = np.unique(
+        np.array(standardized, dtype=object), return_inverse=True
+    )
+    row_groups = unique_groups[label_codes]
+
+    # Assign row n a weight of 1/(n+1) for weighted averaging, and add up the
+    # weighted rows that have the same label
     nrows = frame.shape[0]
+    ngroups = len(group_labels)
     weights = 1.0 / np.arange(1, nrows + 1)
-    label_weights = pd.Series(weights, index=frame.index)
-
-    # groupby(level=0).sum() means to add rows that have the same label
-    relabeled = frame.mul(weights, axis='rows').sort_index().groupby(level=0).sum()
-    combined_weights = label_weights.sort_index().groupby(level=0).sum()
+    grouping = sparse.csr_matrix(
+        (weights, (row_groups, np.arange(nrows))), shape=(ngroups, nrows)
+    )
+    relabeled = grouping @ frame.values
+    combined_weights = np.bincount(row_groups, weights=weights, minlength=ngroups)
 
-    # Optionally adjust words to be more like their word forms
+    # Optionally adjust words to be more like their word forms, by adding
+    # half of each word's vector and weight to its lemma, if we have it
     if forms:
-        for label in relabeled.index:
-            lemmatized = lemmatize_uri(label)
-            if lemmatized != label and lemmatized in relabeled.index:
-                relabeled.loc[lemmatized] += relabeled.loc[label] / 2
-                combined_weights.loc[lemmatized] += combined_weights.loc[label] / 2
-
-    scaled = relabeled.div(combined_weights, axis='rows')
+        lemmas = pd.Index(group_labels).get_indexer(lemmatize_uris(group_labels))
+        inflected = np.flatnonzero((lemmas >= 0) & (lemmas != np.arange(ngroups)))
+        to_lemmas = sparse.csr_matrix(
+            (np.full(len(inflected), 0.5), (lemmas[inflected], inflected)),
+            shape=(ngroups, ngroups),
+        )
+        relabeled += to_lemmas @ relabeled
+        combined_weights += to_lemmas @ combined_weights
+
+    scaled = pd.DataFrame(
+        relabeled / combined_weights[:, np.newaxis],
+        index=pd.Index(group_labels),
+        columns=frame.columns,
+    )
 
     # Rearrange the items in descending order of weight, similar to the order
     # we get them in from word2vec and GloVe
-    combined_weights.sort_values(inplace=True, ascending=False)
-    result = scaled.loc[combined_weights.index]
-    return result
+    order = pd.Series(combined_weights).sort_values(ascending=False).index
+    return scaled.take(order)
 
 
 def l1_normalize_columns(frame):
@@ -1,18 +1,22 @@
 """
 This file sets up Flask to serve the ConceptNet 5 API in JSON-LD format.
 """
+import json
 import os
 
 import flask
+import msgpack
 from flask_cors import CORS
 from flask_limiter import Limiter
 
 from conceptnet5 import api as responses
 from conceptnet5.api import VALID_KEYS, error
 from conceptnet5.nodes import standardized_concept_uri
+from conceptnet_web.caching import configure_caching
 from conceptnet_web.error_logging import try_configuring_sentry
 from conceptnet_web.filters import FILTERS
 from conceptnet_web.json_rendering import jsonify
+from conceptnet_web.metrics import configure_metrics
 
 # Configuration
 
@@ -37,11 +41,26 @@ app.config.update({
 for filter_name, filter_func in FILTERS.items():
     app.jinja_env.filters[filter_name] = filter_func
 app.jinja_env.add_extension('jinja2_highlight.HighlightExtension')
+configure_metrics(app)
 limiter = Limiter(app, global_limits=["600 per minute", "6000 per hour"])
 CORS(app)
 try_configuring_sentry(app)
+configure_caching(app, uncacheable={'query_random_walks', 'fake_error', 'metrics'})
 application = app  # for uWSGI
 
+# Loading the graph of terms that /path searches takes a while with the full
+# ConceptNet in PostgreSQL, so start it when the app starts, instead of
+# during the first request. Set CONCEPTNET_PRELOAD_PATHS=0 to turn this off.
+if os.environ.get('CONCEPTNET_PRELOAD_PATHS', '1') == '1':
+    responses.FINDER.preload_node_graph()
+
+
+# The formats that /export can stream edges in, and their content types
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'msgpack': 'application/x-msgpack',
+}
+
 
 def get_int(args, key, default, minimum, maximum):
     strvalue = args.get(key, default)
@@ -84,6 +103,51 @@ def query():
     return jsonify(results)
 
 
+@app.route('/export')
+@limiter.limit("10 per minute")
+def export_edges():
+    """
+    Stream all the edges matching the query criteria, as newline-delimited
+    JSON or as a stream of msgpack values, without pagination.
+    """
+    req_args = flask.request.args
+    criteria = {key: req_args[key] for key in req_args if key in VALID_KEYS}
+    export_format = req_args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return render_error(400, "'format' should be 'ndjson' or 'msgpack'.")
+    edges = responses.query_stream(criteria)
+    if isinstance(edges, dict):
+        return jsonify(edges, status=edges['error']['status'])
+
+    if export_format == 'msgpack':
+        packer = msgpack.Packer()
+        encoded = (packer.pack(edge) for edge in edges)
+    else:
+        encoded = (
+            json.dumps(edge, ensure_ascii=False, sort_keys=True).encode('utf-8') + b'\n'
+            for edge in edges
+        )
+    return flask.Response(
+        flask.stream_with_context(batched_bytes(encoded)),
+        mimetype=EXPORT_FORMATS[export_format],
+    )
+
+
+def batched_bytes(pieces, batch_size=1000):
+    """
+    Join an iterator of bytestrings into larger chunks, so that a streaming
+    response isn't written one small piece at a time.
+    """
+    batch = []
+    for piece in pieces:
+        batch.append(piece)
+        if len(batch) >= batch_size:
+            yield b''.join(batch)
+            batch = []
+    if batch:
+        yield b''.join(batch)
+
+
 @app.route('/uri')
 @app.route('/normalize')
 @app.route('/standardize')
@@ -136,6 +200,45 @@ def query_relatedness():
     return jsonify(result)
 
 
+@app.route('/neighborhood/<path:uri>')
+@limiter.limit("60 per minute")
+def query_neighborhood(uri):
+    req_args = flask.request.args
+    uri = '/' + uri.rstrip('/ ')
+    hops = get_int(req_args, 'hops', 2, 1, 3)
+    limit = get_int(req_args, 'limit', 20, 1, 100)
+    rel = req_args.get('rel')
+    results = responses.query_neighborhood(uri, hops=hops, limit=limit, rel=rel)
+    return jsonify(results)
+
+
+@app.route('/walks/<path:uri>')
+@limiter.limit("60 per minute")
+def query_random_walks(uri):
+    req_args = flask.request.args
+    uri = '/' + uri.rstrip('/ ')
+    length = get_int(req_args, 'length', 3, 1, 10)
+    walks = get_int(req_args, 'walks', 10, 1, 100)
+    rel = req_args.get('rel')
+    results = responses.query_random_walks(uri, length=length, walks=walks, rel=rel)
+    return jsonify(results)
+
+
+@app.route('/path')
+@limiter.limit("60 per minute")
+def query_path():
+    req_args = flask.request.args
+    node1 = req_args.get('node1')
+    node2 = req_args.get('node2')
+    rels = req_args.getlist('rel') or None
+    max_depth = get_int(req_args, 'max_depth', 4, 1, 6)
+    weighted = req_args.get('weighted', 'true').lower() == 'true'
+    result = responses.query_path(
+        node1, node2, rels=rels, max_depth=max_depth, weighted=weighted
+    )
+    return jsonify(result)
+
+
 @app.errorhandler(IOError)
 @app.errorhandler(MemoryError)
 def error_data_unavailable(e):
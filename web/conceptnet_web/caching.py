@@ -0,0 +1,145 @@
+"""
+HTTP caching for the Flask apps. Responses get an ETag that's derived from
+the version of the data and the normalized request, so a client or CDN that
+already has a response can revalidate it with If-None-Match and get a 304,
+without us looking anything up.
+"""
+import datetime
+import hashlib
+import json
+import os
+
+import flask
+import psycopg2
+
+from conceptnet5 import __version__ as VERSION
+from conceptnet5.db.config import GRAPH_STORE
+from conceptnet5.db.connection import separate_connection
+from conceptnet5.db.schema import get_build_info
+from conceptnet_web.compression import cached_response, compress_response
+from conceptnet_web.json_rendering import request_wants_json
+from conceptnet_web.lru import CACHE_LOOKUPS
+
+
+def _data_build():
+    """
+    Get the version of the data being served and the time it was built, if
+    we know them, as a pair that's (None, None) if we don't.
+
+    For a graph store, the time is when the file was written. In
+    PostgreSQL, both are recorded by `cn5-db load_data` and `load_delta`.
+    """
+    if GRAPH_STORE:
+        if not os.path.exists(GRAPH_STORE):
+            return None, None
+        mtime = int(os.path.getmtime(GRAPH_STORE))
+        modified = datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc)
+        return '{}-{}'.format(VERSION, mtime), modified
+
+    try:
+        with separate_connection() as connection:
+            build_info = get_build_info(connection)
+    except psycopg2.Error:
+        build_info = None
+    if build_info is None:
+        return None, None
+    version, built = build_info
+    return version, built.astimezone(datetime.timezone.utc).replace(microsecond=0)
+
+
+# The version of the data we're serving, which all the ETags change with. It
+# falls back on the code version when the data doesn't record one, as in a
+# database built by an earlier version. Set CONCEPTNET_BUILD_VERSION to
+# override it.
+DATA_VERSION, DATA_MODIFIED = _data_build()
+BUILD_VERSION = os.environ.get('CONCEPTNET_BUILD_VERSION') or DATA_VERSION or VERSION
+
+# How long (in seconds) clients and caches can use a response before
+# revalidating it. Set CONCEPTNET_CACHE_MAX_AGE=0 to turn off ETags, caching
+# headers, and the caches of responses entirely.
+CACHE_MAX_AGE = int(os.environ.get('CONCEPTNET_CACHE_MAX_AGE', '3600'))
+
+
+def request_etag():
+    """
+    Make the ETag of the response to the current request, from the data
+    version, the path, the sorted query parameters, and whether the request
+    gets JSON or HTML.
+    """
+    request = flask.request
+    key = json.dumps(
+        [
+            BUILD_VERSION,
+            request.path,
+            sorted(request.args.items(multi=True)),
+            request_wants_json(),
+        ]
+    )
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def add_cache_headers(response, etag):
+    # A compressed response is a different representation than the
+    # uncompressed one, so it gets a weak ETag, as other servers do
+    response.set_etag(etag, weak='Content-Encoding' in response.headers)
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_MAX_AGE
+    if DATA_MODIFIED is not None:
+        response.last_modified = DATA_MODIFIED
+    response.vary.add('Accept')
+    return response
+
+
+def is_fresh(etag):
+    """
+    Check whether the client already has the response to this request, by
+    the ETag it sent in If-None-Match, or, if it didn't send one, by the date
+    in If-Modified-Since.
+    """
+    request = flask.request
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if DATA_MODIFIED is not None and request.if_modified_since is not None:
+        return request.if_modified_since >= DATA_MODIFIED
+    return False
+
+
+def configure_caching(app, uncacheable=()):
+    """
+    Add ETags and Cache-Control headers to the successful GET responses of a
+    Flask app, and answer requests for responses the client already has with
+    304 Not Modified before the view function runs. Responses that we've
+    recently compressed are answered from `compression.COMPRESSED_CACHE`,
+    also without running the view function.
+
+    `uncacheable` is a collection of endpoint names whose responses change
+    from one request to the next, such as random results.
+
+    Responses are compressed whether or not they're cacheable.
+    """
+
+    @app.before_request
+    def check_not_modified():
+        request = flask.request
+        if CACHE_MAX_AGE <= 0 or request.method not in ('GET', 'HEAD'):
+            return None
+        if request.endpoint is None or request.endpoint in uncacheable:
+            return None
+        etag = request_etag()
+        flask.g.etag = etag
+        if request.if_none_match or request.if_modified_since is not None:
+            fresh = is_fresh(etag)
+            CACHE_LOOKUPS.inc(cache='client', result='hit' if fresh else 'miss')
+            if fresh:
+                return add_cache_headers(flask.Response(status=304), etag)
+        return cached_response(etag)
+
+    @app.after_request
+    def finish_response(response):
+        etag = flask.g.get('etag')
+        if response.status_code != 200:
+            etag = None
+        compress_response(response, etag)
+        if etag is not None:
+            add_cache_headers(response, etag)
+        return response
@@ -0,0 +1,98 @@
+"""
+Compress responses with brotli (if it's installed) or gzip, depending on
+what the client accepts. Compressed responses that have an ETag are cached,
+so a popular response is compressed once instead of on every request.
+"""
+import gzip
+
+import flask
+
+from conceptnet_web.lru import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this many bytes aren't worth compressing
+COMPRESS_MIN_SIZE = 1024
+
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/ld+json',
+    'application/javascript',
+    'text/css',
+    'text/html',
+    'text/plain',
+}
+
+# Compressed responses, by their ETag and encoding, up to this many bytes
+COMPRESSED_CACHE = LRUCache(128 * 1024 * 1024, name='compressed_responses')
+
+
+def choose_encoding():
+    """
+    Choose the best encoding that the client accepts, or None if it doesn't
+    accept one we can make.
+    """
+    accept = flask.request.accept_encodings
+    if brotli is not None and accept['br']:
+        return 'br'
+    if accept['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def cached_response(etag):
+    """
+    Get a response for the current request, whose ETag is `etag`, from the
+    cache of compressed responses, or None if it's not there.
+    """
+    encoding = choose_encoding()
+    if encoding is None:
+        return None
+    cached = COMPRESSED_CACHE.get((etag, encoding))
+    if cached is None:
+        return None
+    content_type, data = cached
+    response = flask.Response(data, content_type=content_type)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def compress_response(response, etag=None):
+    """
+    Compress a response in place, if it's big enough and the client accepts
+    compression. If it has an ETag, keep the compressed data in the cache.
+    """
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_TYPES
+    ):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    compressed = compress(data, encoding)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    if etag is not None:
+        COMPRESSED_CACHE.put(
+            (etag, encoding), (response.content_type, compressed), size=len(compressed)
+        )
+    return response
@@ -1,3 +1,4 @@
+import html
 import json
 import re
 
@@ -7,6 +8,58 @@ from pygments import highlight
 from pygments.formatters import HtmlFormatter
 from pygments.lexers import get_lexer_by_name
 
+from conceptnet_web.lru import LRUCache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Syntax highlighting is slow, so JSON longer than this is shown as plain
+# text, with links but without colors
+HIGHLIGHT_MAX_LENGTH = 200000
+
+# Rendered HTML pages, by the ETag of their request, up to this many
+# characters in total
+HTML_PAGE_CACHE = LRUCache(64 * 1024 * 1024, name='html_pages')
+
+
+def dumps_json(obj, pretty=False):
+    """
+    Convert an object to JSON text, with sorted keys and with non-ASCII
+    characters left as they are, indented by 2 spaces if `pretty` is True.
+
+    We use orjson if it's installed, which is much faster than the standard
+    library. Its output has no spaces after separators, but is otherwise the
+    same.
+    """
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, option=option).decode('utf-8')
+        except TypeError:
+            # orjson is stricter about types, such as keys that aren't
+            # strings, so let the standard library handle those
+            pass
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, sort_keys=True, indent=2)
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True)
+
+
+def htmlsafe_json(json_text):
+    """
+    Make JSON text safe to include in a <script> tag, in the same way as
+    Jinja's `tojson` filter.
+    """
+    return Markup(
+        json_text.replace('<', '\\u003c')
+        .replace('>', '\\u003e')
+        .replace('&', '\\u0026')
+        .replace("'", '\\u0027')
+    )
+
 
 def request_wants_json():
     """
@@ -55,10 +108,16 @@ FORMATTER = HtmlFormatter()
 
 def highlight_and_link_json(content):
     """
-    Given JSON text, syntax-highlight it and convert URLs to links.
+    Given JSON text, syntax-highlight it and convert URLs to links. Text
+    longer than HIGHLIGHT_MAX_LENGTH gets links, but not highlighting.
     """
-    html = highlight(content, LEXER, FORMATTER)
-    urlized_html = linker(html)
+    if len(content) > HIGHLIGHT_MAX_LENGTH:
+        # Escape the text the same way Pygments does, so `linker` works on it
+        escaped = html.escape(content, quote=False).replace('"', '&quot;').replace("'", '&#39;')
+        html_text = '<div class="highlight"><pre>{}</pre></div>'.format(escaped)
+    else:
+        html_text = highlight(content, LEXER, FORMATTER)
+    urlized_html = linker(html_text)
     return Markup(urlized_html)
 
 
@@ -67,17 +126,25 @@ def jsonify(obj, status=200):
     Our custom method for returning JSON, which either provides the raw JSON
     or fills in an HTML template with pretty, syntax-highlighted, linked JSON,
     depending on the requested content type.
+
+    Rendered HTML is cached by the ETag that `conceptnet_web.caching` assigns
+    to the request, because it's much slower to make than the JSON.
     """
     if flask.request is None or request_wants_json():
         return flask.Response(
-            json.dumps(obj, ensure_ascii=False, sort_keys=True),
+            dumps_json(obj),
             status=status,
             mimetype='application/json'
         )
     else:
-        pretty_json = json.dumps(obj, ensure_ascii=False, sort_keys=True, indent=2)
-        return flask.render_template(
-            'json.html',
-            json=pretty_json,
-            raw_object=obj
-        ), status
+        etag = flask.g.get('etag') if status == 200 else None
+        page = HTML_PAGE_CACHE.get(etag) if etag else None
+        if page is None:
+            page = flask.render_template(
+                'json.html',
+                json=dumps_json(obj, pretty=True),
+                raw_json=htmlsafe_json(dumps_json(obj))
+            )
+            if etag:
+                HTML_PAGE_CACHE.put(etag, page)
+        return page, status
@@ -0,0 +1,51 @@
+import threading
+from collections import OrderedDict
+
+from conceptnet5.metrics import counter
+
+CACHE_LOOKUPS = counter(
+    'conceptnet_cache_lookups_total', 'Lookups in in-memory caches, by cache and result'
+)
+
+
+class LRUCache(object):
+    """
+    A cache that keeps the most recently used values, up to a maximum total
+    size. The size of a value is its length, unless another size is given
+    when it's added. It's safe to use from multiple threads.
+
+    The hits and misses of a cache are counted in the metrics by its `name`.
+    """
+
+    def __init__(self, max_size, name='cache'):
+        self.max_size = max_size
+        self.name = name
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                CACHE_LOOKUPS.inc(cache=self.name, result='miss')
+                return default
+            self._items.move_to_end(key)
+            CACHE_LOOKUPS.inc(cache=self.name, result='hit')
+            return self._items[key][0]
+
+    def put(self, key, value, size=None):
+        if size is None:
+            size = len(value)
+        if size > self.max_size:
+            return
+        with self._lock:
+            if key in self._items:
+                self.size -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _key, (_value, old_size) = self._items.popitem(last=False)
+                self.size -= old_size
@@ -0,0 +1,42 @@
+"""
+Timing of requests to the Flask apps, and a /metrics endpoint that reports
+it along with the rest of `conceptnet5.metrics` in the Prometheus text
+format.
+"""
+import time
+
+import flask
+
+from conceptnet5.metrics import CONTENT_TYPE, histogram, render_metrics
+
+REQUEST_SECONDS = histogram(
+    'conceptnet_request_seconds', 'Time spent responding to requests, by endpoint and status'
+)
+
+
+def configure_metrics(app):
+    """
+    Time every request to a Flask app by its endpoint, and add the /metrics
+    endpoint. This should be set up before anything else that can answer a
+    request early, such as caching or rate limits, so those requests are
+    timed too.
+    """
+
+    @app.before_request
+    def start_timer():
+        flask.g.request_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = flask.g.get('request_start')
+        if start is not None:
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                endpoint=flask.request.endpoint or 'none',
+                status=response.status_code,
+            )
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return flask.Response(render_metrics(), content_type=CONTENT_TYPE)
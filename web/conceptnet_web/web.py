@@ -10,8 +10,10 @@ from conceptnet5 import api as responses
 from conceptnet5.languages import COMMON_LANGUAGES, get_language_name
 from conceptnet5.nodes import standardized_concept_uri
 from conceptnet5.uri import split_uri
+from conceptnet_web.caching import configure_caching
 from conceptnet_web.error_logging import try_configuring_sentry
 from conceptnet_web.filters import FILTERS
+from conceptnet_web.metrics import configure_metrics
 from conceptnet_web.relations import REL_HEADINGS
 
 # Configuration
@@ -30,8 +32,10 @@ app.config['RATELIMIT_ENABLED'] = os.environ.get('CONCEPTNET_RATE_LIMITING') ==
 
 for filter_name, filter_func in FILTERS.items():
     app.jinja_env.filters[filter_name] = filter_func
+configure_metrics(app)
 limiter = Limiter(app, global_limits=["600 per minute", "6000 per hour"])
 try_configuring_sentry(app)
+configure_caching(app, uncacheable={'fake_error', 'metrics'})
 application = app  # for uWSGI
 
 
@@ -26,5 +26,10 @@ setup(
         'limits', 'flask >= 0.12.3', 'flask-cors', 'flask-limiter',
         'langcodes >= 2.1', 'jinja2-highlight', 'pygments', 'raven[flask] >= 6.6'
     ],
+    extras_require={
+        # A faster JSON serializer and brotli compression, which are used if
+        # they're installed
+        'fast': ['orjson', 'brotli'],
+    },
     license = 'Apache License 2.0',
 )